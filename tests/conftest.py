@@ -0,0 +1,10 @@
+"""
+Общие настройки модульных тестов. Тесты проверяют чистые функции и не требуют БД,
+однако импорт пакета `webapi` читает настройки подключения из переменных окружения.
+"""
+
+import os
+
+for name, value in dict(POSTGRES_USER='postgres', POSTGRES_PASSWORD='postgres', POSTGRES_HOST='localhost',
+                        POSTGRES_PORT='5432', POSTGRES_DB='postgres').items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, request
+from flask_restful import Api, Resource
+
+from webapi import admission
+from webapi.admission import DEADLINE_ENVIRON_KEY, LIGHT, STREAMING, admission_control, init_admission
+from webapi.db_models import db
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = _Clock()
+    monkeypatch.setattr(admission.time, 'monotonic', fake_clock)
+    return fake_clock
+
+
+def test_token_bucket_allows_burst_then_refills(clock):
+    buckets = admission._TokenBuckets(rate=2, burst=3)
+    assert [buckets.take('a') for _ in range(3)] == [0, 0, 0]
+    assert buckets.take('a') == pytest.approx(0.5)
+    # Другие ключи не затрагиваются.
+    assert buckets.take('b') == 0
+    clock.now += 0.5
+    assert buckets.take('a') == 0
+    clock.now += 100
+    assert [buckets.take('a') for _ in range(4)][-1] > 0
+
+
+def test_token_buckets_forget_full_buckets(clock, monkeypatch):
+    monkeypatch.setattr(admission, '_MAX_TOKEN_BUCKETS', 2)
+    buckets = admission._TokenBuckets(rate=1, burst=2)
+    buckets.take('a')
+    clock.now += 10
+    buckets.take('b')
+    buckets.take('c')
+    assert set(buckets._buckets) == {'b', 'c'}
+
+
+def test_concurrency_limiter_rejects_when_queue_is_full():
+    limiter = admission._ConcurrencyLimiter(concurrency=1, queue_size=0)
+    assert limiter.acquire(time.monotonic() + 1)
+    assert not limiter.acquire(time.monotonic() + 1)
+    limiter.release()
+    assert limiter.acquire(time.monotonic() + 1)
+
+
+def test_concurrency_limiter_waiter_gets_released_place():
+    limiter = admission._ConcurrencyLimiter(concurrency=1, queue_size=1)
+    assert limiter.acquire(time.monotonic() + 1)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire(time.monotonic() + 5)))
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.01)
+    # Очередь заполнена.
+    assert not limiter.acquire(time.monotonic() + 1)
+    limiter.release()
+    waiter.join()
+    assert results == [True]
+    assert limiter.running == 1
+
+
+def test_concurrency_limiter_waiter_times_out():
+    limiter = admission._ConcurrencyLimiter(concurrency=1, queue_size=1)
+    assert limiter.acquire(time.monotonic() + 1)
+    assert not limiter.acquire(time.monotonic() + 0.05)
+    assert limiter.waiting == 0
+
+
+@pytest.fixture
+def client(monkeypatch):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://',
+                      ADMISSION_CLASSES=dict(light=dict(concurrency=2, queue_size=0, timeout_seconds=1),
+                                             streaming=dict(concurrency=1, queue_size=0, timeout_seconds=1)),
+                      RATE_LIMIT_PER_SECOND=0.001, RATE_LIMIT_BURST=1)
+    db.init_app(app)
+    api = Api(app)
+
+    def rate_limit_key():
+        return None if request.authorization else ('ip', request.remote_addr)
+
+    def verified_rate_limit_key():
+        return 'account', request.authorization.username
+
+    class Light(Resource):
+        method_decorators = [admission_control(LIGHT, rate_limit_key, verified_rate_limit_key)]
+
+        def get(self):
+            return dict(deadline=request.environ[DEADLINE_ENVIRON_KEY] is not None)
+
+    class Streaming(Resource):
+        method_decorators = [admission_control(STREAMING, rate_limit_key, verified_rate_limit_key)]
+
+        def get(self):
+            return dict(deadline=request.environ[DEADLINE_ENVIRON_KEY] is not None)
+
+    api.add_resource(Light, '/light')
+    api.add_resource(Streaming, '/streaming')
+    init_admission(app)
+    yield app.test_client()
+    admission._limiters.clear()
+    monkeypatch.setattr(admission, '_token_buckets', None)
+
+
+def test_anonymous_requests_are_limited_by_address(client):
+    assert client.get('/light').status_code == 200
+    response = client.get('/light')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_requests_with_credentials_are_limited_by_verified_key(client):
+    assert client.get('/light', auth=('alice', 'x')).status_code == 200
+    assert client.get('/light', auth=('alice', 'x')).status_code == 429
+    # Другой аккаунт и анонимные запросы того же адреса не затронуты.
+    assert client.get('/light', auth=('bob', 'x')).status_code == 200
+    assert client.get('/light').status_code == 200
+    # Отклонённые запросы освобождают место.
+    assert admission._limiters[LIGHT].running == 0
+
+
+def test_light_requests_get_deadline_and_streaming_requests_do_not(client):
+    assert client.get('/light').json == dict(deadline=True)
+    assert client.get('/streaming', auth=('alice', 'x')).json == dict(deadline=False)
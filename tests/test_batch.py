@@ -0,0 +1,37 @@
+import pytest
+
+from webapi.batch import BatchOperationError, _substitute_references
+
+RESULTS = [
+    dict(status=201, body=dict(id=7, email='user@example.com')),
+    dict(status=200, body=dict(id=12, visitedLocations=[1, 2])),
+]
+
+
+def test_full_reference_keeps_value_type():
+    assert _substitute_references('{{0.id}}', RESULTS) == 7
+    assert _substitute_references('{{1.visitedLocations}}', RESULTS) == [1, 2]
+
+
+def test_reference_inside_string_is_formatted():
+    assert _substitute_references('/animals/{{1.id}}/locations/{{0.id}}', RESULTS) == '/animals/12/locations/7'
+
+
+def test_references_in_nested_json():
+    body = dict(chipperId='{{0.id}}', animalTypes=['{{1.id}}', 3], weight=1.5, name=None)
+    assert _substitute_references(body, RESULTS) == dict(chipperId=7, animalTypes=[12, 3], weight=1.5, name=None)
+
+
+def test_string_without_references_is_unchanged():
+    assert _substitute_references('/animals/{{x.id}}', RESULTS) == '/animals/{{x.id}}'
+
+
+@pytest.mark.parametrize('value', ['{{2.id}}', '{{0.missing}}', '/accounts/{{5.id}}'])
+def test_invalid_reference(value):
+    with pytest.raises(BatchOperationError):
+        _substitute_references(value, RESULTS)
+
+
+def test_reference_to_non_object_body():
+    with pytest.raises(BatchOperationError):
+        _substitute_references('{{0.id}}', [dict(status=200, body=[1, 2])])
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+
+from webapi.encounters import sweep_encounters
+
+T0 = datetime(2023, 3, 1, tzinfo=timezone.utc)
+
+
+def minutes(value: int) -> datetime:
+    return T0 + timedelta(minutes=value)
+
+
+def test_encounters_within_window_at_same_location():
+    # (location_id, visit_datetime, animal_id, visited_location_id)
+    visits = [
+        (1, minutes(0), 10, 100),
+        (1, minutes(5), 11, 101),
+        (1, minutes(20), 12, 102),
+    ]
+    assert list(sweep_encounters(visits, timedelta(minutes=10))) == [
+        (1, (100, minutes(0), 10), (101, minutes(5), 11)),
+    ]
+
+
+def test_window_boundary_is_inclusive():
+    visits = [(1, minutes(0), 10, 100), (1, minutes(10), 11, 101)]
+    assert len(list(sweep_encounters(visits, timedelta(minutes=10)))) == 1
+
+
+def test_same_animal_is_not_an_encounter():
+    visits = [(1, minutes(0), 10, 100), (1, minutes(1), 10, 101), (1, minutes(2), 11, 102)]
+    assert list(sweep_encounters(visits, timedelta(minutes=10))) == [
+        (1, (100, minutes(0), 10), (102, minutes(2), 11)),
+        (1, (101, minutes(1), 10), (102, minutes(2), 11)),
+    ]
+
+
+def test_window_is_reset_between_locations():
+    visits = [(1, minutes(0), 10, 100), (2, minutes(1), 11, 101), (2, minutes(3), 12, 102)]
+    assert list(sweep_encounters(visits, timedelta(minutes=10))) == [
+        (2, (101, minutes(1), 11), (102, minutes(3), 12)),
+    ]
+
+
+def test_no_visits():
+    assert list(sweep_encounters([], timedelta(minutes=10))) == []
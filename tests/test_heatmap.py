@@ -0,0 +1,80 @@
+import math
+from collections import Counter
+from datetime import date
+
+import numpy as np
+import pytest
+
+from webapi import heatmap
+from webapi.heatmap import HEATMAP_BASE_ZOOM, location_cells, move_location_counts
+
+
+def osm_tile(latitude: float, longitude: float, zoom: int) -> tuple[int, int]:
+    """Номер тайла OpenStreetMap по стандартной формуле (для сравнения)."""
+    n = 2 ** zoom
+    latitude = math.radians(latitude)
+    return int((longitude + 180) / 360 * n), int((1 - math.asinh(math.tan(latitude)) / math.pi) / 2 * n)
+
+
+@pytest.mark.parametrize('latitude, longitude', [(55.7558, 37.6173), (-33.8688, 151.2093), (40.7128, -74.006),
+                                                 (0.0, 0.0)])
+@pytest.mark.parametrize('zoom', [0, 1, 10, HEATMAP_BASE_ZOOM])
+def test_location_cells_match_osm_tiles(latitude, longitude, zoom):
+    xs, ys = location_cells(np.array([latitude]), np.array([longitude]), zoom)
+    assert (int(xs[0]), int(ys[0])) == osm_tile(latitude, longitude, zoom)
+
+
+def test_coarse_cells_are_shifted_base_cells():
+    rng = np.random.default_rng(0)
+    latitudes, longitudes = rng.uniform(-85, 85, 1000), rng.uniform(-180, 180, 1000)
+    base_xs, base_ys = location_cells(latitudes, longitudes)
+    xs, ys = location_cells(latitudes, longitudes, 9)
+    assert np.array_equal(base_xs >> (HEATMAP_BASE_ZOOM - 9), xs)
+    assert np.array_equal(base_ys >> (HEATMAP_BASE_ZOOM - 9), ys)
+
+
+def test_location_cells_are_clipped_to_the_grid():
+    xs, ys = location_cells(np.array([90.0, -90.0]), np.array([180.0, -180.0]), 2)
+    assert xs.tolist() == [3, 0]
+    assert ys.tolist() == [0, 3]
+
+
+class _RecordingSession:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, *args):
+        self.statements.append(statement)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    recording_session = _RecordingSession()
+    monkeypatch.setattr(heatmap.db, 'session', recording_session, raising=False)
+    return recording_session
+
+
+def test_cell_deltas_are_upserted_in_primary_key_order(session):
+    day = date(2023, 3, 1)
+    deltas = Counter({(5, 10, 1, day, 'visits_count'): 2,
+                      (0, 3, 1, day, 'chipped_count'): 1,
+                      (0, 3, 1, day, 'visits_count'): -1,
+                      (1, 1, 1, day, 'visits_count'): 0})
+    heatmap._apply_cell_deltas(deltas)
+
+    (statement,) = session.statements
+    params = statement.compile().params
+    rows = [(params[f'animal_type_id_m{i}'], params[f'cell_x_m{i}'], params[f'visits_count_m{i}'],
+             params[f'chipped_count_m{i}']) for i in range(2)]
+    assert 'animal_type_id_m2' not in params
+    assert rows == [(0, 3, -1, 1), (5, 10, 2, 0)]
+
+
+def test_zero_deltas_are_not_written(session):
+    heatmap._apply_cell_deltas(Counter({(0, 1, 1, date(2023, 3, 1), 'visits_count'): 0}))
+    assert session.statements == []
+
+
+def test_moving_location_within_its_cell_changes_nothing(session):
+    move_location_counts(1, (55.7558, 37.6173), (55.75581, 37.61731))
+    assert session.statements == []
@@ -0,0 +1,39 @@
+import numpy as np
+
+from webapi.trajectory import douglas_peucker_mask, time_buckets_mask
+
+
+def test_douglas_peucker_drops_collinear_points():
+    latitudes = np.array([0.0, 0.0, 0.0, 0.0])
+    longitudes = np.array([0.0, 1.0, 2.0, 3.0])
+    assert douglas_peucker_mask(latitudes, longitudes, 0.01).tolist() == [True, False, False, True]
+
+
+def test_douglas_peucker_keeps_points_beyond_tolerance():
+    # Пик в середине отстоит от хорды на 1, соседние с ним точки - примерно на 0.45 от новых хорд.
+    latitudes = np.array([0.0, 0.0, 1.0, 0.0, 0.0])
+    longitudes = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+    assert douglas_peucker_mask(latitudes, longitudes, 0.5).tolist() == [True, False, True, False, True]
+    assert douglas_peucker_mask(latitudes, longitudes, 0.3).tolist() == [True, True, True, True, True]
+    assert douglas_peucker_mask(latitudes, longitudes, 1.5).tolist() == [True, False, False, False, True]
+
+
+def test_douglas_peucker_closed_trajectory():
+    # Начало и конец совпадают - расстояния считаются до этой точки.
+    latitudes = np.array([0.0, 1.0, 0.0])
+    longitudes = np.array([0.0, 0.0, 0.0])
+    assert douglas_peucker_mask(latitudes, longitudes, 0.5).tolist() == [True, True, True]
+
+
+def test_douglas_peucker_short_trajectories():
+    assert douglas_peucker_mask(np.array([]), np.array([]), 1).tolist() == []
+    assert douglas_peucker_mask(np.array([1.0]), np.array([2.0]), 1).tolist() == [True]
+
+
+def test_time_buckets_keep_first_point_of_each_bucket_and_last_point():
+    timestamps = np.array([0, 10, 59, 60, 61, 130, 140])
+    assert time_buckets_mask(timestamps, 60).tolist() == [True, False, False, True, False, True, True]
+
+
+def test_time_buckets_empty():
+    assert time_buckets_mask(np.array([]), 60).tolist() == []
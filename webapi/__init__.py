@@ -7,6 +7,11 @@ from flask import Flask
 from werkzeug.routing import IntegerConverter
 
 from webapi.db_models import db
+from webapi.migrations import check_schema_version
+from webapi.compression import init_compression
+from webapi.profiling import init_profiling
+from webapi.statement_cache import init_statement_cache
+from webapi.admission import init_admission
 from webapi.config import *
 from webapi.resources import *
 
@@ -43,18 +48,22 @@ def start_app():
             )
 
 
-def configure_app_and_db(config: dict = ProductionConfig) -> None:
+def configure_app_and_db(config: dict = ProductionConfig, check_schema: bool = True) -> None:
     """
-    Настраивает приложение согласно `config`,
-    соединяет приложение с БД и создаёт таблицы.
+    Настраивает приложение согласно `config`
+    и соединяет приложение с БД.
+    Таблицы не создаются: схема БД обновляется отдельно через `python -m webapi.migrate`,
+    а здесь (при `check_schema`) только проверяется её версия - одним запросом.
     """
 
     app.config.from_mapping(config)
     api.init_app(app)
     db.init_app(app)
+    init_compression(app)
+    init_profiling(app)
+    init_statement_cache(app)
+    init_admission(app)
     app.app_context().push()
 
-    # Инструкция работает только с помощью реализации healthcheck в docker-compose файле.
-    # Без неё вызов `create_all(...)` завершается исключением, поскольку postgres
-    # не успевает инициализироваться.
-    db.create_all()
+    if check_schema:
+        check_schema_version()
@@ -0,0 +1,215 @@
+"""
+Модуль содержит контроль допуска запросов к обработчикам ресурсов (защиту от перегрузки).
+Каждый обработчик относится к классу эндпоинтов (`LIGHT` - короткие запросы по ID,
+`HEAVY` - поиск, истории посещений и т.п., `STREAMING` - потоковые ответы),
+у которого свои лимит одновременно выполняемых запросов и ограниченная очередь ожидающих,
+чтобы тяжёлые запросы не занимали все воркеры. Запрос, которому нет места в очереди или который
+не дождался своей очереди до крайнего срока, сразу получает 503 (с "Retry-After").
+Кроме того, действует ограничение частоты запросов "маркерной корзиной" (token bucket):
+анонимные запросы ограничиваются по IP-адресу ещё до допуска (без обращения к БД),
+а запросы с авторизационными данными - после допуска и их проверки: по аккаунту,
+либо (если данные неверны) по IP-адресу. При исчерпании корзины запрос получает 429.
+Крайний срок запроса (время прихода + `timeout_seconds` класса) передаётся в БД
+как `statement_timeout` каждой транзакции запроса, а запрос, отменённый по этому
+таймауту, получает 503. Для потоковых ответов крайний срок ограничивает только
+ожидание в очереди: ответ отдаётся, пока его читает клиент.
+Лимиты и корзины действуют в пределах одного процесса приложения.
+Настройки - `ADMISSION_CLASSES`, `RATE_LIMIT_PER_SECOND` и `RATE_LIMIT_BURST`.
+"""
+
+import math
+import threading
+import time
+from functools import wraps
+from typing import Callable, Hashable, Mapping
+from http import HTTPStatus
+from flask import Flask, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from webapi.db_models import db
+
+__all__ = (
+    'LIGHT',
+    'HEAVY',
+    'STREAMING',
+    'DEADLINE_ENVIRON_KEY',
+    'admission_control',
+    'init_admission',
+)
+
+LIGHT = 'light'
+HEAVY = 'heavy'
+STREAMING = 'streaming'
+# Классы, время запросов к БД которых не ограничивается крайним сроком.
+_UNBOUNDED_CLASSES = (STREAMING,)
+# Ключ WSGI-окружения запроса, в котором хранится его крайний срок (по `time.monotonic()`;
+# None - время запросов к БД не ограничено). Запросы с этим ключом (операции пакета `/batch`)
+# повторно не допускаются.
+DEADLINE_ENVIRON_KEY = 'webapi.deadline'
+# Код ошибки PostgreSQL "query_canceled" (в том числе по `statement_timeout`).
+_QUERY_CANCELED_PGCODE = '57014'
+# Количество корзин, при превышении которого удаляются полностью восполненные корзины.
+_MAX_TOKEN_BUCKETS = 100_000
+
+
+class _ConcurrencyLimiter:
+    """Лимит одновременно выполняемых запросов с ограниченной очередью ожидающих."""
+
+    def __init__(self, concurrency: int, queue_size: int) -> None:
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.running = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, deadline: float) -> bool:
+        """Занимает место до крайнего срока `deadline`. Возвращает False, если места нет."""
+        with self._condition:
+            if self.running < self.concurrency:
+                self.running += 1
+                return True
+            if self.waiting >= self.queue_size:
+                return False
+            self.waiting += 1
+            try:
+                if not self._condition.wait_for(lambda: self.running < self.concurrency,
+                                                timeout=deadline - time.monotonic()):
+                    return False
+                self.running += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.running -= 1
+            self._condition.notify()
+
+
+class _TokenBuckets:
+    """Маркерные корзины по ключам: `rate` маркеров в секунду, не больше `burst` в корзине."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        # Ключ -> (количество маркеров, момент их подсчёта).
+        self._buckets: dict[Hashable, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: Hashable) -> float:
+        """Забирает маркер из корзины `key`. Возвращает 0, либо (если маркеров нет) секунды до появления маркера."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > _MAX_TOKEN_BUCKETS:
+                self._buckets = {bucket_key: bucket for bucket_key, bucket in self._buckets.items()
+                                 if bucket[0] + (now - bucket[1]) * self.rate < self.burst}
+            return 0
+
+
+_limiters: dict[str, _ConcurrencyLimiter] = {}
+_timeouts: dict[str, float] = {}
+_token_buckets: _TokenBuckets | None = None
+
+
+def _rejection(status: HTTPStatus, retry_after_seconds: float) -> tuple[dict, HTTPStatus, dict]:
+    """
+    Ответ отклонённому запросу. Возвращается, а не выбрасывается исключением,
+    чтобы массовые отказы под нагрузкой не записывались в журнал как ошибки.
+    """
+    return dict(), status, {'Retry-After': str(max(1, math.ceil(retry_after_seconds)))}
+
+
+def admission_control(endpoint_class: str | Mapping[str, str],
+                      rate_limit_key: Callable[[], Hashable | None],
+                      verified_rate_limit_key: Callable[[], Hashable]) -> Callable:
+    """
+    Декоратор обработчика (для `method_decorators` ресурса): допускает запрос по лимитам
+    класса `endpoint_class` (либо класса из словаря "метод HTTP -> класс", по умолчанию `LIGHT`)
+    и по корзине с ключом `rate_limit_key()` (вызывается до допуска и не должен обращаться к БД).
+    Если он возвращает None, ключ корзины `verified_rate_limit_key()` определяется уже после допуска
+    (когда запросы к БД ограничены крайним сроком), например по проверенным авторизационным данным.
+    """
+    def decorator(method: Callable) -> Callable:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if DEADLINE_ENVIRON_KEY in request.environ or not _limiters:
+                return _call_with_deadline(method, *args, **kwargs)
+
+            key = rate_limit_key()
+
+            def admitted_method(*args, **kwargs):
+                if _token_buckets is not None and key is None:
+                    wait_seconds = _token_buckets.take(verified_rate_limit_key())
+                    if wait_seconds:
+                        return _rejection(HTTPStatus.TOO_MANY_REQUESTS, wait_seconds)
+                return method(*args, **kwargs)
+
+            if _token_buckets is not None and key is not None:
+                wait_seconds = _token_buckets.take(key)
+                if wait_seconds:
+                    return _rejection(HTTPStatus.TOO_MANY_REQUESTS, wait_seconds)
+
+            class_name = (endpoint_class.get(request.method.lower(), LIGHT)
+                          if isinstance(endpoint_class, Mapping) else endpoint_class)
+            limiter = _limiters[class_name]
+            deadline = time.monotonic() + _timeouts[class_name]
+            if not limiter.acquire(deadline):
+                return _rejection(HTTPStatus.SERVICE_UNAVAILABLE, _timeouts[class_name] / 2)
+            request.environ[DEADLINE_ENVIRON_KEY] = None if class_name in _UNBOUNDED_CLASSES else deadline
+            # Транзакция, начатая до допуска, тоже должна получить ограничение времени запросов.
+            if db.session().in_transaction():
+                _set_statement_timeout(db.session, None, db.session.connection())
+            try:
+                response = _call_with_deadline(admitted_method, *args, **kwargs)
+            except BaseException:
+                limiter.release()
+                raise
+            # Потоковый ответ занимает место, пока не будет отдан целиком.
+            if getattr(response, 'is_streamed', False):
+                response.call_on_close(limiter.release)
+            else:
+                limiter.release()
+            return response
+        return wrapper
+    return decorator
+
+
+def _call_with_deadline(method: Callable, *args, **kwargs):
+    """Вызывает обработчик, превращая отмену запроса к БД по крайнему сроку в 503."""
+    try:
+        return method(*args, **kwargs)
+    except OperationalError as exception:
+        if (request.environ.get(DEADLINE_ENVIRON_KEY) is None or
+                getattr(exception.orig, 'pgcode', None) != _QUERY_CANCELED_PGCODE):
+            raise
+        db.session.rollback()
+        return _rejection(HTTPStatus.SERVICE_UNAVAILABLE, 1)
+
+
+def _set_statement_timeout(session: Session, transaction, connection) -> None:
+    """Ограничивает время запросов транзакции оставшимся до крайнего срока запроса временем."""
+    if not has_request_context() or request.environ.get(DEADLINE_ENVIRON_KEY) is None:
+        return
+    remaining_ms = max(1, int((request.environ[DEADLINE_ENVIRON_KEY] - time.monotonic()) * 1000))
+    connection.exec_driver_sql(f'SET LOCAL statement_timeout = {remaining_ms}')
+
+
+def init_admission(app: Flask) -> None:
+    """Создаёт лимиты классов эндпоинтов и корзины по настройкам приложения."""
+    global _token_buckets
+    _limiters.clear()
+    for class_name, limits in app.config['ADMISSION_CLASSES'].items():
+        _limiters[class_name] = _ConcurrencyLimiter(limits['concurrency'], limits['queue_size'])
+        _timeouts[class_name] = limits['timeout_seconds']
+    _token_buckets = (_TokenBuckets(app.config['RATE_LIMIT_PER_SECOND'], app.config['RATE_LIMIT_BURST'])
+                      if app.config['RATE_LIMIT_PER_SECOND'] > 0 else None)
+    if not event.contains(Session, 'after_begin', _set_statement_timeout):
+        event.listen(Session, 'after_begin', _set_statement_timeout)
@@ -0,0 +1,345 @@
+"""
+Модуль содержит холодный архив умерших животных и их посещённых точек.
+Архивация (`python -m webapi.archive_dead_animals`) переносит животных, умерших
+раньше заданного момента, из таблиц БД в сжатые колоночные файлы Parquet
+в каталоге `ARCHIVE_DIR`. Каждый запуск дописывает сегменты - пару файлов
+"animals-<метка>.parquet" и "visited_locations-<метка>.parquet" (строки отсортированы по ID).
+Файлы читаются через отображение в память, а группы строк, не содержащие
+нужных значений, пропускаются по статистике Parquet. Поиск читает сегменты
+(отсортированные по ID) пачками и останавливается, набрав нужное количество животных,
+а количество подходящих животных запоминается для каждого сегмента и набора фильтров
+(сегменты не изменяются после записи).
+Архивные объекты возвращаются как не привязанные к сессии объекты моделей
+и доступны только для чтения.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Iterator
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from flask import current_app
+from sqlalchemy import any_, bindparam, delete, select
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from webapi.db_models import db, Animal, VisitedLocation
+from webapi.heatmap import count_animals
+from webapi.search_index import publish_animals_changes
+
+__all__ = (
+    'archive_dead_animals',
+    'load_archived_animal',
+    'load_archived_visited_locations',
+    'search_archived_animals',
+    'count_archived_animals',
+)
+
+_ANIMALS_PREFIX = 'animals-'
+_VISITED_LOCATIONS_PREFIX = 'visited_locations-'
+_SUFFIX = '.parquet'
+# Размер группы строк Parquet: чем меньше, тем точнее пропуск групп при поиске по ID.
+_ROW_GROUP_SIZE = 65_536
+# Размер пачки строк при последовательном чтении сегмента.
+_BATCH_SIZE = 1_024
+# Количество запоминаемых результатов подсчёта (сегмент, фильтры) -> количество.
+_COUNTS_CACHE_SIZE = 4_096
+# Операция фильтра -> функция сравнения столбца со значением.
+_FILTER_FUNCTIONS = {'=': pc.equal, '>=': pc.greater_equal, '<=': pc.less_equal}
+
+_ANIMALS_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('animal_types', pa.list_(pa.int64())),
+    ('weight', pa.float64()),
+    ('length', pa.float64()),
+    ('height', pa.float64()),
+    ('gender', pa.string()),
+    ('life_status', pa.string()),
+    ('chipping_datetime', pa.timestamp('us', tz='UTC')),
+    ('chipper_id', pa.int64()),
+    ('chipping_location_id', pa.int64()),
+    ('visited_locations', pa.list_(pa.int64())),
+    ('death_datetime', pa.timestamp('us', tz='UTC')),
+])
+
+_VISITED_LOCATIONS_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('visit_datetime', pa.timestamp('us', tz='UTC')),
+    ('location_id', pa.int64()),
+    ('animal_id', pa.int64()),
+])
+
+
+@dataclass
+class _Segment:
+    animals_path: str
+    visited_locations_path: str
+    # Диапазон ID животных сегмента.
+    min_id: int
+    max_id: int
+
+
+_segments: list[_Segment] = []
+# Момент изменения каталога архива, по состоянию на который составлен `_segments`.
+_segments_mtime_ns: int | None = None
+_segments_lock = threading.Lock()
+
+
+def _archive_segments() -> list[_Segment]:
+    """
+    Возвращает сегменты архива. Список перечитывается, только если каталог изменился
+    (новые сегменты создаются другим процессом).
+    """
+    global _segments, _segments_mtime_ns
+    archive_dir = current_app.config['ARCHIVE_DIR']
+    try:
+        mtime_ns = os.stat(archive_dir).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    if mtime_ns == _segments_mtime_ns:
+        return _segments
+
+    with _segments_lock:
+        segments = []
+        for file_name in sorted(os.listdir(archive_dir)):
+            if not (file_name.startswith(_ANIMALS_PREFIX) and file_name.endswith(_SUFFIX)):
+                continue
+            animals_path = os.path.join(archive_dir, file_name)
+            metadata = pq.read_metadata(animals_path)
+            id_column_index = metadata.schema.names.index('id')
+            row_groups_statistics = [metadata.row_group(i).column(id_column_index).statistics
+                                     for i in range(metadata.num_row_groups)]
+            if not row_groups_statistics:
+                continue
+            segments.append(_Segment(
+                animals_path=animals_path,
+                visited_locations_path=os.path.join(archive_dir,
+                                                    _VISITED_LOCATIONS_PREFIX + file_name[len(_ANIMALS_PREFIX):]),
+                min_id=min(statistics.min for statistics in row_groups_statistics),
+                max_id=max(statistics.max for statistics in row_groups_statistics),
+            ))
+        _segments, _segments_mtime_ns = segments, mtime_ns
+    return segments
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Дата и время без часового пояса считаются указанными в UTC (как и в БД)."""
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def _read_rows(path: str, filters: list[tuple]) -> list[dict]:
+    return pq.read_table(path, filters=filters or None, memory_map=True).to_pylist()
+
+
+def load_archived_animal(_id: int) -> Animal | None:
+    """Возвращает архивное животное с указанным ID (None - если его нет в архиве)."""
+    for segment in _archive_segments():
+        if segment.min_id <= _id <= segment.max_id:
+            rows = _read_rows(segment.animals_path, [('id', '=', _id)])
+            if rows:
+                return Animal(**rows[0])
+    return None
+
+
+def load_archived_visited_locations(animal: Animal,
+                                    start_datetime: datetime | None = None,
+                                    end_datetime: datetime | None = None) -> list[VisitedLocation]:
+    """Возвращает архивные посещённые точки животного (по возрастанию даты посещения)."""
+    filters = [('animal_id', '=', animal.id)]
+    if start_datetime:
+        filters.append(('visit_datetime', '>=', _as_utc(start_datetime)))
+    if end_datetime:
+        filters.append(('visit_datetime', '<=', _as_utc(end_datetime)))
+    for segment in _archive_segments():
+        if segment.min_id <= animal.id <= segment.max_id:
+            rows = _read_rows(segment.visited_locations_path, filters)
+            if rows:
+                return sorted((VisitedLocation(**row) for row in rows),
+                              key=lambda visited_location: visited_location.visit_datetime)
+    return []
+
+
+def _animals_filters(start_datetime: datetime | None, end_datetime: datetime | None,
+                     equal_values: dict[str, int | str]) -> list[tuple]:
+    filters = [(name, '=', value) for name, value in equal_values.items()]
+    if start_datetime:
+        filters.append(('chipping_datetime', '>=', _as_utc(start_datetime)))
+    if end_datetime:
+        filters.append(('chipping_datetime', '<=', _as_utc(end_datetime)))
+    return filters
+
+
+def _row_group_match(row_group: pq.RowGroupMetaData, filters: list[tuple]) -> bool | None:
+    """
+    Проверяет группу строк по статистике: False - ни одна строка не подходит под фильтры,
+    True - подходят все строки, None - нужно проверять строки.
+    """
+    columns_statistics = {row_group.column(i).path_in_schema: row_group.column(i).statistics
+                          for i in range(row_group.num_columns)}
+    all_match = True
+    for name, operation, value in filters:
+        statistics = columns_statistics[name]
+        if statistics is None or not statistics.has_min_max or statistics.null_count:
+            all_match = False
+            continue
+        if operation == '=':
+            if not statistics.min <= value <= statistics.max:
+                return False
+            all_match = all_match and statistics.min == statistics.max
+        elif operation == '>=':
+            if statistics.max < value:
+                return False
+            all_match = all_match and statistics.min >= value
+        else:
+            if statistics.min > value:
+                return False
+            all_match = all_match and statistics.max <= value
+    return True if all_match else None
+
+
+def _filters_mask(batch: pa.RecordBatch, filters: list[tuple]) -> pa.BooleanArray:
+    mask = None
+    for name, operation, value in filters:
+        column = batch.column(name)
+        column_mask = _FILTER_FUNCTIONS[operation](column, pa.scalar(value, type=column.type))
+        mask = column_mask if mask is None else pc.and_(mask, column_mask)
+    return mask
+
+
+def _iter_matching_rows(path: str, filters: list[tuple]) -> Iterator[dict]:
+    """Выдаёт подходящие под фильтры строки файла по порядку, читая только непропущенные группы строк."""
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    row_groups = [i for i in range(parquet_file.num_row_groups)
+                  if _row_group_match(parquet_file.metadata.row_group(i), filters) is not False]
+    if not row_groups:
+        return
+    for batch in parquet_file.iter_batches(batch_size=_BATCH_SIZE, row_groups=row_groups):
+        if filters:
+            batch = batch.filter(_filters_mask(batch, filters))
+        yield from batch.to_pylist()
+
+
+def search_archived_animals(limit: int,
+                            start_datetime: datetime | None = None, end_datetime: datetime | None = None,
+                            **equal_values: int | str) -> list[Animal]:
+    """
+    Возвращает до `limit` архивных животных с наименьшими ID, у которых дата чипирования
+    попадает в диапазон, а остальные поля равны `equal_values`.
+    """
+    filters = _animals_filters(start_datetime, end_datetime, equal_values)
+    rows = heapq.merge(*(_iter_matching_rows(segment.animals_path, filters) for segment in _archive_segments()),
+                       key=lambda row: row['id'])
+    return [Animal(**row) for row in itertools.islice(rows, limit)]
+
+
+@lru_cache(maxsize=_COUNTS_CACHE_SIZE)
+def _count_matching_rows(path: str, filters: tuple[tuple, ...]) -> int:
+    """
+    Считает подходящие под фильтры строки файла: группы строк, целиком подходящие
+    или не подходящие по статистике, не читаются, а из остальных читаются только столбцы фильтров.
+    """
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    count = 0
+    row_groups = []
+    for i in range(parquet_file.num_row_groups):
+        row_group = parquet_file.metadata.row_group(i)
+        match = _row_group_match(row_group, list(filters))
+        if match:
+            count += row_group.num_rows
+        elif match is None:
+            row_groups.append(i)
+    if row_groups:
+        columns = sorted({name for name, *_ in filters})
+        for batch in parquet_file.iter_batches(row_groups=row_groups, columns=columns):
+            count += pc.sum(_filters_mask(batch, list(filters))).as_py() or 0
+    return count
+
+
+def count_archived_animals(start_datetime: datetime | None = None, end_datetime: datetime | None = None,
+                           **equal_values: int | str) -> int:
+    """Возвращает количество архивных животных, подходящих под те же фильтры, что и в `search_archived_animals`."""
+    filters = tuple(_animals_filters(start_datetime, end_datetime, equal_values))
+    return sum(_count_matching_rows(segment.animals_path, filters) for segment in _archive_segments())
+
+
+def _write_parquet(path: str, rows: list[dict], schema: pa.Schema) -> None:
+    """Записывает файл атомарно: во временный файл с последующим переименованием."""
+    temporary_path = path + '.tmp'
+    pq.write_table(pa.Table.from_pylist(rows, schema), temporary_path,
+                   compression='zstd', row_group_size=_ROW_GROUP_SIZE)
+    with open(temporary_path, 'rb') as file:
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def archive_dead_animals(died_before: datetime, batch_size: int = 100_000) -> tuple[int, int]:
+    """
+    Переносит животных, умерших раньше `died_before`, вместе с их посещёнными точками
+    в архив (по `batch_size` животных на сегмент) и удаляет их из БД.
+    Строки удаляются только после того, как сегмент записан на диск.
+    Возвращает количество перенесённых животных и посещённых точек.
+    """
+    os.makedirs(current_app.config['ARCHIVE_DIR'], exist_ok=True)
+    animals_count = visited_locations_count = 0
+    while True:
+        animals = db.session.execute(
+            select(Animal)
+            .where(Animal.life_status == 'DEAD', Animal.death_datetime < died_before)
+            .order_by(Animal.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not animals:
+            db.session.rollback()
+            return animals_count, visited_locations_count
+
+        animal_ids = [animal.id for animal in animals]
+        visited_location_ids = [_id for animal in animals for _id in animal.visited_locations or []]
+        visited_locations = db.session.execute(
+            select(VisitedLocation)
+            .where(VisitedLocation.id == any_(bindparam('ids', visited_location_ids, type_=ARRAY(db.Integer))))
+            .order_by(VisitedLocation.id)
+        ).scalars().all()
+        # Посещённые точки привязываем к животному по "visitedLocations" (а не по столбцу `animal_id`).
+        animal_id_by_visited_location_id = {_id: animal.id for animal in animals
+                                            for _id in animal.visited_locations or []}
+
+        label = f'{time.time_ns()}{_SUFFIX}'
+        animals_path = os.path.join(current_app.config['ARCHIVE_DIR'], _ANIMALS_PREFIX + label)
+        visited_locations_path = os.path.join(current_app.config['ARCHIVE_DIR'], _VISITED_LOCATIONS_PREFIX + label)
+        _write_parquet(visited_locations_path,
+                       [dict(id=visited_location.id, visit_datetime=visited_location.visit_datetime,
+                             location_id=visited_location.location_id,
+                             animal_id=animal_id_by_visited_location_id[visited_location.id])
+                        for visited_location in visited_locations],
+                       _VISITED_LOCATIONS_SCHEMA)
+        # Файл животных записывается последним: именно по нему читатели находят сегмент.
+        _write_parquet(animals_path,
+                       [{name: getattr(animal, name) for name in _ANIMALS_SCHEMA.names} for animal in animals],
+                       _ANIMALS_SCHEMA)
+        try:
+            # Тепловая карта строится только по данным БД.
+            count_animals(animals, -1)
+            db.session.execute(delete(VisitedLocation).where(
+                VisitedLocation.id == any_(bindparam('ids', visited_location_ids, type_=ARRAY(db.Integer)))
+            ).execution_options(synchronize_session=False))
+            db.session.execute(delete(Animal).where(
+                Animal.id == any_(bindparam('ids', animal_ids, type_=ARRAY(db.Integer)))
+            ).execution_options(synchronize_session=False))
+            publish_animals_changes(removed_ids=animal_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            os.remove(animals_path)
+            os.remove(visited_locations_path)
+            raise
+        # Удалённые запросами объекты не должны оставаться в сессии.
+        db.session.expunge_all()
+        animals_count += len(animals)
+        visited_locations_count += len(visited_locations)
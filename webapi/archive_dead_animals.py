@@ -0,0 +1,19 @@
+"""
+Переносит в холодный архив (см. модуль `archive`) животных, умерших больше указанного
+числа дней назад (по умолчанию - 365), вместе с их посещёнными точками.
+Пример: python -m webapi.archive_dead_animals [--days 365]
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from webapi.__init__ import configure_app_and_db
+from webapi.archive import archive_dead_animals
+
+parser = argparse.ArgumentParser(prog='python -m webapi.archive_dead_animals')
+parser.add_argument('--days', type=int, default=365, help='сколько дней назад животное должно было умереть')
+args = parser.parse_args()
+
+configure_app_and_db()
+animals_count, visited_locations_count = archive_dead_animals(datetime.now(timezone.utc) - timedelta(days=args.days))
+print(f'Перенесено в архив животных: {animals_count}, посещённых точек: {visited_locations_count}')
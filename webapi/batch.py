@@ -0,0 +1,160 @@
+"""
+Модуль содержит выполнение пакетных запросов `/batch`: упорядоченного списка операций
+над существующими ресурсами приложения за один HTTP-запрос.
+Операции выполняются обычными обработчиками ресурсов в одной транзакции БД
+(фиксации внутри обработчиков становятся точками сохранения), поэтому пакет
+применяется целиком либо не применяется вовсе.
+Операции могут ссылаться на результаты предыдущих операций шаблоном "{{N.поле}}",
+где N - номер операции (с нуля), а поле - поле её JSON-ответа (например, "{{0.id}}").
+"""
+
+import re
+from contextlib import contextmanager
+from http import HTTPStatus
+from typing import Any, Callable, Iterator
+from flask import after_this_request, current_app, request
+from werkzeug.exceptions import HTTPException
+
+from webapi.db_models import db
+from webapi.partitions import forget_existing_visited_locations_partitions
+from webapi.search_index import animals_search_index
+from webapi.admission import DEADLINE_ENVIRON_KEY
+from webapi.resources_utils import get_entity_loader
+
+__all__ = (
+    'BatchOperationError',
+    'execute_batch',
+)
+
+# Шаблон ссылки на поле ответа предыдущей операции.
+_REFERENCE_PATTERN = re.compile(r'\{\{(\d+)\.(\w+)\}\}')
+# URN'ы, которые нельзя выполнять в пакете (вложенные пакеты и потоковые ответы).
+_FORBIDDEN_PATHS = ('/batch', '/animals/events', '/admin/')
+# Ключи WSGI-окружения, переносимые из пакетного запроса в запросы операций
+# (авторизованный аккаунт, загрузчик объектов моделей и крайний срок общие для всего пакета).
+_SHARED_ENVIRON_KEYS = ('webapi.authorized_account_id', 'webapi.entity_loader', DEADLINE_ENVIRON_KEY)
+
+
+class BatchOperationError(Exception):
+    """Ошибка в описании операции пакета (некорректный URN или ссылка)."""
+
+
+def _resolve_reference(match: re.Match, results: list[dict]) -> Any:
+    index, field = int(match.group(1)), match.group(2)
+    if index >= len(results):
+        raise BatchOperationError()
+    body = results[index]['body']
+    if not isinstance(body, dict) or field not in body:
+        raise BatchOperationError()
+    return body[field]
+
+
+def _substitute_references(value: Any, results: list[dict]) -> Any:
+    """
+    Подставляет в значение (URN или JSON операции) поля ответов предыдущих операций.
+    Строка, целиком состоящая из ссылки, заменяется значением поля как есть (например, числом).
+    """
+    if isinstance(value, str):
+        full_match = _REFERENCE_PATTERN.fullmatch(value)
+        if full_match:
+            return _resolve_reference(full_match, results)
+        return _REFERENCE_PATTERN.sub(lambda match: str(_resolve_reference(match, results)), value)
+    if isinstance(value, list):
+        return [_substitute_references(item, results) for item in value]
+    if isinstance(value, dict):
+        return {key: _substitute_references(item, results) for key, item in value.items()}
+    return value
+
+
+@contextmanager
+def _batch_transaction() -> Iterator[None]:
+    """
+    Заменяет сессию БД текущего контекста приложения сессией, работающей
+    внутри одной внешней транзакции. `commit()` сессии фиксирует лишь точку сохранения,
+    а внешняя транзакция фиксируется только после успешного выполнения всех операций.
+    """
+    # Соединение прежней сессии (которой проверялась авторизация) на время пакета не нужно.
+    db.session.remove()
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    db.session.registry.set(db.session.session_factory(bind=connection,
+                                                       join_transaction_mode='create_savepoint'))
+    try:
+        yield
+        db.session.commit()
+        transaction.commit()
+    except BaseException:
+        transaction.rollback()
+        # Отменённые изменения могли успеть попасть в состояние процесса.
+        forget_existing_visited_locations_partitions()
+        animals_search_index.invalidate()
+        raise
+    finally:
+        db.session.remove()
+        connection.close()
+
+
+class _BatchRolledBack(Exception):
+    """Операция пакета завершилась ошибкой, и транзакция пакета отменена."""
+
+    def __init__(self, status: int) -> None:
+        super().__init__()
+        self.status = status
+
+
+def _execute_operation(method: str, path: str, body: Any) -> tuple[int, Any, list[Callable]]:
+    """
+    Выполняет одну операцию обработчиком соответствующего ресурса и возвращает статус и JSON ответа,
+    а также функции, зарегистрированные обработчиком через `after_this_request`.
+    """
+    if not path.startswith('/') or path.startswith(_FORBIDDEN_PATHS):
+        raise BatchOperationError()
+
+    headers = {}
+    if request.authorization is not None:
+        headers['Authorization'] = request.headers['Authorization']
+    environ_overrides = {key: request.environ[key] for key in _SHARED_ENVIRON_KEYS if key in request.environ}
+    app = current_app._get_current_object()
+    with app.test_request_context(path, method=method, json=body, headers=headers,
+                                  environ_overrides=environ_overrides) as operation_context:
+        # Вызываем обработчик напрямую, минуя хуки before/after_request (сжатие, профилирование):
+        # они применяются к пакетному запросу целиком.
+        try:
+            response = app.make_response(app.dispatch_request())
+        except HTTPException as exception:
+            response = app.make_response(app.handle_user_exception(exception))
+        if response.is_streamed:
+            raise BatchOperationError()
+        return response.status_code, response.get_json(silent=True), operation_context._after_request_functions
+
+
+def execute_batch(operations: list[dict]) -> tuple[list[dict], int]:
+    """
+    Выполняет операции пакета (словари с ключами "method", "path" и "body") по порядку
+    в одной транзакции. Возвращает результаты выполненных операций (статус и JSON ответа)
+    и итоговый статус: 200, либо статус первой неудачной операции (тогда все изменения отменены
+    и она последняя в результатах). Некорректная операция приводит к `BatchOperationError`.
+    Функции `after_this_request` операций применяются к ответу пакета, если пакет применён.
+    """
+    results = []
+    after_request_functions = []
+    # Загрузчик создаётся до первой операции, чтобы он был общим для всех операций пакета.
+    entity_loader = get_entity_loader()
+    try:
+        with _batch_transaction():
+            for operation in operations:
+                path = _substitute_references(operation['path'], results)
+                body = _substitute_references(operation['body'], results)
+                status, response_body, functions = _execute_operation(operation['method'], path, body)
+                results.append(dict(status=status, body=response_body))
+                if status >= HTTPStatus.BAD_REQUEST:
+                    raise _BatchRolledBack(status)
+                after_request_functions += functions
+                # Изменяющая операция могла создать объекты, ранее не найденные загрузчиком.
+                if operation['method'].upper() != 'GET':
+                    entity_loader.forget_missing()
+    except _BatchRolledBack as exception:
+        return results, exception.status
+    for function in after_request_functions:
+        after_this_request(function)
+    return results, HTTPStatus.OK
@@ -0,0 +1,95 @@
+"""
+Сравнивает скорость поиска животных через колоночный индекс в памяти и через SQL.
+Без --sql индекс строится из синтетических данных (по умолчанию - 10 млн животных).
+С --sql индекс строится из таблицы животных БД из настроек приложения (в ней должны быть данные),
+и те же запросы замеряются через SQL - так, как их выполняет `/animals/search`
+(первая страница ID по возрастанию и точное количество совпадений).
+Пример: python -m webapi.benchmark_search_index [--rows 10000000] [--sql] [--page-size 10]
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+parser = argparse.ArgumentParser(prog='python -m webapi.benchmark_search_index')
+parser.add_argument('--rows', type=int, default=10_000_000)
+parser.add_argument('--repeat', type=int, default=20)
+parser.add_argument('--sql', action='store_true')
+parser.add_argument('--page-size', type=int, default=10)
+args = parser.parse_args()
+
+from webapi.search_index import AnimalsSearchIndex  # noqa: E402
+
+start_of_chipping = datetime(2020, 1, 1, tzinfo=timezone.utc)
+random.seed(0)
+
+
+def synthetic_rows():
+    for _id in range(1, args.rows + 1):
+        yield (_id, random.choice(('MALE', 'FEMALE', 'OTHER')), 'DEAD' if random.random() < 0.1 else 'ALIVE',
+               random.randint(1, 1000), random.randint(1, 10_000), start_of_chipping + timedelta(minutes=_id))
+
+
+queries = [
+    dict(gender='FEMALE'),
+    dict(gender='MALE', life_status='DEAD'),
+    dict(chipper_id=42, life_status='ALIVE'),
+    dict(chipping_location_id=777),
+    dict(start_datetime=start_of_chipping + timedelta(days=1000), end_datetime=start_of_chipping + timedelta(days=1100),
+         gender='OTHER'),
+]
+
+
+def measure(name: str, search) -> None:
+    for query in queries:
+        started_at = time.perf_counter()
+        for _ in range(args.repeat):
+            found_count = search(query)
+        elapsed = (time.perf_counter() - started_at) / args.repeat
+        print(f'{name:6} {elapsed * 1000:10.2f} мс  найдено: {found_count:>10}  {query}')
+
+
+def index_search(query: dict) -> int:
+    found_ids = index.search(**query)
+    found_ids[:args.page_size].tolist()
+    return len(found_ids)
+
+
+index = AnimalsSearchIndex()
+if args.sql:
+    from sqlalchemy import func, select
+    from webapi.__init__ import configure_app_and_db
+    from webapi.db_models import db, Animal
+
+    configure_app_and_db()
+    rows = db.session.execute(
+        select(Animal.id, Animal.gender, Animal.life_status, Animal.chipper_id,
+               Animal.chipping_location_id, Animal.chipping_datetime)
+        .order_by(Animal.id)
+        .execution_options(yield_per=100_000)
+    )
+    source = 'таблицы животных БД'
+else:
+    rows = synthetic_rows()
+    source = f'{args.rows} синтетических строк'
+started_at = time.perf_counter()
+index.build(rows)
+print(f'Построение индекса из {source}: {time.perf_counter() - started_at:.1f} с')
+measure('index', index_search)
+
+if args.sql:
+    def sql_search(query: dict) -> int:
+        filter_args = []
+        if 'start_datetime' in query:
+            filter_args.append(Animal.chipping_datetime >= query['start_datetime'])
+        if 'end_datetime' in query:
+            filter_args.append(Animal.chipping_datetime <= query['end_datetime'])
+        filter_args += [getattr(Animal, name) == value for name, value in query.items()
+                        if name not in ('start_datetime', 'end_datetime')]
+        db.session.execute(select(Animal.id).where(*filter_args).order_by(Animal.id).limit(args.page_size)).all()
+        found_count = db.session.execute(select(func.count()).select_from(Animal).where(*filter_args)).scalar_one()
+        db.session.rollback()
+        return found_count
+
+    measure('sql', sql_search)
@@ -0,0 +1,67 @@
+"""
+Модуль содержит сжатие ответов приложения (gzip, а также brotli и zstd - если установлены
+пакеты `brotli` и `zstandard`) с выбором алгоритма по заголовку "Accept-Encoding".
+"""
+
+import gzip
+import threading
+from typing import Callable
+from flask import Flask, Response, request
+
+__all__ = (
+    'init_compression',
+)
+
+# Алгоритм сжатия -> функция сжатия (в порядке предпочтения сервера).
+_compressors: dict[str, Callable[[bytes], bytes]] = {}
+
+try:
+    import zstandard
+
+    # `ZstdCompressor` нельзя использовать из нескольких потоков одновременно,
+    # поэтому у каждого потока свой.
+    _zstd_local = threading.local()
+
+    def _zstd_compress(data: bytes) -> bytes:
+        if not hasattr(_zstd_local, 'compressor'):
+            _zstd_local.compressor = zstandard.ZstdCompressor(level=3)
+        return _zstd_local.compressor.compress(data)
+
+    _compressors['zstd'] = _zstd_compress
+except ImportError:
+    pass
+
+try:
+    import brotli
+    _compressors['br'] = lambda data: brotli.compress(data, quality=4)
+except ImportError:
+    pass
+
+_compressors['gzip'] = lambda data: gzip.compress(data, compresslevel=6)
+
+
+def _compress_response(response: Response, min_size: int) -> Response:
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    encoding = request.accept_encodings.best_match(list(_compressors))
+    if encoding is None:
+        return response
+
+    response.set_data(_compressors[encoding](data))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app: Flask) -> None:
+    """
+    Подключает к приложению сжатие ответов размером от `COMPRESSION_MIN_SIZE` байт.
+    """
+    min_size = app.config['COMPRESSION_MIN_SIZE']
+    app.after_request(lambda response: _compress_response(response, min_size))
@@ -15,6 +15,36 @@ __all__ = (
     'TestConfig',
 )
 
+
+def _replica_binds(db_name: str) -> dict[str, str]:
+    """
+    Формирует `SQLALCHEMY_BINDS` для реплик БД, перечисленных в переменной окружения
+    "POSTGRES_REPLICAS" через запятую в формате "host:port" (например, "localhost:5433,localhost:5434").
+    """
+    replicas = [replica.strip() for replica in os.environ.get('POSTGRES_REPLICAS', '').split(',')
+                if replica.strip()]
+    return {f'replica_{i}': f'postgresql://'
+                            f'{os.environ["POSTGRES_USER"]}:'
+                            f'{os.environ["POSTGRES_PASSWORD"]}@'
+                            f'{replica}/'
+                            f'{db_name}'
+            for i, replica in enumerate(replicas)}
+
+
+def _admission_classes() -> dict[str, dict]:
+    """
+    Формирует `ADMISSION_CLASSES` из переменных окружения вида "ADMISSION_<КЛАСС>_CONCURRENCY",
+    "ADMISSION_<КЛАСС>_QUEUE_SIZE" и "ADMISSION_<КЛАСС>_TIMEOUT_SECONDS" (классы - "LIGHT", "HEAVY" и "STREAMING").
+    Для "STREAMING" время до крайнего срока ограничивает только ожидание в очереди.
+    """
+    defaults = dict(light=(16, 64, 5), heavy=(4, 8, 30), streaming=(4, 8, 10))
+    return {class_name: dict(
+        concurrency=int(os.environ.get(f'ADMISSION_{class_name.upper()}_CONCURRENCY', concurrency)),
+        queue_size=int(os.environ.get(f'ADMISSION_{class_name.upper()}_QUEUE_SIZE', queue_size)),
+        timeout_seconds=float(os.environ.get(f'ADMISSION_{class_name.upper()}_TIMEOUT_SECONDS', timeout_seconds)),
+    ) for class_name, (concurrency, queue_size, timeout_seconds) in defaults.items()}
+
+
 ProductionConfig: Final = dict(
     SQLALCHEMY_DATABASE_URI=f'postgresql://'
                             f'{os.environ["POSTGRES_USER"]}:'
@@ -22,6 +52,52 @@ ProductionConfig: Final = dict(
                             f'{os.environ["POSTGRES_HOST"]}:'
                             f'{os.environ["POSTGRES_PORT"]}/'
                             f'{os.environ["POSTGRES_DB"]}',
+    SQLALCHEMY_BINDS=_replica_binds(os.environ["POSTGRES_DB"]),
+    # Сколько секунд после изменения данных аккаунтом его GET-запросы читают с основной БД
+    # (чтобы он видел свои изменения, даже если реплики ещё не догнали основную БД).
+    REPLICA_STICKINESS_SECONDS=float(os.environ.get('REPLICA_STICKINESS_SECONDS', 5)),
+    # На сколько месяцев вперёд заранее создаются партиции таблицы `visited_locations`.
+    VISITED_LOCATIONS_PARTITIONS_AHEAD=int(os.environ.get('VISITED_LOCATIONS_PARTITIONS_AHEAD', 3)),
+    # Минимальный размер ответа (в байтах), начиная с которого ответ сжимается.
+    COMPRESSION_MIN_SIZE=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    # Максимальное количество неотправленных клиенту событий (более старые отбрасываются).
+    EVENTS_CLIENT_BUFFER_SIZE=int(os.environ.get('EVENTS_CLIENT_BUFFER_SIZE', 100)),
+    # Интервал (в секундах), с которым клиенту отправляется пустой комментарий, если событий нет.
+    EVENTS_KEEPALIVE_SECONDS=float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15)),
+    # Поиск животных через колоночный индекс в памяти процесса (см. модуль `search_index`).
+    ANIMALS_SEARCH_INDEX_ENABLED=os.environ.get('ANIMALS_SEARCH_INDEX_ENABLED', 'FALSE').upper() == 'TRUE',
+    # Возраст индекса (в секундах), после которого он перестраивается, а поиск до этого идёт через SQL.
+    ANIMALS_SEARCH_INDEX_MAX_AGE_SECONDS=float(os.environ.get('ANIMALS_SEARCH_INDEX_MAX_AGE_SECONDS', 60)),
+    # Профилирование запросов (см. модуль `profiling`): токен для заголовка "X-Profile-Token"
+    # и доля случайно профилируемых запросов. Если оба пусты, профилирование полностью отключено.
+    PROFILING_TOKEN=os.environ.get('PROFILING_TOKEN', ''),
+    PROFILING_SAMPLE_RATE=float(os.environ.get('PROFILING_SAMPLE_RATE', 0)),
+    PROFILING_INTERVAL_MS=float(os.environ.get('PROFILING_INTERVAL_MS', 1)),
+    PROFILING_DIR=os.environ.get('PROFILING_DIR', 'profiles'),
+    PROFILING_MAX_PROFILES=int(os.environ.get('PROFILING_MAX_PROFILES', 100)),
+    # Фоновые задачи (см. модуль `jobs`): каталог для файлов с результатами,
+    # время без продления блокировки воркером, после которого выполняемая задача забирается повторно
+    # (воркер продлевает блокировку каждую треть этого времени),
+    # и интервал опроса очереди воркером, когда задач нет.
+    JOBS_RESULTS_DIR=os.environ.get('JOBS_RESULTS_DIR', 'jobs_results'),
+    JOBS_LOCK_TIMEOUT_SECONDS=float(os.environ.get('JOBS_LOCK_TIMEOUT_SECONDS', 60)),
+    JOBS_POLL_INTERVAL_SECONDS=float(os.environ.get('JOBS_POLL_INTERVAL_SECONDS', 1)),
+    # Каталог холодного архива умерших животных (см. модуль `archive`).
+    ARCHIVE_DIR=os.environ.get('ARCHIVE_DIR', 'archive'),
+    # Во сколько раз оценка планировщика количества совпадений поиска может превышать
+    # количество строк, читаемых для страницы ("from" + "size"), чтобы оно считалось точно (см. "countMode").
+    SEARCH_EXACT_COUNT_PAGE_FACTOR=int(os.environ.get('SEARCH_EXACT_COUNT_PAGE_FACTOR', 4)),
+    # Максимальное количество выражений в кэше SQL-выражений (см. модуль `statement_cache`).
+    STATEMENT_CACHE_SIZE=int(os.environ.get('STATEMENT_CACHE_SIZE', 1000)),
+    # Контроль допуска запросов (см. модуль `admission`): для каждого класса эндпоинтов -
+    # лимит одновременно выполняемых запросов, размер очереди ожидающих
+    # и время от прихода запроса до крайнего срока (ожидание в очереди + запросы к БД).
+    ADMISSION_CLASSES=_admission_classes(),
+    # Ограничение частоты запросов одного аккаунта (анонимных либо с неверными авторизационными
+    # данными - одного IP-адреса): маркеров в секунду (0 - без ограничения)
+    # и наибольшее количество запросов подряд.
+    RATE_LIMIT_PER_SECOND=float(os.environ.get('RATE_LIMIT_PER_SECOND', 20)),
+    RATE_LIMIT_BURST=int(os.environ.get('RATE_LIMIT_BURST', 40)),
 )
 
 TestConfig: Final = dict(
@@ -31,4 +107,26 @@ TestConfig: Final = dict(
                             f'{os.environ["POSTGRES_HOST"]}:'
                             f'{os.environ["POSTGRES_PORT"]}/'
                             f'{os.environ["POSTGRES_TEST_DB"]}',  # Тестовая БД.
+    SQLALCHEMY_BINDS=_replica_binds(os.environ["POSTGRES_TEST_DB"]),
+    REPLICA_STICKINESS_SECONDS=float(os.environ.get('REPLICA_STICKINESS_SECONDS', 5)),
+    VISITED_LOCATIONS_PARTITIONS_AHEAD=int(os.environ.get('VISITED_LOCATIONS_PARTITIONS_AHEAD', 3)),
+    COMPRESSION_MIN_SIZE=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    EVENTS_CLIENT_BUFFER_SIZE=int(os.environ.get('EVENTS_CLIENT_BUFFER_SIZE', 100)),
+    EVENTS_KEEPALIVE_SECONDS=float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15)),
+    ANIMALS_SEARCH_INDEX_ENABLED=os.environ.get('ANIMALS_SEARCH_INDEX_ENABLED', 'FALSE').upper() == 'TRUE',
+    ANIMALS_SEARCH_INDEX_MAX_AGE_SECONDS=float(os.environ.get('ANIMALS_SEARCH_INDEX_MAX_AGE_SECONDS', 60)),
+    PROFILING_TOKEN=os.environ.get('PROFILING_TOKEN', ''),
+    PROFILING_SAMPLE_RATE=float(os.environ.get('PROFILING_SAMPLE_RATE', 0)),
+    PROFILING_INTERVAL_MS=float(os.environ.get('PROFILING_INTERVAL_MS', 1)),
+    PROFILING_DIR=os.environ.get('PROFILING_DIR', 'profiles'),
+    PROFILING_MAX_PROFILES=int(os.environ.get('PROFILING_MAX_PROFILES', 100)),
+    JOBS_RESULTS_DIR=os.environ.get('JOBS_RESULTS_DIR', 'jobs_results'),
+    JOBS_LOCK_TIMEOUT_SECONDS=float(os.environ.get('JOBS_LOCK_TIMEOUT_SECONDS', 60)),
+    JOBS_POLL_INTERVAL_SECONDS=float(os.environ.get('JOBS_POLL_INTERVAL_SECONDS', 1)),
+    ARCHIVE_DIR=os.environ.get('ARCHIVE_DIR', 'archive'),
+    SEARCH_EXACT_COUNT_PAGE_FACTOR=int(os.environ.get('SEARCH_EXACT_COUNT_PAGE_FACTOR', 4)),
+    STATEMENT_CACHE_SIZE=int(os.environ.get('STATEMENT_CACHE_SIZE', 1000)),
+    ADMISSION_CLASSES=_admission_classes(),
+    RATE_LIMIT_PER_SECOND=float(os.environ.get('RATE_LIMIT_PER_SECOND', 0)),
+    RATE_LIMIT_BURST=int(os.environ.get('RATE_LIMIT_BURST', 40)),
 )
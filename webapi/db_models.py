@@ -2,18 +2,56 @@
 Модуль содержит ORM-модели для БД приложения.
 """
 
+from flask import request, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.dialects.postgresql import ARRAY
+from flask_sqlalchemy.session import Session
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 
 __all__ = ('db',
+           'REPLICA_BIND_KEY_PREFIX',
+           'REPLICA_BIND_KEY_ENVIRON_KEY',
+           'get_replica_bind_keys',
            'Account',
            'Location',
            'VisitedLocation',
            'AnimalType',
            'Animal',
+           'Job',
+           'HeatmapCount',
            )
 
-db = SQLAlchemy()
+# Реплики БД для чтения задаются в `SQLALCHEMY_BINDS` с ключами вида "replica_0", "replica_1", ...
+REPLICA_BIND_KEY_PREFIX = 'replica_'
+# Ключ WSGI-окружения запроса, в котором хранится ключ выбранной для запроса реплики.
+REPLICA_BIND_KEY_ENVIRON_KEY = 'webapi.replica_bind_key'
+
+
+class RoutingSession(Session):
+    """
+    Сессия, которая направляет запросы на реплику БД, если для текущего запроса
+    она была выбрана (см. `read_from_replica` в модуле `resources_utils`).
+    Запись (flush) всегда выполняется на основной БД.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # Сессия, явно привязанная к соединению (см. модуль `batch`), работает только через него.
+        if bind is None and self.bind is not None:
+            return self.bind
+        if bind is None and not self._flushing and has_request_context():
+            replica_bind_key = request.environ.get(REPLICA_BIND_KEY_ENVIRON_KEY)
+            if replica_bind_key is not None:
+                return self._db.engines[replica_bind_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def get_replica_bind_keys() -> list[str]:
+    """Возвращает ключи `SQLALCHEMY_BINDS`, соответствующие репликам БД."""
+    return sorted(key for key in db.engines
+                  if key is not None and key.startswith(REPLICA_BIND_KEY_PREFIX))
 
 
 class Account(db.Model):
@@ -24,10 +62,13 @@ class Account(db.Model):
     last_name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(100), nullable=False)
+    # До какого момента GET-запросы аккаунта читают с основной БД (см. `read_from_replica`).
+    primary_sticky_until = db.Column(db.DateTime(timezone=True))
 
 
 class Location(db.Model):
     __tablename__ = 'locations'
+    __table_args__ = (db.UniqueConstraint('latitude', 'longitude'),)
 
     id = db.Column(db.Integer, primary_key=True)
     latitude = db.Column(db.Float, nullable=False)
@@ -36,21 +77,36 @@ class Location(db.Model):
 
 class VisitedLocation(db.Model):
     __tablename__ = 'visited_locations'
+    # Таблица разбита на помесячные партиции по дате посещения (см. модуль `partitions`).
+    # Ключ партиционирования обязан входить в первичный ключ таблицы,
+    # однако ORM по-прежнему идентифицирует объекты только по `id`.
+    # Индекс по (location_id, visit_datetime) позволяет читать посещения в порядке,
+    # нужном для поиска встреч животных (см. модуль `encounters`), без сортировки.
+    __table_args__ = (db.Index('ix_visited_locations_location_id_visit_datetime', 'location_id', 'visit_datetime',
+                               postgresql_include=['animal_id']),
+                      dict(postgresql_partition_by='RANGE (visit_datetime)'))
 
-    id = db.Column(db.Integer, primary_key=True)
-    visit_datetime = db.Column(db.DateTime(timezone=True), nullable=False)
-    location_id = db.Column(db.Integer, nullable=False)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    visit_datetime = db.Column(db.DateTime(timezone=True), primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id', ondelete='RESTRICT'),
+                            nullable=False)
+    # Животное, посетившее точку (NULL - если животное удалено).
+    animal_id = db.Column(db.Integer, db.ForeignKey('animals.id', ondelete='SET NULL'), index=True)
+
+    __mapper_args__ = dict(primary_key=[id])
 
 
 class AnimalType(db.Model):
     __tablename__ = 'animal_types'
 
     id = db.Column(db.Integer, primary_key=True)
-    type = db.Column(db.String, nullable=False)
+    type = db.Column(db.String, unique=True, nullable=False)
 
 
 class Animal(db.Model):
     __tablename__ = 'animals'
+    # GIN-индекс ускоряет поиск животных по вхождению типа в "animalTypes".
+    __table_args__ = (db.Index('ix_animals_animal_types', 'animal_types', postgresql_using='gin'),)
 
     id = db.Column(db.Integer, primary_key=True)
     animal_types = db.Column(ARRAY(db.Integer), nullable=False)
@@ -60,7 +116,46 @@ class Animal(db.Model):
     gender = db.Column(db.String, nullable=False)
     life_status = db.Column(db.String, nullable=False, default='ALIVE')
     chipping_datetime = db.Column(db.DateTime(timezone=True), nullable=False)
-    chipper_id = db.Column(db.Integer, nullable=False)
-    chipping_location_id = db.Column(db.Integer, nullable=False)
+    chipper_id = db.Column(db.Integer, db.ForeignKey('accounts.id', ondelete='RESTRICT'),
+                           nullable=False, index=True)
+    chipping_location_id = db.Column(db.Integer, db.ForeignKey('locations.id', ondelete='RESTRICT'),
+                                     nullable=False, index=True)
     visited_locations = db.Column(ARRAY(db.Integer), default=[])
     death_datetime = db.Column(db.DateTime(timezone=True), default=None)
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    # Индекс для выборки очередных задач воркерами.
+    __table_args__ = (db.Index('ix_jobs_queue', 'run_after_datetime',
+                               postgresql_where=db.text("status IN ('QUEUED', 'RUNNING')")),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=False)
+    params = db.Column(JSONB, nullable=False)
+    # QUEUED -> RUNNING -> DONE / FAILED (или снова QUEUED для повторной попытки).
+    status = db.Column(db.String, nullable=False, default='QUEUED')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    result = db.Column(JSONB, default=None)
+    error = db.Column(db.String, default=None)
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id', ondelete='SET NULL'), index=True)
+    created_datetime = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+    # Не раньше какого момента задачу можно (повторно) запускать.
+    run_after_datetime = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+    # До какого момента задача считается выполняемой воркером (после - воркер считается упавшим).
+    locked_until_datetime = db.Column(db.DateTime(timezone=True), default=None)
+    finished_datetime = db.Column(db.DateTime(timezone=True), default=None)
+
+
+class HeatmapCount(db.Model):
+    __tablename__ = 'heatmap_counts'
+
+    # Тип животного (0 - все животные) стоит первым: запрос тайла фильтрует по нему на равенство.
+    animal_type_id = db.Column(db.Integer, primary_key=True)
+    # Координаты ячейки сетки тепловой карты (см. модуль `heatmap`).
+    cell_x = db.Column(db.Integer, primary_key=True)
+    cell_y = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    visits_count = db.Column(db.Integer, nullable=False, default=0)
+    chipped_count = db.Column(db.Integer, nullable=False, default=0)
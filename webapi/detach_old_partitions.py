@@ -0,0 +1,23 @@
+"""
+Отсоединяет партиции `visited_locations` старше указанного числа месяцев (по умолчанию - 12)
+и, если партиции были отсоединены, пересчитывает тепловую карту.
+Пример: python -m webapi.detach_old_partitions 24
+"""
+
+import sys
+from datetime import datetime, timezone
+
+from webapi.__init__ import configure_app_and_db
+from webapi.partitions import detach_visited_locations_partitions_before
+from webapi.heatmap import recompute_heatmap
+
+configure_app_and_db()
+months = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+now = datetime.now(timezone.utc)
+total_months = now.year * 12 + now.month - 1 - months
+detached_partitions_names = detach_visited_locations_partitions_before(
+    datetime(total_months // 12, total_months % 12 + 1, 1, tzinfo=timezone.utc))
+for partition_name in detached_partitions_names:
+    print(partition_name)
+if detached_partitions_names:
+    recompute_heatmap()
@@ -0,0 +1,85 @@
+"""
+Модуль содержит поиск встреч животных: пар посещений одной точки локации разными
+животными с разницей во времени не больше заданного окна.
+Посещения читаются потоком в порядке (location_id, visit_datetime), который
+обеспечивает индекс `ix_visited_locations_location_id_visit_datetime`, и обходятся
+скользящим окном (sort-merge sweep): каждое посещение сравнивается только
+с посещениями той же точки, попавшими в окно, поэтому память не зависит от объёма таблицы.
+"""
+
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+from sqlalchemy import select
+
+from webapi.db_models import db, Animal, VisitedLocation
+
+__all__ = (
+    'sweep_encounters',
+    'find_encounters',
+)
+
+# Количество строк, получаемых из БД за раз.
+_FETCH_CHUNK_SIZE = 10_000
+
+
+def sweep_encounters(visits: Iterable[tuple[int, datetime, int, int]],
+                     window: timedelta) -> Iterator[tuple[int, tuple[int, datetime, int], tuple[int, datetime, int]]]:
+    """
+    Находит встречи по посещениям (location_id, visit_datetime, animal_id, visited_location_id),
+    отсортированным по (location_id, visit_datetime).
+    Возвращает тройки (location_id, более раннее посещение, более позднее посещение),
+    где посещение - (visited_location_id, visit_datetime, animal_id).
+    """
+    current_location_id = None
+    # Посещения текущей точки локации, попадающие в окно перед очередным посещением.
+    window_visits: deque[tuple[int, datetime, int]] = deque()
+    for location_id, visit_datetime, animal_id, visited_location_id in visits:
+        if location_id != current_location_id:
+            current_location_id = location_id
+            window_visits.clear()
+        while window_visits and window_visits[0][1] < visit_datetime - window:
+            window_visits.popleft()
+        visit = (visited_location_id, visit_datetime, animal_id)
+        for earlier_visit in window_visits:
+            if earlier_visit[2] != animal_id:
+                yield location_id, earlier_visit, visit
+        window_visits.append(visit)
+
+
+def find_encounters(window: timedelta,
+                    start_datetime: datetime | None = None, end_datetime: datetime | None = None,
+                    location_id: int | None = None,
+                    animal_type_id: int | None = None,
+                    ) -> Iterator[tuple[int, tuple[int, datetime, int], tuple[int, datetime, int]]]:
+    """
+    Находит встречи животных по посещениям из БД в диапазоне даты и времени
+    (и в одной точке локации, если указан `location_id`).
+    Если указан `animal_type_id`, то учитываются только животные этого типа.
+    """
+    filter_args = [VisitedLocation.animal_id.is_not(None)]
+    if start_datetime:
+        filter_args.append(VisitedLocation.visit_datetime >= start_datetime)
+    if end_datetime:
+        filter_args.append(VisitedLocation.visit_datetime <= end_datetime)
+    if location_id:
+        filter_args.append(VisitedLocation.location_id == location_id)
+
+    animal_ids = None
+    if animal_type_id:
+        # ID животных типа загружаются заранее (по GIN-индексу), чтобы не соединять таблицы
+        # и сохранить порядок чтения посещений по индексу.
+        animal_ids = set(db.session.execute(
+            select(Animal.id).where(Animal.animal_types.contains([animal_type_id]))
+        ).scalars())
+
+    visits = db.session.execute(
+        select(VisitedLocation.location_id, VisitedLocation.visit_datetime,
+               VisitedLocation.animal_id, VisitedLocation.id)
+        .where(*filter_args)
+        .order_by(VisitedLocation.location_id, VisitedLocation.visit_datetime)
+        .execution_options(yield_per=_FETCH_CHUNK_SIZE)
+    )
+    if animal_ids is not None:
+        visits = (visit for visit in visits if visit[2] in animal_ids)
+    return sweep_encounters(visits, window)
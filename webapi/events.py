@@ -0,0 +1,169 @@
+"""
+Модуль содержит публикацию событий об изменениях животных и их перемещениях
+и подписку на них. События рассылаются между процессами приложения через
+Postgres LISTEN/NOTIFY, а внутри процесса - по подпискам клиентов.
+Через тот же поток процесса, слушающий уведомления, другие модули могут получать
+сообщения своих каналов (см. `listen_channel`).
+"""
+
+import json
+import select
+import threading
+import time
+from collections import deque
+from typing import Callable
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from webapi.db_models import db
+
+__all__ = (
+    'EVENTS_CHANNEL',
+    'EventSubscription',
+    'publish_event',
+    'notify',
+    'listen_channel',
+    'subscribe',
+    'unsubscribe',
+)
+
+# Канал Postgres LISTEN/NOTIFY.
+EVENTS_CHANNEL = 'animal_events'
+# Наибольший размер сообщения NOTIFY в байтах (ограничение Postgres - меньше 8000 байт).
+_MAX_PAYLOAD_SIZE = 7_900
+
+
+def publish_event(name: str, animal_id: int, location_ids: list[int], data: dict) -> None:
+    """
+    Публикует событие в текущей транзакции БД: подписчики получат его
+    только после её фиксации (и не получат, если она будет отменена).
+    `location_ids` - ID точек локации, подписчики которых должны получить событие.
+    Если событие с данными `data` не помещается в сообщение NOTIFY, то оно публикуется
+    без данных (подписчик может запросить объект по ID).
+    """
+    event = dict(event=name, animalId=animal_id, locationPointIds=location_ids, data=data)
+    payload = json.dumps(event)
+    if len(payload.encode()) > _MAX_PAYLOAD_SIZE:
+        payload = json.dumps(dict(event, data=None))
+    notify(EVENTS_CHANNEL, payload)
+
+
+def notify(channel: str, payload: str) -> None:
+    """Отправляет сообщение в канал LISTEN/NOTIFY в текущей транзакции БД (доставляется после её фиксации)."""
+    db.session.execute(text('SELECT pg_notify(:channel, :payload)'), dict(channel=channel, payload=payload))
+
+
+class EventSubscription:
+    """
+    Подписка клиента на события конкретных животных и/или точек локации
+    (если не указаны ни те, ни другие - на все события).
+    Буфер событий ограничен: при переполнении отбрасываются самые старые события.
+    """
+
+    def __init__(self, animal_ids: list[int] | None, location_ids: list[int] | None,
+                 buffer_size: int) -> None:
+        self.animal_ids = set(animal_ids or [])
+        self.location_ids = set(location_ids or [])
+        self._events: deque[dict] = deque(maxlen=buffer_size)
+        self._condition = threading.Condition()
+
+    def matches(self, event: dict) -> bool:
+        if not self.animal_ids and not self.location_ids:
+            return True
+        return (event['animalId'] in self.animal_ids or
+                not self.location_ids.isdisjoint(event['locationPointIds']))
+
+    def put(self, event: dict) -> None:
+        with self._condition:
+            self._events.append(event)
+            self._condition.notify()
+
+    def get(self, timeout: float) -> dict | None:
+        """Возвращает следующее событие, либо None, если за `timeout` секунд событий не было."""
+        with self._condition:
+            if not self._events:
+                self._condition.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+_subscriptions: set[EventSubscription] = set()
+_subscriptions_lock = threading.Lock()
+_listener_thread: threading.Thread | None = None
+# Канал -> (обработчик разобранного сообщения, обработчик (пере)подключения к БД или None).
+# Сообщения, отправленные, пока соединения нет, теряются - об этом сообщает второй обработчик.
+_channels_handlers: dict[str, tuple[Callable[[dict], None], Callable[[], None] | None]] = {}
+# Время ожидания уведомлений, после которого поток проверяет, не добавились ли каналы.
+_POLL_INTERVAL_SECONDS = 1
+
+
+def _dispatch(event: dict) -> None:
+    with _subscriptions_lock:
+        subscriptions = list(_subscriptions)
+    for subscription in subscriptions:
+        if subscription.matches(event):
+            subscription.put(event)
+
+
+def _listen(engine: Engine) -> None:
+    """
+    Получает уведомления Postgres и раздаёт их подписчикам процесса
+    и обработчикам каналов (выполняется в отдельном потоке).
+    """
+    while True:
+        connection = None
+        try:
+            # Отдельное соединение, изъятое из пула, используется только для LISTEN.
+            connection = engine.raw_connection()
+            connection.detach()
+            driver_connection = connection.driver_connection
+            driver_connection.autocommit = True
+            listened_channels = set()
+            while True:
+                for channel in _channels_handlers.keys() - listened_channels:
+                    driver_connection.cursor().execute(f'LISTEN {channel}')
+                    listened_channels.add(channel)
+                    on_connect = _channels_handlers[channel][1]
+                    if on_connect is not None:
+                        on_connect()
+                if select.select([driver_connection], [], [], _POLL_INTERVAL_SECONDS) == ([], [], []):
+                    continue
+                driver_connection.poll()
+                while driver_connection.notifies:
+                    notification = driver_connection.notifies.pop(0)
+                    _channels_handlers[notification.channel][0](json.loads(notification.payload))
+        except Exception:
+            # Соединение с БД потеряно - переподключаемся через некоторое время.
+            if connection is not None:
+                connection.invalidate()
+            time.sleep(1)
+
+
+def listen_channel(channel: str, handler: Callable[[dict], None],
+                   on_connect: Callable[[], None] | None = None) -> None:
+    """
+    Начинает получать сообщения (JSON) канала `channel`: `handler` вызывается для каждого
+    сообщения в потоке, слушающем уведомления (он запускается при первом вызове),
+    а `on_connect` - каждый раз, когда канал начинает прослушиваться (в том числе после потери
+    соединения с БД, при которой сообщения могли быть пропущены).
+    """
+    global _listener_thread
+    with _subscriptions_lock:
+        _channels_handlers.setdefault(channel, (handler, on_connect))
+        if _listener_thread is None:
+            _listener_thread = threading.Thread(target=_listen, args=(db.engine,), daemon=True)
+            _listener_thread.start()
+
+
+def subscribe(animal_ids: list[int] | None, location_ids: list[int] | None,
+              buffer_size: int) -> EventSubscription:
+    """Создаёт подписку на события (канал `EVENTS_CHANNEL` начинает прослушиваться при первой подписке)."""
+    subscription = EventSubscription(animal_ids, location_ids, buffer_size)
+    with _subscriptions_lock:
+        _subscriptions.add(subscription)
+    listen_channel(EVENTS_CHANNEL, _dispatch)
+    return subscription
+
+
+def unsubscribe(subscription: EventSubscription) -> None:
+    with _subscriptions_lock:
+        _subscriptions.discard(subscription)
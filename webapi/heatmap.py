@@ -0,0 +1,299 @@
+"""
+Модуль содержит тепловую карту посещений и чипирований животных по тайлам z/x/y
+(веб-проекция Меркатора, как у тайлов OpenStreetMap).
+Счётчики хранятся в таблице `heatmap_counts` по ячейкам сетки масштаба `HEATMAP_BASE_ZOOM`,
+дням (UTC) и типам животных (тип `ALL_ANIMAL_TYPES` - все животные); ячейки более крупных
+масштабов получаются сдвигом координат ячейки. Счётчики обновляются обработчиками
+изменений животных, посещённых точек и координат точек локации в той же транзакции
+(строки счётчиков изменяются в порядке первичного ключа, чтобы параллельные транзакции
+не блокировали друг друга взаимно), а полностью пересчитываются
+через `python -m webapi.recompute_heatmap` (например, после отсоединения старых партиций).
+Перевод координат точек локации в ячейки выполняется векторно (NumPy).
+"""
+
+from collections import Counter
+from datetime import date, datetime, timezone
+from typing import Iterable
+import numpy as np
+from sqlalchemy import any_, bindparam, func, select, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+
+from webapi.db_models import db, Animal, HeatmapCount, Location, VisitedLocation
+from webapi.statement_cache import statement_cache
+
+__all__ = (
+    'HEATMAP_BASE_ZOOM',
+    'ALL_ANIMAL_TYPES',
+    'location_cells',
+    'count_chippings',
+    'count_visits',
+    'count_animals',
+    'move_location_counts',
+    'tile_cells',
+    'recompute_heatmap',
+)
+
+# Масштаб сетки, по ячейкам которой хранятся счётчики (ячейка - около 600 м на экваторе).
+HEATMAP_BASE_ZOOM = 16
+# Значение `animal_type_id` для счётчиков по всем животным независимо от типа.
+ALL_ANIMAL_TYPES = 0
+# Предельная широта веб-проекции Меркатора.
+_MAX_LATITUDE = 85.05112878
+# Количество строк, вставляемых за раз при полном пересчёте.
+_INSERT_CHUNK_SIZE = 10_000
+
+
+def location_cells(latitudes: np.ndarray, longitudes: np.ndarray,
+                   zoom: int = HEATMAP_BASE_ZOOM) -> tuple[np.ndarray, np.ndarray]:
+    """Возвращает координаты (x, y) ячеек масштаба `zoom`, в которые попадают точки."""
+    cells_per_side = 1 << zoom
+    latitudes = np.radians(np.clip(latitudes, -_MAX_LATITUDE, _MAX_LATITUDE))
+    xs = np.floor((longitudes + 180) / 360 * cells_per_side)
+    ys = np.floor((1 - np.log(np.tan(latitudes) + 1 / np.cos(latitudes)) / np.pi) / 2 * cells_per_side)
+    return (np.clip(xs, 0, cells_per_side - 1).astype(np.int64),
+            np.clip(ys, 0, cells_per_side - 1).astype(np.int64))
+
+
+def _utc_date(value: datetime) -> date:
+    return value.astimezone(timezone.utc).date()
+
+
+def _animal_type_ids(animal: Animal, animal_type_ids: list[int] | None) -> list[int]:
+    return [*animal.animal_types, ALL_ANIMAL_TYPES] if animal_type_ids is None else animal_type_ids
+
+
+def _apply_cell_deltas(deltas: Counter[tuple[int, int, int, date, str]]) -> None:
+    """
+    Прибавляет к счётчикам изменения вида (ID типа, x ячейки, y ячейки, день, счётчик) -> изменение
+    (одним запросом "INSERT ... ON CONFLICT DO UPDATE", строки - в порядке первичного ключа).
+    """
+    rows: dict[tuple, dict] = {}
+    for (animal_type_id, cell_x, cell_y, day, counter_name), delta in deltas.items():
+        if not delta:
+            continue
+        row = rows.setdefault((animal_type_id, cell_x, cell_y, day),
+                              dict(animal_type_id=animal_type_id, cell_x=cell_x, cell_y=cell_y, day=day,
+                                   visits_count=0, chipped_count=0))
+        row[counter_name] += delta
+    if not rows:
+        return
+
+    statement = pg_insert(HeatmapCount).values([rows[key] for key in sorted(rows)])
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[HeatmapCount.animal_type_id, HeatmapCount.cell_x, HeatmapCount.cell_y, HeatmapCount.day],
+        set_=dict(visits_count=HeatmapCount.visits_count + statement.excluded.visits_count,
+                  chipped_count=HeatmapCount.chipped_count + statement.excluded.chipped_count),
+    ))
+
+
+def _apply_deltas(deltas: Counter[tuple[int, date, int, str]]) -> None:
+    """
+    Прибавляет к счётчикам изменения вида (ID точки локации, день, ID типа, счётчик) -> изменение.
+    Точки локации читаются с блокировкой "FOR SHARE": пока транзакция изменения координат
+    точки (см. `move_location_counts`) не завершена, счётчики по этой точке не изменяются.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    location_ids = sorted({location_id for location_id, *_ in deltas})
+    locations = db.session.execute(
+        select(Location.id, Location.latitude, Location.longitude)
+        .where(Location.id == any_(bindparam('ids', location_ids, type_=ARRAY(db.Integer))))
+        .order_by(Location.id)
+        .with_for_update(read=True)
+    ).all()
+    xs, ys = location_cells(np.array([location.latitude for location in locations], dtype=np.float64),
+                            np.array([location.longitude for location in locations], dtype=np.float64))
+    cell_by_location_id = {location.id: (int(x), int(y)) for location, x, y in zip(locations, xs, ys)}
+
+    cell_deltas = Counter()
+    for (location_id, day, animal_type_id, counter_name), delta in deltas.items():
+        cell_deltas[(animal_type_id, *cell_by_location_id[location_id], day, counter_name)] += delta
+    _apply_cell_deltas(cell_deltas)
+
+
+def _chipping_deltas(animals: Iterable[Animal], sign: int, animal_type_ids: list[int] | None) -> Counter:
+    deltas = Counter()
+    for animal in animals:
+        for animal_type_id in _animal_type_ids(animal, animal_type_ids):
+            deltas[animal.chipping_location_id, _utc_date(animal.chipping_datetime),
+                   animal_type_id, 'chipped_count'] += sign
+    return deltas
+
+
+def _visit_deltas(animals_visited_locations: Iterable[tuple[Animal, VisitedLocation]], sign: int,
+                  animal_type_ids: list[int] | None) -> Counter:
+    deltas = Counter()
+    for animal, visited_location in animals_visited_locations:
+        for animal_type_id in _animal_type_ids(animal, animal_type_ids):
+            deltas[visited_location.location_id, _utc_date(visited_location.visit_datetime),
+                   animal_type_id, 'visits_count'] += sign
+    return deltas
+
+
+def count_chippings(animals: Iterable[Animal], sign: int = 1, animal_type_ids: list[int] | None = None) -> None:
+    """
+    Учитывает (`sign` = 1) или перестаёт учитывать (`sign` = -1) чипирование животных
+    для типов `animal_type_ids` (по умолчанию - для всех типов животного и для всех животных).
+    """
+    _apply_deltas(_chipping_deltas(animals, sign, animal_type_ids))
+
+
+def count_visits(animal: Animal, visited_locations: Iterable[VisitedLocation], sign: int = 1,
+                 animal_type_ids: list[int] | None = None) -> None:
+    """Учитывает или перестаёт учитывать посещённые животным точки (аналогично `count_chippings`)."""
+    _apply_deltas(_visit_deltas(((animal, visited_location) for visited_location in visited_locations),
+                                sign, animal_type_ids))
+
+
+def count_animals(animals: list[Animal], sign: int = 1, animal_type_ids: list[int] | None = None) -> None:
+    """
+    Учитывает или перестаёт учитывать чипирование животных вместе со всеми их посещёнными точками
+    (посещённые точки загружаются одним запросом).
+    """
+    animal_by_visited_location_id = {_id: animal for animal in animals for _id in animal.visited_locations or []}
+    visited_locations = db.session.execute(
+        select(VisitedLocation.id, VisitedLocation.location_id, VisitedLocation.visit_datetime)
+        .where(VisitedLocation.id == any_(bindparam('ids', list(animal_by_visited_location_id),
+                                                    type_=ARRAY(db.Integer))))
+    ).all()
+    deltas = _visit_deltas(((animal_by_visited_location_id[visited_location.id], visited_location)
+                            for visited_location in visited_locations), sign, animal_type_ids)
+    deltas.update(_chipping_deltas(animals, sign, animal_type_ids))
+    _apply_deltas(deltas)
+
+
+def move_location_counts(location_id: int, old_coordinates: tuple[float, float],
+                         new_coordinates: tuple[float, float]) -> None:
+    """
+    Переносит счётчики точки локации (её посещения и чипирования) из ячейки старых координат
+    (широта, долгота) в ячейку новых. Вызывается после изменения координат точки в той же транзакции
+    (изменение блокирует строку точки, поэтому параллельные изменения счётчиков по ней дождутся его фиксации).
+    """
+    (old_x, new_x), (old_y, new_y) = location_cells(
+        np.array([old_coordinates[0], new_coordinates[0]], dtype=np.float64),
+        np.array([old_coordinates[1], new_coordinates[1]], dtype=np.float64))
+    if (old_x, old_y) == (new_x, new_y):
+        return
+
+    rows = db.session.execute(text(
+        # Посещения точки животными (только точки из "visitedLocations" животных) по дням и типам.
+        'SELECT (v.visit_datetime AT TIME ZONE \'UTC\')::date, t.animal_type_id, count(*), 0 '
+        'FROM visited_locations v '
+        'JOIN animals a ON a.id = v.animal_id AND v.id = ANY(a.visited_locations) '
+        'CROSS JOIN LATERAL unnest(a.animal_types || :all_types) AS t(animal_type_id) '
+        'WHERE v.location_id = :location_id '
+        'GROUP BY 1, 2 '
+        'UNION ALL '
+        # Чипирования в точке по дням и типам.
+        'SELECT (a.chipping_datetime AT TIME ZONE \'UTC\')::date, t.animal_type_id, 0, count(*) '
+        'FROM animals a '
+        'CROSS JOIN LATERAL unnest(a.animal_types || :all_types) AS t(animal_type_id) '
+        'WHERE a.chipping_location_id = :location_id '
+        'GROUP BY 1, 2'
+    ), dict(location_id=location_id, all_types=ALL_ANIMAL_TYPES)).all()
+
+    cell_deltas = Counter()
+    for day, animal_type_id, visits_count, chipped_count in rows:
+        for cell_x, cell_y, sign in ((int(old_x), int(old_y), -1), (int(new_x), int(new_y), 1)):
+            cell_deltas[animal_type_id, cell_x, cell_y, day, 'visits_count'] += sign * visits_count
+            cell_deltas[animal_type_id, cell_x, cell_y, day, 'chipped_count'] += sign * chipped_count
+    _apply_cell_deltas(cell_deltas)
+
+
+def tile_cells(z: int, x: int, y: int, resolution: int,
+               start_datetime: datetime | None = None, end_datetime: datetime | None = None,
+               animal_type_id: int | None = None) -> list[dict]:
+    """
+    Возвращает ненулевые счётчики ячеек тайла z/x/y, разбитого на 2^`resolution` x 2^`resolution` ячеек.
+    Координаты ячеек (x, y) - относительно левого верхнего угла тайла.
+    Диапазон даты и времени применяется с точностью до дня (UTC).
+    """
+    def build_statement():
+        filter_args = [HeatmapCount.animal_type_id == bindparam('animal_type_id'),
+                       HeatmapCount.cell_x.between(bindparam('min_x'), bindparam('max_x')),
+                       HeatmapCount.cell_y.between(bindparam('min_y'), bindparam('max_y'))]
+        if start_datetime:
+            filter_args.append(HeatmapCount.day >= bindparam('start_day'))
+        if end_datetime:
+            filter_args.append(HeatmapCount.day <= bindparam('end_day'))
+        cell_x = HeatmapCount.cell_x.op('>>')(bindparam('shift')) - bindparam('origin_x')
+        cell_y = HeatmapCount.cell_y.op('>>')(bindparam('shift')) - bindparam('origin_y')
+        visits_count, chipped_count = func.sum(HeatmapCount.visits_count), func.sum(HeatmapCount.chipped_count)
+        return (select(cell_x, cell_y, visits_count, chipped_count)
+                .where(*filter_args)
+                .group_by(cell_x, cell_y)
+                .having((visits_count > 0) | (chipped_count > 0)))
+
+    statement = statement_cache.get(('heatmap_tile', start_datetime is not None, end_datetime is not None),
+                                    build_statement)
+    # Ячейки базовой сетки, покрываемые тайлом.
+    tile_shift = HEATMAP_BASE_ZOOM - z
+    rows = db.session.execute(statement, dict(
+        animal_type_id=animal_type_id or ALL_ANIMAL_TYPES,
+        min_x=x << tile_shift, max_x=((x + 1) << tile_shift) - 1,
+        min_y=y << tile_shift, max_y=((y + 1) << tile_shift) - 1,
+        start_day=start_datetime and _utc_date(start_datetime),
+        end_day=end_datetime and _utc_date(end_datetime),
+        shift=tile_shift - resolution,
+        origin_x=x << resolution, origin_y=y << resolution,
+    )).all()
+    return [dict(x=cell_x, y=cell_y, visits=visits, chippedAnimals=chipped)
+            for cell_x, cell_y, visits, chipped in rows]
+
+
+def recompute_heatmap() -> int:
+    """
+    Полностью пересчитывает счётчики по данным БД в одной транзакции.
+    Из БД берутся счётчики по точкам локации, а распределение точек по ячейкам
+    и суммирование по ячейкам выполняются векторно. Возвращает количество строк счётчиков.
+    """
+    # Таблица очищается до подсчёта: TRUNCATE удерживает её блокировку до конца транзакции,
+    # поэтому изменения счётчиков, не попавшие в подсчёт, применятся уже после пересчёта.
+    db.session.execute(text(f'TRUNCATE {HeatmapCount.__tablename__}'))
+    rows = db.session.execute(text(
+        # Посещённые точки животных (из "visitedLocations") по дням и типам.
+        'SELECT v.location_id, (v.visit_datetime AT TIME ZONE \'UTC\')::date, t.animal_type_id, count(*), 0 '
+        'FROM animals a '
+        'CROSS JOIN LATERAL unnest(a.visited_locations) AS vl(id) '
+        'JOIN visited_locations v ON v.id = vl.id '
+        'CROSS JOIN LATERAL unnest(a.animal_types || :all_types) AS t(animal_type_id) '
+        'GROUP BY 1, 2, 3 '
+        'UNION ALL '
+        # Чипирования по дням и типам.
+        'SELECT a.chipping_location_id, (a.chipping_datetime AT TIME ZONE \'UTC\')::date, t.animal_type_id, 0, count(*) '
+        'FROM animals a '
+        'CROSS JOIN LATERAL unnest(a.animal_types || :all_types) AS t(animal_type_id) '
+        'GROUP BY 1, 2, 3'
+    ), dict(all_types=ALL_ANIMAL_TYPES)).all()
+    if not rows:
+        db.session.commit()
+        return 0
+
+    location_ids, days, animal_type_ids, visits, chipped = (np.array(column) for column in zip(*rows))
+    locations = db.session.execute(select(Location.id, Location.latitude, Location.longitude)
+                                   .order_by(Location.id)).all()
+    locations_ids, latitudes, longitudes = (np.array(column) for column in zip(*locations))
+    xs, ys = location_cells(latitudes.astype(np.float64), longitudes.astype(np.float64))
+    # Позиции точек локации строк в отсортированном списке точек.
+    positions = np.searchsorted(locations_ids, location_ids)
+    day_ordinals = np.array([day.toordinal() for day in days], dtype=np.int64)
+
+    keys = np.column_stack((animal_type_ids.astype(np.int64), xs[positions], ys[positions], day_ordinals))
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    visits_sums = np.bincount(inverse, weights=visits.astype(np.int64), minlength=len(unique_keys)).astype(np.int64)
+    chipped_sums = np.bincount(inverse, weights=chipped.astype(np.int64), minlength=len(unique_keys)).astype(np.int64)
+
+    # `np.unique` возвращает ключи отсортированными - строки вставляются в порядке первичного ключа.
+    for start in range(0, len(unique_keys), _INSERT_CHUNK_SIZE):
+        chunk = slice(start, start + _INSERT_CHUNK_SIZE)
+        db.session.execute(pg_insert(HeatmapCount), [
+            dict(animal_type_id=int(animal_type_id), cell_x=int(cell_x), cell_y=int(cell_y),
+                 day=date.fromordinal(int(day_ordinal)), visits_count=int(visits_count),
+                 chipped_count=int(chipped_count))
+            for (animal_type_id, cell_x, cell_y, day_ordinal), visits_count, chipped_count
+            in zip(unique_keys[chunk], visits_sums[chunk], chipped_sums[chunk])
+        ])
+    db.session.commit()
+    return len(unique_keys)
@@ -0,0 +1,72 @@
+"""
+Модуль содержит виды фоновых задач (см. модуль `jobs`).
+"""
+
+import json
+import os
+from flask import current_app
+from flask_restful import marshal
+from sqlalchemy import any_, bindparam, delete
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from webapi.db_models import db, Animal, VisitedLocation, Job
+from webapi.validation_models import AnimalDeletionJobParams, AnimalsExportJobParams
+from webapi.resources_utils import animal_resource_fields
+from webapi.jobs import JobError, job_kind
+from webapi.heatmap import count_animals
+from webapi.search_index import publish_animals_changes
+
+__all__ = (
+    'delete_animal',
+    'export_animals',
+    'export_file_path',
+)
+
+
+@job_kind('animalDeletion', AnimalDeletionJobParams, concurrency=4)
+def delete_animal(job: Job, params: AnimalDeletionJobParams) -> dict:
+    """Удаляет животное вместе со всеми его посещёнными точками (одним запросом на каждую таблицу)."""
+    found_animal: Animal = db.session.get(Animal, params.animal_id)
+    if not found_animal:
+        raise JobError('Животное не найдено.')
+    # Проверка: для удаления животное должно находиться в точке чипирования.
+    if found_animal.visited_locations:
+        last_visited_location: VisitedLocation = db.session.get(VisitedLocation, found_animal.visited_locations[-1])
+        if last_visited_location.location_id != found_animal.chipping_location_id:
+            raise JobError('Животное не находится в точке чипирования.')
+
+    count_animals([found_animal], -1)
+    deleted_visited_locations_count = db.session.execute(
+        delete(VisitedLocation)
+        .where(VisitedLocation.id == any_(bindparam('ids', found_animal.visited_locations or [],
+                                                    type_=ARRAY(db.Integer))))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.delete(found_animal)
+    publish_animals_changes(removed_ids=[params.animal_id])
+    return dict(animalId=params.animal_id, deletedVisitedLocationsCount=deleted_visited_locations_count)
+
+
+def export_file_path(job: Job) -> str:
+    """Путь к файлу с результатом выгрузки."""
+    return os.path.join(current_app.config['JOBS_RESULTS_DIR'], f'{job.id}.jsonl')
+
+
+@job_kind('animalsExport', AnimalsExportJobParams, concurrency=1)
+def export_animals(job: Job, params: AnimalsExportJobParams) -> dict:
+    """Выгружает животных, подходящих под фильтры, в файл JSON Lines."""
+    filter_args = []
+    if params.start_datetime:
+        filter_args.append(Animal.chipping_datetime >= params.start_datetime)
+    if params.end_datetime:
+        filter_args.append(Animal.chipping_datetime <= params.end_datetime)
+    for param_name, value in params.dict(exclude={'start_datetime', 'end_datetime'}, exclude_none=True).items():
+        filter_args.append(getattr(Animal, param_name) == value)
+
+    os.makedirs(current_app.config['JOBS_RESULTS_DIR'], exist_ok=True)
+    animals_count = 0
+    with open(export_file_path(job), 'w', encoding='utf-8') as file:
+        for animal in Animal.query.filter(*filter_args).order_by('id').yield_per(10_000):
+            file.write(json.dumps(marshal(animal, animal_resource_fields)) + '\n')
+            animals_count += 1
+    return dict(animalsCount=animals_count)
@@ -0,0 +1,175 @@
+"""
+Модуль содержит очередь фоновых задач, хранящуюся в таблице `jobs`.
+Задачи выполняются отдельными процессами-воркерами (`python -m webapi.jobs_worker`),
+которые забирают их из таблицы через `SELECT ... FOR UPDATE SKIP LOCKED`.
+Пока задача выполняется, воркер периодически продлевает её блокировку, поэтому
+повторно забираются только задачи воркеров, переставших отвечать (например, упавших).
+Виды задач регистрируются декоратором `job_kind` (см. модуль `job_kinds`).
+"""
+
+import json
+import threading
+import traceback
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator
+import pydantic
+from sqlalchemy import func, or_ as sql_or, select, text, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from webapi.db_models import db, Job
+
+__all__ = (
+    'JobError',
+    'JobKind',
+    'job_kinds',
+    'job_kind',
+    'submit_job',
+    'run_next_job',
+)
+
+# Ключ рекомендательной блокировки Postgres, под которой воркеры по очереди забирают задачи
+# (чтобы ограничения на количество одновременно выполняемых задач соблюдались точно).
+_CLAIM_LOCK_KEY = 20230302
+
+
+class JobError(Exception):
+    """Ошибка выполнения задачи, при которой повторять задачу бессмысленно."""
+
+
+@dataclass
+class JobKind:
+    name: str
+    handler: Callable[[Job, pydantic.BaseModel], dict]
+    params_model: type[pydantic.BaseModel]
+    # Максимальное количество одновременно выполняемых задач этого вида.
+    concurrency: int
+    max_attempts: int
+
+
+# Название вида задачи -> вид задачи.
+job_kinds: dict[str, JobKind] = {}
+
+
+def job_kind(name: str, params_model: type[pydantic.BaseModel],
+             concurrency: int = 2, max_attempts: int = 3) -> Callable:
+    """
+    Регистрирует функцию-обработчик задач вида `name`.
+    Обработчик получает задачу и её провалидированные параметры и возвращает результат (JSON-объект).
+    Изменения в БД, сделанные обработчиком, фиксируются вместе с отметкой о выполнении задачи.
+    """
+    def decorator(handler: Callable) -> Callable:
+        job_kinds[name] = JobKind(name, handler, params_model, concurrency, max_attempts)
+        return handler
+    return decorator
+
+
+def submit_job(kind: JobKind, params: pydantic.BaseModel, account_id: int | None) -> Job:
+    """Ставит задачу в очередь."""
+    new_job = Job(kind=kind.name, params=json.loads(params.json(by_alias=True)), account_id=account_id,
+                  max_attempts=kind.max_attempts)
+    db.session.add(new_job)
+    db.session.commit()
+    return new_job
+
+
+def _claim_job(lock_timeout_seconds: float) -> Job | None:
+    """Забирает из очереди задачу, готовую к выполнению, и помечает её выполняемой."""
+    db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), dict(key=_CLAIM_LOCK_KEY))
+    now = datetime.now(timezone.utc)
+    running_counts = dict(db.session.execute(
+        select(Job.kind, func.count())
+        .where(Job.status == 'RUNNING', Job.locked_until_datetime > now)
+        .group_by(Job.kind)
+    ).all())
+    available_kinds = [kind.name for kind in job_kinds.values()
+                       if running_counts.get(kind.name, 0) < kind.concurrency]
+    if not available_kinds:
+        db.session.rollback()
+        return None
+
+    claimed_job = db.session.execute(
+        select(Job)
+        .where(Job.kind.in_(available_kinds),
+               Job.status.in_(('QUEUED', 'RUNNING')),
+               # Выполняемые задачи забираются повторно, только если воркер не уложился
+               # в отведённое время (например, упал).
+               sql_or(Job.locked_until_datetime.is_(None), Job.locked_until_datetime <= now),
+               Job.run_after_datetime <= now)
+        .order_by(Job.run_after_datetime, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar()
+    if claimed_job is None:
+        db.session.rollback()
+        return None
+
+    claimed_job.status = 'RUNNING'
+    claimed_job.attempts += 1
+    claimed_job.locked_until_datetime = now + timedelta(seconds=lock_timeout_seconds)
+    db.session.commit()
+    return claimed_job
+
+
+@contextmanager
+def _lock_heartbeat(job_id: int, lock_timeout_seconds: float) -> Iterator[None]:
+    """
+    Пока выполняется блок, продлевает блокировку задачи каждую треть `lock_timeout_seconds`.
+    Продление фиксируется на отдельном соединении, не затрагивая транзакцию обработчика задачи.
+    """
+    engine = db.engine
+    stopped = threading.Event()
+
+    def extend_lock() -> None:
+        while not stopped.wait(lock_timeout_seconds / 3):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(
+                        update(Job)
+                        .where(Job.id == job_id, Job.status == 'RUNNING')
+                        .values(locked_until_datetime=datetime.now(timezone.utc)
+                                + timedelta(seconds=lock_timeout_seconds))
+                    )
+            except SQLAlchemyError:
+                # Повторим при следующем продлении; если БД недоступна дольше `lock_timeout_seconds`,
+                # задача будет забрана другим воркером.
+                pass
+
+    heartbeat = threading.Thread(target=extend_lock, daemon=True)
+    heartbeat.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        heartbeat.join()
+
+
+def run_next_job(lock_timeout_seconds: float) -> bool:
+    """
+    Выполняет одну задачу из очереди. Неудачные задачи повторяются с экспоненциальной
+    задержкой, пока не исчерпаны попытки. Возвращает False, если выполнять было нечего.
+    """
+    job = _claim_job(lock_timeout_seconds)
+    if job is None:
+        return False
+
+    job_id, kind = job.id, job_kinds[job.kind]
+    try:
+        with _lock_heartbeat(job_id, lock_timeout_seconds):
+            result = kind.handler(job, kind.params_model(**job.params))
+        job.status, job.result = 'DONE', result
+    except Exception as exception:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.error = ''.join(traceback.format_exception_only(exception)).strip()
+        if isinstance(exception, JobError) or job.attempts >= job.max_attempts:
+            job.status = 'FAILED'
+        else:
+            job.status = 'QUEUED'
+            job.run_after_datetime = datetime.now(timezone.utc) + timedelta(seconds=2 ** job.attempts)
+    if job.status != 'QUEUED':
+        job.finished_datetime = datetime.now(timezone.utc)
+    job.locked_until_datetime = None
+    db.session.commit()
+    return True
@@ -0,0 +1,46 @@
+"""
+Запускает процессы-воркеры, выполняющие фоновые задачи из очереди (таблицы `jobs`).
+Пример: python -m webapi.jobs_worker [--processes 4]
+"""
+
+import argparse
+import multiprocessing
+import signal
+import sys
+import time
+
+
+def run_worker() -> None:
+    from webapi.__init__ import app, db, configure_app_and_db
+    from webapi.jobs import run_next_job
+    import webapi.job_kinds  # noqa: F401 (регистрация видов задач)
+
+    configure_app_and_db()
+    while True:
+        try:
+            if run_next_job(app.config['JOBS_LOCK_TIMEOUT_SECONDS']):
+                continue
+        except Exception:
+            # Например, потеряно соединение с БД - задача будет забрана повторно после истечения блокировки.
+            db.session.rollback()
+        time.sleep(app.config['JOBS_POLL_INTERVAL_SECONDS'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m webapi.jobs_worker')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    # При остановке контейнера (SIGTERM) завершаемся штатно, чтобы завершились и дочерние процессы.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    processes = [multiprocessing.Process(target=run_worker, daemon=True) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    # Упавшие воркеры перезапускаются (не чаще раза в секунду на каждый).
+    while True:
+        time.sleep(1)
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                print(f'Воркер {process.pid} завершился с кодом {process.exitcode}, перезапуск', file=sys.stderr)
+                processes[i] = multiprocessing.Process(target=run_worker, daemon=True)
+                processes[i].start()
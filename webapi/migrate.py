@@ -0,0 +1,21 @@
+"""
+Применяет миграции схемы БД и создаёт ближайшие партиции `visited_locations`.
+Пример: python -m webapi.migrate [--reset]
+(--reset - предварительно удаляет все таблицы приложения вместе с данными).
+"""
+
+import argparse
+
+from webapi.__init__ import app, configure_app_and_db
+from webapi.migrations import migrate, drop_schema
+from webapi.partitions import ensure_visited_locations_partitions
+
+parser = argparse.ArgumentParser(prog='python -m webapi.migrate')
+parser.add_argument('--reset', action='store_true', help='удалить все таблицы перед миграцией')
+args = parser.parse_args()
+
+configure_app_and_db(check_schema=False)
+if args.reset:
+    drop_schema()
+print(f'Применено миграций: {migrate()}')
+ensure_visited_locations_partitions(app.config['VISITED_LOCATIONS_PARTITIONS_AHEAD'])
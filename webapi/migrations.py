@@ -0,0 +1,244 @@
+"""
+Модуль содержит версионированные миграции схемы БД.
+Текущая версия схемы хранится в таблице `schema_version`.
+При запуске приложения выполняется только проверка версии (один запрос),
+а применение миграций выполняется отдельно через `python -m webapi.migrate`.
+"""
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from webapi.db_models import db
+from webapi.partitions import visited_locations_partition_ddl
+
+__all__ = (
+    'MIGRATIONS',
+    'SchemaVersionError',
+    'check_schema_version',
+    'migrate',
+    'drop_schema',
+)
+
+# Ключ рекомендательной блокировки Postgres, не дающей нескольким процессам мигрировать одновременно.
+_MIGRATION_LOCK_KEY = 20230301
+
+# Список миграций: i-й элемент переводит схему из версии i в версию i + 1.
+# Уже применённые миграции изменять нельзя - только добавлять новые в конец списка.
+MIGRATIONS: list[list[str]] = [
+    # 1: исходная схема.
+    [
+        '''CREATE TABLE IF NOT EXISTS accounts (
+            id SERIAL NOT NULL,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            email VARCHAR(100) NOT NULL,
+            password VARCHAR(100) NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (email)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS animal_types (
+            id SERIAL NOT NULL,
+            type VARCHAR NOT NULL,
+            PRIMARY KEY (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS animals (
+            id SERIAL NOT NULL,
+            animal_types INTEGER[] NOT NULL,
+            weight FLOAT NOT NULL,
+            length FLOAT NOT NULL,
+            height FLOAT NOT NULL,
+            gender VARCHAR NOT NULL,
+            life_status VARCHAR NOT NULL,
+            chipping_datetime TIMESTAMP WITH TIME ZONE NOT NULL,
+            chipper_id INTEGER NOT NULL,
+            chipping_location_id INTEGER NOT NULL,
+            visited_locations INTEGER[],
+            death_datetime TIMESTAMP WITH TIME ZONE,
+            PRIMARY KEY (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS locations (
+            id SERIAL NOT NULL,
+            latitude FLOAT NOT NULL,
+            longitude FLOAT NOT NULL,
+            PRIMARY KEY (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS visited_locations (
+            id SERIAL NOT NULL,
+            visit_datetime TIMESTAMP WITH TIME ZONE NOT NULL,
+            location_id INTEGER NOT NULL,
+            PRIMARY KEY (id, visit_datetime)
+        ) PARTITION BY RANGE (visit_datetime)''',
+    ],
+    # 2: внешние ключи (вместо проверок связанных записей перед удалением) и индексы для них.
+    [
+        'CREATE INDEX IF NOT EXISTS ix_animals_chipper_id ON animals (chipper_id)',
+        'CREATE INDEX IF NOT EXISTS ix_animals_chipping_location_id ON animals (chipping_location_id)',
+        'CREATE INDEX IF NOT EXISTS ix_visited_locations_location_id ON visited_locations (location_id)',
+        'CREATE INDEX IF NOT EXISTS ix_animals_animal_types ON animals USING gin (animal_types)',
+        '''ALTER TABLE animals ADD CONSTRAINT animals_chipper_id_fkey
+            FOREIGN KEY (chipper_id) REFERENCES accounts (id) ON DELETE RESTRICT''',
+        '''ALTER TABLE animals ADD CONSTRAINT animals_chipping_location_id_fkey
+            FOREIGN KEY (chipping_location_id) REFERENCES locations (id) ON DELETE RESTRICT''',
+        '''ALTER TABLE visited_locations ADD CONSTRAINT visited_locations_location_id_fkey
+            FOREIGN KEY (location_id) REFERENCES locations (id) ON DELETE RESTRICT''',
+    ],
+    # 3: уникальность координат локаций и названий типов животных (для создания через ON CONFLICT).
+    [
+        'ALTER TABLE locations ADD CONSTRAINT locations_latitude_longitude_key UNIQUE (latitude, longitude)',
+        'ALTER TABLE animal_types ADD CONSTRAINT animal_types_type_key UNIQUE (type)',
+    ],
+    # 4: очередь фоновых задач.
+    [
+        '''CREATE TABLE jobs (
+            id SERIAL NOT NULL,
+            kind VARCHAR NOT NULL,
+            params JSONB NOT NULL,
+            status VARCHAR NOT NULL,
+            attempts INTEGER NOT NULL,
+            max_attempts INTEGER NOT NULL,
+            result JSONB,
+            error VARCHAR,
+            account_id INTEGER,
+            created_datetime TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            run_after_datetime TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            locked_until_datetime TIMESTAMP WITH TIME ZONE,
+            finished_datetime TIMESTAMP WITH TIME ZONE,
+            PRIMARY KEY (id),
+            FOREIGN KEY (account_id) REFERENCES accounts (id) ON DELETE SET NULL
+        )''',
+        "CREATE INDEX ix_jobs_queue ON jobs (run_after_datetime) WHERE status IN ('QUEUED', 'RUNNING')",
+        'CREATE INDEX ix_jobs_account_id ON jobs (account_id)',
+    ],
+    # 5: животное посещённой точки и индекс (точка локации, дата посещения) для поиска встреч животных.
+    [
+        'ALTER TABLE visited_locations ADD COLUMN animal_id INTEGER',
+        '''UPDATE visited_locations SET animal_id = animals_visits.animal_id
+            FROM (SELECT id AS animal_id, unnest(visited_locations) AS visited_location_id FROM animals) animals_visits
+            WHERE visited_locations.id = animals_visits.visited_location_id''',
+        '''ALTER TABLE visited_locations ADD CONSTRAINT visited_locations_animal_id_fkey
+            FOREIGN KEY (animal_id) REFERENCES animals (id) ON DELETE SET NULL''',
+        'CREATE INDEX ix_visited_locations_animal_id ON visited_locations (animal_id)',
+        # Индекс по (location_id, visit_datetime) заменяет индекс по одному location_id.
+        '''CREATE INDEX ix_visited_locations_location_id_visit_datetime
+            ON visited_locations (location_id, visit_datetime) INCLUDE (animal_id)''',
+        'DROP INDEX ix_visited_locations_location_id',
+    ],
+    # 6: счётчики тепловой карты (заполняются через "python -m webapi.recompute_heatmap").
+    [
+        '''CREATE TABLE heatmap_counts (
+            animal_type_id INTEGER NOT NULL,
+            cell_x INTEGER NOT NULL,
+            cell_y INTEGER NOT NULL,
+            day DATE NOT NULL,
+            visits_count INTEGER NOT NULL,
+            chipped_count INTEGER NOT NULL,
+            PRIMARY KEY (animal_type_id, cell_x, cell_y, day)
+        )''',
+    ],
+    # 7: отметка аккаунта о недавнем изменении данных (чтение с основной БД во всех процессах).
+    [
+        'ALTER TABLE accounts ADD COLUMN primary_sticky_until TIMESTAMP WITH TIME ZONE',
+    ],
+]
+
+
+# Имя, под которым непартиционированная таблица `visited_locations` исходной схемы
+# (созданной до миграций через `create_all`) хранится, пока её строки переносятся в партиции.
+_BASELINE_VISITED_LOCATIONS = 'visited_locations_baseline'
+
+
+def _detach_baseline_visited_locations(connection) -> bool:
+    """
+    Если в БД без версии схемы `visited_locations` - обычная (не партиционированная) таблица,
+    то переименовывает её вместе с первичным ключом и последовательностью ID,
+    чтобы миграция 1 создала на её месте партиционированную таблицу.
+    Возвращает True, если таблица была переименована.
+    """
+    relkind = connection.execute(text(
+        "SELECT relkind FROM pg_class WHERE relname = 'visited_locations' AND relkind IN ('r', 'p') "
+        'AND pg_table_is_visible(oid)'
+    )).scalar()
+    if relkind != 'r':
+        return False
+    connection.execute(text(f'ALTER TABLE visited_locations RENAME TO {_BASELINE_VISITED_LOCATIONS}'))
+    connection.execute(text(f'ALTER TABLE {_BASELINE_VISITED_LOCATIONS} '
+                            f'RENAME CONSTRAINT visited_locations_pkey TO {_BASELINE_VISITED_LOCATIONS}_pkey'))
+    connection.execute(text(f'ALTER SEQUENCE IF EXISTS visited_locations_id_seq '
+                            f'RENAME TO {_BASELINE_VISITED_LOCATIONS}_id_seq'))
+    return True
+
+
+def _copy_baseline_visited_locations(connection) -> None:
+    """
+    Переносит строки исходной таблицы в партиционированную `visited_locations`
+    (создавая партиции всех встречающихся месяцев) с сохранением ID и удаляет исходную таблицу.
+    """
+    months = connection.execute(text(
+        "SELECT DISTINCT extract(year FROM visit_datetime AT TIME ZONE 'UTC')::int, "
+        "extract(month FROM visit_datetime AT TIME ZONE 'UTC')::int "
+        f'FROM {_BASELINE_VISITED_LOCATIONS}'
+    )).all()
+    for year, month in months:
+        connection.execute(text(visited_locations_partition_ddl(year, month)))
+    connection.execute(text(
+        'INSERT INTO visited_locations (id, visit_datetime, location_id) '
+        f'SELECT id, visit_datetime, location_id FROM {_BASELINE_VISITED_LOCATIONS}'
+    ))
+    connection.execute(text(
+        "SELECT setval(pg_get_serial_sequence('visited_locations', 'id'), "
+        f'(SELECT coalesce(max(id), 0) + 1 FROM {_BASELINE_VISITED_LOCATIONS}), false)'
+    ))
+    connection.execute(text(f'DROP TABLE {_BASELINE_VISITED_LOCATIONS}'))
+
+
+class SchemaVersionError(RuntimeError):
+    """Версия схемы БД не совпадает с версией, которую ожидает приложение."""
+
+
+def check_schema_version() -> None:
+    """
+    Проверяет, что схема БД находится в актуальной версии.
+    Выполняет ровно один запрос и не делает рефлексию схемы.
+    """
+    try:
+        with db.engine.connect() as connection:
+            version = connection.execute(text('SELECT version FROM schema_version')).scalar()
+    except ProgrammingError:
+        version = None
+
+    if version != len(MIGRATIONS):
+        raise SchemaVersionError(f'Версия схемы БД: {version}, ожидается: {len(MIGRATIONS)}. '
+                                 f'Выполните "python -m webapi.migrate".')
+
+
+def migrate() -> int:
+    """
+    Применяет к БД недостающие миграции в одной транзакции.
+    БД исходной схемы (таблицы без версии) переводится на партиционированную `visited_locations`.
+    Возвращает количество применённых миграций.
+    """
+    with db.engine.begin() as connection:
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), dict(key=_MIGRATION_LOCK_KEY))
+        connection.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+        version = connection.execute(text('SELECT version FROM schema_version')).scalar()
+        if version is None:
+            version = 0
+            connection.execute(text('INSERT INTO schema_version (version) VALUES (0)'))
+        # БД исходной схемы: её `visited_locations` переводится в партиционированную таблицу
+        # сразу после миграции 1 (до миграций, работающих с её строками).
+        baseline_detached = version == 0 and _detach_baseline_visited_locations(connection)
+
+        for migration_index, statements in enumerate(MIGRATIONS[version:], start=version):
+            for statement in statements:
+                connection.execute(text(statement))
+            if migration_index == 0 and baseline_detached:
+                _copy_baseline_visited_locations(connection)
+        connection.execute(text('UPDATE schema_version SET version = :version'), dict(version=len(MIGRATIONS)))
+    return len(MIGRATIONS) - version
+
+
+def drop_schema() -> None:
+    """Удаляет все таблицы приложения вместе с таблицей версии схемы."""
+    db.drop_all()
+    with db.engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS schema_version'))
@@ -0,0 +1,118 @@
+"""
+Модуль содержит функции обслуживания помесячных партиций таблицы `visited_locations`
+(создание партиций на будущие месяцы и отсоединение старых партиций).
+"""
+
+from datetime import datetime, timezone
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from webapi.db_models import db, VisitedLocation
+
+__all__ = (
+    'visited_locations_partition_ddl',
+    'ensure_visited_locations_partition',
+    'ensure_visited_locations_partitions',
+    'detach_visited_locations_partitions_before',
+    'forget_existing_visited_locations_partitions',
+)
+
+# Месяцы (год, месяц), для которых партиции уже точно существуют.
+# Позволяет не обращаться к БД перед каждой вставкой посещённой точки.
+_existing_partitions: set[tuple[int, int]] = set()
+# Сколько отдельное соединение ждёт блокировку `visited_locations` для создания партиции (в мс).
+_PARTITION_LOCK_TIMEOUT_MS = 1000
+# Код ошибки PostgreSQL "lock_not_available" (в том числе по `lock_timeout`).
+_LOCK_NOT_AVAILABLE_PGCODE = '55P03'
+
+
+def _month_start(year: int, month: int) -> datetime:
+    # Переполнение месяца переносим на следующий год (например, 13-й месяц -> январь).
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def _partition_name(year: int, month: int) -> str:
+    return f'{VisitedLocation.__tablename__}_y{year:04d}m{month:02d}'
+
+
+def visited_locations_partition_ddl(year: int, month: int) -> str:
+    """Возвращает SQL создания партиции `visited_locations` для месяца (если её нет)."""
+    start = _month_start(year, month)
+    end = _month_start(year, month + 1)
+    return (f'CREATE TABLE IF NOT EXISTS {_partition_name(year, month)} '
+            f'PARTITION OF {VisitedLocation.__tablename__} '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+
+
+def ensure_visited_locations_partition(moment: datetime) -> None:
+    """
+    Создаёт партицию `visited_locations` для месяца, в который попадает `moment` (если её нет).
+    Партиция создаётся и фиксируется на отдельном соединении, не затрагивая транзакцию сессии.
+    """
+    moment = moment.astimezone(timezone.utc)
+    if (moment.year, moment.month) in _existing_partitions:
+        return
+
+    partition_ddl = visited_locations_partition_ddl(moment.year, moment.month)
+    try:
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(f'SET LOCAL lock_timeout = {_PARTITION_LOCK_TIMEOUT_MS}')
+            connection.execute(text(partition_ddl))
+    except OperationalError as exception:
+        if getattr(exception.orig, 'pgcode', None) != _LOCK_NOT_AVAILABLE_PGCODE:
+            raise
+        # Таблицу может удерживать сама транзакция сессии (например, предыдущие операции пакета `/batch`),
+        # тогда отдельное соединение её не дождётся. Партиция создаётся в транзакции сессии
+        # и фиксируется (либо отменяется) вместе с ней, поэтому не запоминается.
+        db.session.execute(text(partition_ddl))
+        return
+    _existing_partitions.add((moment.year, moment.month))
+
+
+def forget_existing_visited_locations_partitions() -> None:
+    """
+    Сбрасывает запомненные существующие партиции. Вызывается после отмены транзакции,
+    в которой партиции могли создаваться (например, транзакции пакетного запроса `/batch`).
+    """
+    _existing_partitions.clear()
+
+
+def ensure_visited_locations_partitions(months_ahead: int) -> None:
+    """Создаёт партиции `visited_locations` для текущего месяца и `months_ahead` следующих."""
+    now = datetime.now(timezone.utc)
+    for month_offset in range(months_ahead + 1):
+        ensure_visited_locations_partition(_month_start(now.year, now.month + month_offset))
+
+
+def detach_visited_locations_partitions_before(moment: datetime) -> list[str]:
+    """
+    Отсоединяет от `visited_locations` партиции месяцев, которые целиком раньше `moment`.
+    Отсоединённые таблицы остаются в БД (их можно выгрузить в архив или удалить через DROP TABLE),
+    а ID их строк убираются из "visitedLocations" животных.
+    Возвращает имена отсоединённых таблиц.
+    """
+    moment = moment.astimezone(timezone.utc)
+    boundary = _month_start(moment.year, moment.month)
+    partition_names = db.session.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class parent ON pg_inherits.inhparent = parent.oid '
+        'JOIN pg_class child ON pg_inherits.inhrelid = child.oid '
+        'WHERE parent.relname = :table_name ORDER BY child.relname'
+    ), dict(table_name=VisitedLocation.__tablename__)).scalars().all()
+
+    detached_names = []
+    for partition_name in partition_names:
+        year, month = int(partition_name[-7:-3]), int(partition_name[-2:])
+        if _month_start(year, month + 1) > boundary:
+            continue
+        db.session.execute(text(f'ALTER TABLE {VisitedLocation.__tablename__} DETACH PARTITION {partition_name}'))
+        db.session.execute(text(
+            'UPDATE animals SET visited_locations = ARRAY('
+            f'SELECT v FROM unnest(visited_locations) v WHERE v NOT IN (SELECT id FROM {partition_name})) '
+            f'WHERE visited_locations && ARRAY(SELECT id FROM {partition_name})'
+        ))
+        _existing_partitions.discard((year, month))
+        detached_names.append(partition_name)
+    db.session.commit()
+    return detached_names
@@ -0,0 +1,121 @@
+"""
+Модуль содержит профилирование отдельных запросов по требованию.
+Запрос профилируется, если в нём передан заголовок "X-Profile-Token" со значением
+`PROFILING_TOKEN`, либо если он попал в случайную выборку с долей `PROFILING_SAMPLE_RATE`.
+Профиль - стеки вызовов потока запроса, снимаемые с интервалом `PROFILING_INTERVAL_MS`,
+в формате collapsed stacks (вход для flamegraph.pl, speedscope и т.п.).
+Профили сохраняются в каталог `PROFILING_DIR` (общий для всех процессов приложения)
+и доступны через `/admin/profiles` с тем же заголовком.
+Если ни токен, ни доля выборки не заданы, то модуль ничего не подключает к приложению.
+"""
+
+import contextlib
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http import HTTPStatus
+from flask import Flask, Response, abort, current_app, jsonify, request, send_from_directory
+
+__all__ = (
+    'has_valid_profile_token',
+    'init_profiling',
+)
+
+PROFILE_TOKEN_HEADER = 'X-Profile-Token'
+# Расширение файлов профилей.
+_PROFILE_SUFFIX = '.collapsed'
+
+
+class _StackSampler(threading.Thread):
+    """Поток, периодически снимающий стек вызовов другого потока."""
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames_names = []
+            while frame is not None:
+                code = frame.f_code
+                frames_names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if frames_names:
+                self.stacks[';'.join(reversed(frames_names))] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+def has_valid_profile_token() -> bool:
+    """Проверяет заголовок "X-Profile-Token" запроса (он же открывает доступ к служебным URN'ам /admin)."""
+    token = current_app.config['PROFILING_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get(PROFILE_TOKEN_HEADER, ''), token)
+
+
+def _start_profiling() -> None:
+    if request.path.startswith('/admin/profiles'):
+        return
+    if has_valid_profile_token() or random.random() < current_app.config['PROFILING_SAMPLE_RATE']:
+        sampler = _StackSampler(threading.get_ident(), current_app.config['PROFILING_INTERVAL_MS'] / 1000)
+        request.environ['webapi.stack_sampler'] = (sampler, time.perf_counter())
+        sampler.start()
+
+
+def _stop_profiling(exception: BaseException | None) -> None:
+    if 'webapi.stack_sampler' not in request.environ:
+        return
+    sampler, started_at = request.environ.pop('webapi.stack_sampler')
+    sampler.stop()
+    duration_ms = (time.perf_counter() - started_at) * 1000
+
+    profiles_dir = current_app.config['PROFILING_DIR']
+    path_slug = request.path.strip('/').replace('/', '_') or 'root'
+    file_name = f'{time.time_ns() // 1_000_000}-{request.method}-{path_slug}-{duration_ms:.0f}ms{_PROFILE_SUFFIX}'
+    with open(os.path.join(profiles_dir, file_name), 'w', encoding='utf-8') as file:
+        file.writelines(f'{stack} {count}\n' for stack, count in sampler.stacks.items())
+
+    # Храним только последние `PROFILING_MAX_PROFILES` профилей.
+    file_names = sorted(name for name in os.listdir(profiles_dir) if name.endswith(_PROFILE_SUFFIX))
+    # Старый профиль мог уже удалить параллельный запрос.
+    for old_file_name in file_names[:-current_app.config['PROFILING_MAX_PROFILES']]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(profiles_dir, old_file_name))
+
+
+def _profiles_list() -> Response:
+    """Выдаёт список сохранённых профилей (сначала новые)."""
+    if not has_valid_profile_token():
+        abort(HTTPStatus.FORBIDDEN)
+    profiles_dir = current_app.config['PROFILING_DIR']
+    file_names = sorted((name for name in os.listdir(profiles_dir) if name.endswith(_PROFILE_SUFFIX)),
+                        reverse=True)
+    return jsonify([dict(name=name, size=os.path.getsize(os.path.join(profiles_dir, name)))
+                    for name in file_names])
+
+
+def _profile(name: str) -> Response:
+    """Выдаёт профиль в формате collapsed stacks."""
+    if not has_valid_profile_token():
+        abort(HTTPStatus.FORBIDDEN)
+    return send_from_directory(current_app.config['PROFILING_DIR'], name, mimetype='text/plain')
+
+
+def init_profiling(app: Flask) -> None:
+    """Подключает профилирование запросов, если оно включено в настройках приложения."""
+    if not app.config['PROFILING_TOKEN'] and not app.config['PROFILING_SAMPLE_RATE']:
+        return
+    os.makedirs(app.config['PROFILING_DIR'], exist_ok=True)
+    app.before_request(_start_profiling)
+    app.teardown_request(_stop_profiling)
+    app.add_url_rule('/admin/profiles', view_func=_profiles_list, methods=['GET'])
+    app.add_url_rule('/admin/profiles/<name>', view_func=_profile, methods=['GET'])
@@ -0,0 +1,11 @@
+"""
+Полностью пересчитывает счётчики тепловой карты (`heatmap_counts`) по данным БД.
+Нужен после миграции, создающей таблицу счётчиков, и после отсоединения старых партиций.
+Пример: python -m webapi.recompute_heatmap
+"""
+
+from webapi.__init__ import configure_app_and_db
+from webapi.heatmap import recompute_heatmap
+
+configure_app_and_db()
+print(f'Строк счётчиков: {recompute_heatmap()}')
@@ -1,5 +1,8 @@
-from webapi.__init__ import db, app, configure_app_and_db
+from webapi.__init__ import app, configure_app_and_db
+from webapi.migrations import migrate, drop_schema
+from webapi.partitions import ensure_visited_locations_partitions
 
-configure_app_and_db()
-db.drop_all()
-db.create_all()
+configure_app_and_db(check_schema=False)
+drop_schema()
+migrate()
+ensure_visited_locations_partitions(app.config['VISITED_LOCATIONS_PARTITIONS_AHEAD'])
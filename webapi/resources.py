@@ -2,15 +2,36 @@
 Модуль содержит обработчики различных URN'ов приложения (подклассы `Resource`).
 """
 
-from flask_restful import Api, Resource, abort, marshal_with
+import heapq
+import json
+import os
+from flask import Response, current_app, send_file, stream_with_context
+from flask_restful import Api, Resource, abort, marshal, marshal_with
 from http import HTTPStatus
 from typing import Iterable
-from datetime import datetime, timezone
-from sqlalchemy import or_ as sql_or
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from sqlalchemy import any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from pydantic import ValidationError
 
 from webapi.db_models import *
 from webapi.validation_models import *
 from webapi.resources_utils import *
+from webapi.partitions import ensure_visited_locations_partition
+from webapi.events import publish_event, subscribe, unsubscribe
+from webapi.trajectory import douglas_peucker_mask, time_buckets_mask
+from webapi.search_index import animals_search_index, animal_matches_filters, publish_animals_changes
+from webapi.jobs import job_kinds, submit_job
+from webapi.job_kinds import export_file_path
+from webapi.batch import BatchOperationError, execute_batch
+from webapi.encounters import find_encounters
+from webapi.statement_cache import statement_cache
+from webapi.archive import (load_archived_animal, load_archived_visited_locations, search_archived_animals,
+                            count_archived_animals)
+from webapi.admission import HEAVY, STREAMING
+from webapi.heatmap import (HEATMAP_BASE_ZOOM, count_animals, count_chippings, count_visits, move_location_counts,
+                            tile_cells)
 
 __all__ = (
     'api',
@@ -31,15 +52,10 @@ class Registration(Resource):
         if get_authorized_account():
             abort(HTTPStatus.FORBIDDEN)
 
-        # Проверка: email не должен быть занят.
-        if not Account.query.filter_by(email=valid_json_data.email).first():
-            # Создаём новый аккаунт в БД.
-            new_account = Account(**valid_json_data.dict())
-            db.session.add(new_account)
-            db.session.commit()
-            return new_account, HTTPStatus.CREATED
-        else:
-            abort(HTTPStatus.CONFLICT)
+        # Создаём новый аккаунт в БД.
+        # Проверка: email не должен быть занят (выполняется тем же запросом).
+        new_account = insert_or_abort(Account, valid_json_data.dict())
+        return new_account, HTTPStatus.CREATED
 
 
 @resource_route(api, '/accounts/<signed_int:_id>')
@@ -47,10 +63,11 @@ class AccountsID(Resource):
 
     @marshal_with(account_resource_fields)  # Преобразование возвращаемого объекта `Account` в JSON.
     @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
     @id_validation  # Валидация входящего ID аккаунта.
     def get(self, _id: int) -> tuple[Account, HTTPStatus] | None:
         """Выдаёт аккаунт по его ID."""
-        found_account: Account = Account.query.filter_by(id=_id).first()
+        found_account: Account = load_entity(Account, _id)
         if found_account:
             return found_account, HTTPStatus.OK
         else:
@@ -65,11 +82,11 @@ class AccountsID(Resource):
             valid_json_data: AccountRegistrationOrUpdating,
             ) -> tuple[Account, HTTPStatus] | None:
         """Обновляет данные аккаунта с указанным ID."""
-        found_account: Account = Account.query.filter_by(id=_id).first()
+        found_account: Account = load_entity(Account, _id)
         # Проверка: обновлять можно только свой аккаунт.
         if found_account and found_account == authorized_account:
             # Пробуем найти аккаунт с email, который указан в `valid_json_data`.
-            account_with_auth_email = Account.query.filter_by(email=valid_json_data.email).first()
+            account_with_auth_email = find_first_by(Account, email=valid_json_data.email)
             # Если такого аккаунта нет или этот аккаунт - тот же самый, под которым
             # авторизован пользователь, то продолжим обработку.
             if (account_with_auth_email is None) or (account_with_auth_email == found_account):
@@ -88,64 +105,86 @@ class AccountsID(Resource):
                authorized_account: Account,
                ) -> tuple[dict, HTTPStatus] | None:
         """Удаляет аккаунт с указанным ID."""
-        found_account: Account = Account.query.filter_by(id=_id).first()
+        found_account: Account = load_entity(Account, _id)
         # Проверка: удалять можно только свой аккаунт.
         if found_account and found_account == authorized_account:
-            # Проверка: нельзя удалять аккаунт, который связан с животным.
-            if Animal.query.filter_by(chipper_id=found_account.id).first():
-                abort(HTTPStatus.BAD_REQUEST)
-
             # Удаляем аккаунт из БД.
+            # Проверка: нельзя удалять аккаунт, который связан с животным (обеспечивается внешним ключом).
             db.session.delete(found_account)
-            db.session.commit()
+            commit_or_abort(HTTPStatus.BAD_REQUEST)
             return dict(), HTTPStatus.OK
         else:
             return abort(HTTPStatus.FORBIDDEN)
 
 
-@resource_route(api, '/accounts/search')
+@resource_route(api, '/accounts')
+class Accounts(Resource):
+
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
+    @request_args_validation(IdsBatch)  # Валидация входящих GET-параметров.
+    def get(self, valid_args_data: IdsBatch) -> tuple[dict, HTTPStatus]:
+        """Выдаёт аккаунты с ID из "ids" (в том же порядке) и список ненайденных ID."""
+        return entities_batch(Account, account_resource_fields, valid_args_data.ids), HTTPStatus.OK
+
+
+@resource_route(api, '/accounts/search', HEAVY)
 class AccountsSearch(Resource):
 
-    @marshal_with(account_resource_fields)  # Преобразование возвращаемого списка объектов `Account` в JSON.
+    @marshal_with_sparse_fields(account_resource_fields)  # Преобразование возвращаемого списка объектов `Account` в JSON.
     @cut_results  # Срез результатов поиска.
     @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
     @request_args_validation(AccountsSearch)  # Валидация входящих GET-параметров.
     def get(self,
             valid_args_data: AccountsSearch,
-            ) -> tuple[Iterable[Account], int, int]:
-        """Производит поиск аккаунтов по параметрам."""
-        # Формируем параметры фильтрации для ORM.
-        filter_args = []
-        for param_name, value in valid_args_data.dict(exclude={'from_', 'size'},
-                                                      exclude_none=True,
-                                                      ).items():
+            ) -> tuple[Iterable[Account], int, int, dict]:
+        """
+        Производит поиск аккаунтов по параметрам.
+        Общее количество совпадений выдаётся в заголовке "X-Total-Count" (см. "countMode").
+        """
+        params = valid_args_data.dict(exclude={'from_', 'size', 'fields_', 'count_mode'}, exclude_none=True)
+
+        def build_statement():
             # Фильтрация каждого параметра происходит без учёта регистра
             # и с учётом только части значения.
-            filter_arg = getattr(Account, param_name).icontains(value)
-            filter_args.append(filter_arg)
-
-        return (Account.query.filter(*filter_args).order_by('id'),
-                valid_args_data.from_, valid_args_data.size)
+            filter_args = [getattr(Account, param_name).icontains(bindparam(param_name)) for param_name in params]
+            # Загружаем из БД только запрошенные в "fields" столбцы.
+            statement = load_only_resource_fields(select(Account), Account, account_resource_fields,
+                                                  valid_args_data.fields_)
+            return statement.where(*filter_args).order_by(Account.id)
+
+        # Выражения строятся один раз для каждого набора фильтров и "fields".
+        filtered_statement, page_statement, count_statement = search_statements(
+            ('accounts_search', tuple(params), fields_cache_key(valid_args_data.fields_)), build_statement)
+        found_accounts = db.session.execute(page_statement, dict(params, offset=valid_args_data.from_,
+                                                                 limit=valid_args_data.size)).scalars()
+        total_count = count_search_matches(valid_args_data.count_mode, filtered_statement, count_statement, params,
+                                           valid_args_data.from_ + valid_args_data.size)
+        # Срез уже выполнен в БД.
+        return found_accounts, 0, valid_args_data.size, total_count_headers(total_count)
 
 
 @resource_route(api, '/locations')
 class Locations(Resource):
 
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
+    @request_args_validation(IdsBatch)  # Валидация входящих GET-параметров.
+    def get(self, valid_args_data: IdsBatch) -> tuple[dict, HTTPStatus]:
+        """Выдаёт точки локации с ID из "ids" (в том же порядке) и список ненайденных ID."""
+        return entities_batch(Location, location_resource_fields, valid_args_data.ids), HTTPStatus.OK
+
     @marshal_with(location_resource_fields)  # Преобразование возвращаемого объекта `Location` в JSON.
     @authorization_required()  # Проверка авторизации (она обязательна).
     @request_json_validation(LocationCreatingOrUpdating)  # Валидация входящего JSON.
     def post(self, valid_json_data: LocationCreatingOrUpdating,
              ) -> tuple[Location, HTTPStatus] | None:
         """Создаёт новую точку локации."""
-        # Проверка: указанные координаты не должны быть заняты другой локацией.
-        if not Location.query.filter_by(**valid_json_data.dict()).first():
-            # Создаём новую точку в БД.
-            new_location = Location(**valid_json_data.dict())
-            db.session.add(new_location)
-            db.session.commit()
-            return new_location, HTTPStatus.CREATED
-        else:
-            abort(HTTPStatus.CONFLICT)
+        # Создаём новую точку в БД.
+        # Проверка: указанные координаты не должны быть заняты другой локацией (выполняется тем же запросом).
+        new_location = insert_or_abort(Location, valid_json_data.dict())
+        return new_location, HTTPStatus.CREATED
 
 
 @resource_route(api, '/locations/<signed_int:_id>')
@@ -153,10 +192,11 @@ class LocationsID(Resource):
 
     @marshal_with(location_resource_fields)  # Преобразование возвращаемого объекта `Location` в JSON.
     @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
     @id_validation  # Валидация входящего ID локации.
     def get(self, _id: int) -> tuple[Location, HTTPStatus] | None:
         """Выдаёт точку локации по её ID."""
-        found_location = Location.query.filter_by(id=_id).first()
+        found_location = load_entity(Location, _id)
         if found_location:
             return found_location, HTTPStatus.OK
         else:
@@ -170,15 +210,19 @@ class LocationsID(Resource):
             valid_json_data: LocationCreatingOrUpdating,
             ) -> tuple[Location, HTTPStatus] | None:
         """Обновляет координаты локации с указанным ID."""
-        found_location = Location.query.filter_by(id=_id).first()
+        found_location = load_entity(Location, _id)
         if found_location:
             # Пробуем найти локацию с указанными в `valid_json_data` координатами.
-            location_with_taken_coords = Location.query.filter_by(**valid_json_data.dict()).first()
+            location_with_taken_coords = find_first_by(Location, **valid_json_data.dict())
             # Если такой локации нет, либо это та же самая локация, которая обновляется,
             # то продолжим обработку.
             if not location_with_taken_coords or location_with_taken_coords == found_location:
-                # Обновляем точку локации в БД.
+                # Обновляем точку локации в БД и переносим её счётчики тепловой карты в новую ячейку.
+                old_coordinates = (found_location.latitude, found_location.longitude)
                 set_attrs_of_model_instance(found_location, valid_json_data.dict())
+                db.session.flush()
+                move_location_counts(found_location.id, old_coordinates,
+                                     (found_location.latitude, found_location.longitude))
                 db.session.commit()
                 return found_location, HTTPStatus.OK
             else:
@@ -190,16 +234,12 @@ class LocationsID(Resource):
     @id_validation  # Валидация входящего ID локации.
     def delete(self, _id: int) -> tuple[dict, HTTPStatus] | None:
         """Удаляет точку локации с указанным ID."""
-        found_location = Location.query.filter_by(id=_id).first()
+        found_location = load_entity(Location, _id)
         if found_location:
-            # Проверка: нельзя удалять точку локации, связанную с животным.
-            if (VisitedLocation.query.filter_by(location_id=found_location.id).first() or
-                Animal.query.filter_by(chipping_location_id=found_location.id).first()):
-                abort(HTTPStatus.BAD_REQUEST)
-
             # Удаляем точку локации из БД.
+            # Проверка: нельзя удалять точку локации, связанную с животным (обеспечивается внешними ключами).
             db.session.delete(found_location)
-            db.session.commit()
+            commit_or_abort(HTTPStatus.BAD_REQUEST)
             return dict(), HTTPStatus.OK
         else:
             abort(HTTPStatus.NOT_FOUND)
@@ -208,21 +248,23 @@ class LocationsID(Resource):
 @resource_route(api, '/animals/types')
 class AnimalsTypes(Resource):
 
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
+    @request_args_validation(IdsBatch)  # Валидация входящих GET-параметров.
+    def get(self, valid_args_data: IdsBatch) -> tuple[dict, HTTPStatus]:
+        """Выдаёт типы животных с ID из "ids" (в том же порядке) и список ненайденных ID."""
+        return entities_batch(AnimalType, animal_type_resource_fields, valid_args_data.ids), HTTPStatus.OK
+
     @marshal_with(animal_type_resource_fields)  # Преобразование возвращаемого объекта `AnimalType` в JSON.
     @authorization_required()  # Проверка авторизации (она обязательна).
     @request_json_validation(AnimalTypeCreatingOrUpdating)  # Валидация входящего JSON.
     def post(self, valid_json_data: AnimalTypeCreatingOrUpdating,
              ) -> tuple[AnimalType, HTTPStatus] | None:
         """Создаёт новый тип животного."""
-        # Проверка: указанный тип животного должен быть свободен.
-        if not AnimalType.query.filter_by(type=valid_json_data.type).first():
-            # Создаём новый тип животного в БД.
-            new_animal_type = AnimalType(**valid_json_data.dict())
-            db.session.add(new_animal_type)
-            db.session.commit()
-            return new_animal_type, HTTPStatus.CREATED
-        else:
-            abort(HTTPStatus.CONFLICT)
+        # Создаём новый тип животного в БД.
+        # Проверка: указанный тип животного должен быть свободен (выполняется тем же запросом).
+        new_animal_type = insert_or_abort(AnimalType, valid_json_data.dict())
+        return new_animal_type, HTTPStatus.CREATED
 
 
 @resource_route(api, '/animals/types/<signed_int:_id>')
@@ -230,10 +272,11 @@ class AnimalsTypesID(Resource):
 
     @marshal_with(animal_type_resource_fields)  # Преобразование возвращаемого объекта `AnimalType` в JSON.
     @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
     @id_validation  # Валидация входящего ID типа животного.
     def get(self, _id: int) -> tuple[AnimalType, HTTPStatus] | None:
         """Выдаёт тип животного по его ID."""
-        found_animal_type = AnimalType.query.filter_by(id=_id).first()
+        found_animal_type = load_entity(AnimalType, _id)
         if found_animal_type:
             return found_animal_type, HTTPStatus.OK
         else:
@@ -246,10 +289,10 @@ class AnimalsTypesID(Resource):
     def put(self, _id: int, valid_json_data: AnimalTypeCreatingOrUpdating,
             ) -> tuple[AnimalType, HTTPStatus] | None:
         """Обновляет тип животного с указанным ID."""
-        found_animal_type = AnimalType.query.filter_by(id=_id).first()
+        found_animal_type = load_entity(AnimalType, _id)
         if found_animal_type:
             # Пробуем найти уже существующий указанный тип животного.
-            animal_type_with_taken_type = AnimalType.query.filter_by(type=valid_json_data.type).first()
+            animal_type_with_taken_type = find_first_by(AnimalType, type=valid_json_data.type)
             # Если такого нет, либо он тот же самый, который обновляется,
             # то продолжим обработку.
             if not animal_type_with_taken_type or animal_type_with_taken_type == found_animal_type:
@@ -266,7 +309,7 @@ class AnimalsTypesID(Resource):
     @id_validation  # Валидация входящего ID типа животного.
     def delete(self, _id: int) -> tuple[dict, HTTPStatus] | None:
         """Удаляет тип животного с указанным ID."""
-        found_animal_type = AnimalType.query.filter_by(id=_id).first()
+        found_animal_type = load_entity(AnimalType, _id)
         if found_animal_type:
             # Проверка: нельзя удалять тип, если он есть у хотя бы одного животного.
             if Animal.query.filter(Animal.animal_types.contains([_id])).first():
@@ -283,6 +326,13 @@ class AnimalsTypesID(Resource):
 @resource_route(api, '/animals')
 class Animals(Resource):
 
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
+    @request_args_validation(IdsBatch)  # Валидация входящих GET-параметров.
+    def get(self, valid_args_data: IdsBatch) -> tuple[dict, HTTPStatus]:
+        """Выдаёт животных с ID из "ids" (в том же порядке) и список ненайденных ID."""
+        return entities_batch(Animal, animal_resource_fields, valid_args_data.ids), HTTPStatus.OK
+
     @marshal_with(animal_resource_fields)  # Преобразование возвращаемого объекта `Animal` в JSON.
     @authorization_required()  # Проверка авторизации (она обязательна).
     @request_json_validation(AnimalCreating)  # Валидация входящего JSON.
@@ -293,16 +343,15 @@ class Animals(Resource):
         if len(valid_json_data.animal_types) != len(set(valid_json_data.animal_types)):
             abort(HTTPStatus.CONFLICT)
 
-        # Проверка: каждый ID в "animalTypes" должен существовать.
-        for type_id in valid_json_data.animal_types:
-            if not AnimalType.query.filter_by(id=type_id).first():
-                abort(HTTPStatus.NOT_FOUND)
+        # Проверка: каждый ID в "animalTypes" должен существовать (один запрос на все ID).
+        if None in get_entity_loader().load_many(AnimalType, valid_json_data.animal_types):
+            abort(HTTPStatus.NOT_FOUND)
 
         # Проверка: аккаунт с ID = "chipperId" должен существовать.
-        if not Account.query.filter_by(id=valid_json_data.chipper_id).first():
+        if not load_entity(Account, valid_json_data.chipper_id):
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: локация с ID = "chippingLocationId" должна существовать.
-        elif not Location.query.filter_by(id=valid_json_data.chipping_location_id).first():
+        elif not load_entity(Location, valid_json_data.chipping_location_id):
             abort(HTTPStatus.NOT_FOUND)
         else:
             new_animal_data_dict = valid_json_data.dict()
@@ -312,7 +361,11 @@ class Animals(Resource):
             # Добавляем животное в БД.
             new_animal = Animal(**new_animal_data_dict)
             db.session.add(new_animal)
+            count_chippings([new_animal])
+            db.session.flush()
+            publish_animals_changes(upserted=[new_animal])
             db.session.commit()
+            animals_search_index.upsert(new_animal)
             return new_animal, HTTPStatus.CREATED
 
 
@@ -321,10 +374,11 @@ class AnimalsID(Resource):
 
     @marshal_with(animal_resource_fields)  # Преобразование возвращаемого объекта `Animal` в JSON.
     @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
     @id_validation  # Валидация входящего ID животного.
     def get(self, _id: int) -> tuple[Animal, HTTPStatus] | None:
-        """Выдаёт животное по его ID."""
-        found_animal = Animal.query.filter_by(id=_id).first()
+        """Выдаёт животное по его ID (в том числе перенесённое в холодный архив)."""
+        found_animal = load_entity(Animal, _id) or load_archived_animal(_id)
         if found_animal:
             return found_animal, HTTPStatus.OK
         else:
@@ -339,18 +393,17 @@ class AnimalsID(Resource):
             ) -> tuple[Animal, HTTPStatus] | None:
         """Обновляет данные животного с указанным ID."""
         # Проверка: аккаунт с ID = "chipperId" должен существовать.
-        if not Account.query.filter_by(id=valid_json_data.chipper_id).first():
+        if not load_entity(Account, valid_json_data.chipper_id):
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: локация с ID = "chippingLocationId" должна существовать.
-        elif not Location.query.filter_by(id=valid_json_data.chipping_location_id).first():
+        elif not load_entity(Location, valid_json_data.chipping_location_id):
             abort(HTTPStatus.NOT_FOUND)
 
-        found_animal: Animal = Animal.query.filter_by(id=_id).first()
+        found_animal: Animal = load_entity(Animal, _id)
         if found_animal:
             # Проверка: новая точка чипирования не должна совпадать с первой посещённой.
             if len(found_animal.visited_locations) > 0:
-                if valid_json_data.chipping_location_id == VisitedLocation.query.filter_by(
-                        id=found_animal.visited_locations[0]).first().location_id:
+                if valid_json_data.chipping_location_id == load_entity(VisitedLocation, found_animal.visited_locations[0]).location_id:
                     abort(HTTPStatus.BAD_REQUEST)
             new_animal_data_dict = valid_json_data.dict()
             # Проверка: нельзя сменять статус "DEAD" на "ALIVE".
@@ -361,9 +414,20 @@ class AnimalsID(Resource):
             if found_animal.life_status == 'ALIVE' and valid_json_data.life_status == 'DEAD':
                 new_animal_data_dict['death_datetime'] = datetime.now(timezone.utc)
 
-            # Обновляем животное в БД.
+            # Обновляем животное в БД (и переносим чипирование на тепловой карте, если сменилась точка).
+            chipping_location_changed = found_animal.chipping_location_id != valid_json_data.chipping_location_id
+            if chipping_location_changed:
+                count_chippings([found_animal], -1)
             set_attrs_of_model_instance(found_animal, new_animal_data_dict)
+            if chipping_location_changed:
+                count_chippings([found_animal])
+            # Список "visitedLocations" в событие не входит: он не меняется этим запросом
+            # и у давно отслеживаемых животных не помещается в сообщение NOTIFY.
+            publish_event('animalUpdated', found_animal.id, [found_animal.chipping_location_id],
+                          marshal(found_animal, animal_event_fields))
+            publish_animals_changes(upserted=[found_animal])
             db.session.commit()
+            animals_search_index.upsert(found_animal)
             return found_animal, HTTPStatus.OK
         else:
             abort(HTTPStatus.NOT_FOUND)
@@ -372,51 +436,180 @@ class AnimalsID(Resource):
     @id_validation  # Валидация входящего ID животного.
     def delete(self, _id: int) -> tuple[dict, HTTPStatus] | None:
         """Удаляет животное с указанным ID."""
-        found_animal = Animal.query.filter_by(id=_id).first()
+        found_animal = load_entity(Animal, _id)
         if found_animal:
             # Проверка: для удаления животное должно находиться в точке чипирования.
             if len(found_animal.visited_locations) > 0:
-                if VisitedLocation.query.filter_by(
-                        id=found_animal.visited_locations[-1]).first().location_id != found_animal.chipping_location_id:
+                if load_entity(VisitedLocation, found_animal.visited_locations[-1]).location_id != found_animal.chipping_location_id:
                     abort(HTTPStatus.BAD_REQUEST)
 
             # Удаляем животное из БД.
+            count_animals([found_animal], -1)
             db.session.delete(found_animal)
+            publish_animals_changes(removed_ids=[_id])
             db.session.commit()
+            animals_search_index.remove(_id)
             return dict(), HTTPStatus.OK
         else:
             abort(HTTPStatus.NOT_FOUND)
 
 
-@resource_route(api, '/animals/search')
+@resource_route(api, '/animals/search', HEAVY)
 class AnimalsSearch(Resource):
 
-    @marshal_with(animal_resource_fields)  # Преобразование возвращаемого списка объектов `Animal` в JSON.
+    @marshal_with_sparse_fields(animal_resource_fields)  # Преобразование возвращаемого списка объектов `Animal` в JSON.
     @cut_results  # Срез результатов поиска.
     @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
     @request_args_validation(AnimalsSearch)  # Валидация входящих GET-параметров.
     def get(self, valid_args_data: AnimalsSearch,
-            ) -> tuple[Iterable[Animal], int, int]:
-        """Производит поиск животных по параметрам."""
-        # Формируем параметры фильтрации для ORM.
-        filter_args = []
-        # Обрабатываем "startDateTime" и "endDateTime" отдельно от остальных параметров.
-        if valid_args_data.start_datetime:
-            # Дата от (включительно).
-            filter_args.append(Animal.chipping_datetime >= valid_args_data.start_datetime)
-        if valid_args_data.end_datetime:
-            # Дата до (включительно).
-            filter_args.append(Animal.chipping_datetime <= valid_args_data.end_datetime)
-        for param_name, value in valid_args_data.dict(exclude={'from_', 'size',
-                                                               'start_datetime', 'end_datetime'},
-                                                      exclude_none=True,
-                                                      ).items():
-            # Остальные значения должны быть строго равны указанным.
-            filter_arg = getattr(Animal, param_name) == value
-            filter_args.append(filter_arg)
+            ) -> tuple[Iterable[Animal], int, int, dict]:
+        """
+        Производит поиск животных по параметрам.
+        Общее количество совпадений выдаётся в заголовке "X-Total-Count" (см. "countMode").
+        """
+        # Если включён колоночный индекс в памяти и он не устарел, то ищем по нему,
+        # а из БД загружаем только животных запрошенной страницы.
+        if current_app.config['ANIMALS_SEARCH_INDEX_ENABLED'] and not valid_args_data.include_archived:
+            if animals_search_index.is_fresh(current_app.config['ANIMALS_SEARCH_INDEX_MAX_AGE_SECONDS']):
+                filters = valid_args_data.dict(exclude={'from_', 'size', 'fields_', 'include_archived', 'count_mode'})
+                found_ids = animals_search_index.search(**filters)
+                page_ids = found_ids[valid_args_data.from_:valid_args_data.from_ + valid_args_data.size].tolist()
+                found_animals = get_entity_loader().load_many(Animal, page_ids)
+                # Проверка страницы по данным БД: изменение, уведомление о котором ещё не дошло
+                # до индекса, приводит к поиску через SQL (и перестроению индекса).
+                if all(animal is not None and animal_matches_filters(animal, **filters)
+                       for animal in found_animals):
+                    # Точное количество совпадений по индексу известно без дополнительных затрат.
+                    total_count = None if valid_args_data.count_mode == 'none' else (len(found_ids), 'exact')
+                    return found_animals, 0, valid_args_data.size, total_count_headers(total_count)
+                animals_search_index.invalidate()
+            animals_search_index.rebuild_in_background(current_app._get_current_object())
+
+        params = valid_args_data.dict(exclude={'from_', 'size', 'fields_', 'include_archived', 'count_mode'},
+                                      exclude_none=True)
+
+        def build_statement():
+            # Формируем параметры фильтрации для ORM.
+            filter_args = []
+            for param_name in params:
+                if param_name == 'start_datetime':
+                    # Дата от (включительно).
+                    filter_args.append(Animal.chipping_datetime >= bindparam(param_name))
+                elif param_name == 'end_datetime':
+                    # Дата до (включительно).
+                    filter_args.append(Animal.chipping_datetime <= bindparam(param_name))
+                else:
+                    # Остальные значения должны быть строго равны указанным.
+                    filter_args.append(getattr(Animal, param_name) == bindparam(param_name))
+            # Загружаем из БД только запрошенные в "fields" столбцы.
+            statement = load_only_resource_fields(select(Animal), Animal, animal_resource_fields,
+                                                  valid_args_data.fields_)
+            return statement.where(*filter_args).order_by(Animal.id)
+
+        # Выражения строятся один раз для каждого набора фильтров и "fields".
+        filtered_statement, page_statement, count_statement = search_statements(
+            ('animals_search', tuple(params), fields_cache_key(valid_args_data.fields_)), build_statement)
+        total_count = count_search_matches(valid_args_data.count_mode, filtered_statement, count_statement, params,
+                                           valid_args_data.from_ + valid_args_data.size)
+        if valid_args_data.include_archived:
+            # Берём из БД и из архива по первые "from" + "size" животных и объединяем их по возрастанию ID.
+            limit = valid_args_data.from_ + valid_args_data.size
+            found_animals = db.session.execute(page_statement, dict(params, offset=0, limit=limit)).scalars()
+            archived_animals = search_archived_animals(limit, **params)
+            if total_count is not None:
+                total_count = (total_count[0] + count_archived_animals(**params), total_count[1])
+            return (heapq.merge(found_animals, archived_animals, key=lambda animal: animal.id),
+                    valid_args_data.from_, valid_args_data.size, total_count_headers(total_count))
+        found_animals = db.session.execute(page_statement, dict(params, offset=valid_args_data.from_,
+                                                                limit=valid_args_data.size)).scalars()
+        # Срез уже выполнен в БД.
+        return found_animals, 0, valid_args_data.size, total_count_headers(total_count)
+
+
+@resource_route(api, '/animals/events', None)  # Долгие подписки не ограничиваются.
+class AnimalsEvents(Resource):
+
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @request_args_validation(AnimalEventsSubscription)  # Валидация входящих GET-параметров.
+    def get(self, valid_args_data: AnimalEventsSubscription) -> Response:
+        """
+        Выдаёт поток событий (Server-Sent Events) об изменениях и перемещениях животных
+        с ID из "animalIds" и/или в точках локации с ID из "locationPointIds".
+        """
+        subscription = subscribe(valid_args_data.animal_ids, valid_args_data.location_ids,
+                                 current_app.config['EVENTS_CLIENT_BUFFER_SIZE'])
+        keepalive_seconds = current_app.config['EVENTS_KEEPALIVE_SECONDS']
+
+        def generate_events():
+            try:
+                while True:
+                    event = subscription.get(keepalive_seconds)
+                    if event is None:
+                        # Комментарий позволяет обнаружить отключение клиента, даже если событий нет.
+                        yield ': keepalive\n\n'
+                    else:
+                        yield f'event: {event["event"]}\ndata: {json.dumps(event)}\n\n'
+            finally:
+                unsubscribe(subscription)
+
+        return Response(generate_events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+
+@resource_route(api, '/animals/encounters', STREAMING)
+class AnimalsEncounters(Resource):
+
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
+    @request_args_validation(EncountersSearch)  # Валидация входящих GET-параметров.
+    def get(self, valid_args_data: EncountersSearch) -> Response | None:
+        """
+        Выдаёт потоком (JSON Lines) встречи животных: пары посещений одной точки локации
+        разными животными с разницей во времени не больше "windowSeconds".
+        Необязательные фильтры: диапазон даты и времени, точка локации и тип животных.
+        """
+        # Проверка: тип животного с ID = "animalTypeId" должен существовать.
+        if valid_args_data.animal_type_id and not load_entity(AnimalType, valid_args_data.animal_type_id):
+            abort(HTTPStatus.NOT_FOUND)
+
+        encounters = find_encounters(timedelta(seconds=valid_args_data.window_seconds),
+                                     **valid_args_data.dict(exclude={'window_seconds'}))
 
-        return (Animal.query.filter(*filter_args).order_by('id'),
-                valid_args_data.from_, valid_args_data.size)
+        def generate_lines():
+            for location_id, *visits in encounters:
+                encounter = dict(locationPointId=location_id,
+                                 visits=[dict(animalId=animal_id,
+                                              visitedLocationPointId=visited_location_id,
+                                              dateTimeOfVisitLocationPoint=visit_datetime.isoformat())
+                                         for visited_location_id, visit_datetime, animal_id in visits])
+                yield json.dumps(encounter) + '\n'
+
+        return Response(stream_with_context(generate_lines()), mimetype='application/jsonl')
+
+
+@resource_route(api, '/heatmap/<signed_int:z>/<signed_int:x>/<signed_int:y>', HEAVY)
+class Heatmap(Resource):
+
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
+    @request_args_validation(HeatmapTile)  # Валидация входящих GET-параметров.
+    def get(self, z: int, x: int, y: int, valid_args_data: HeatmapTile) -> tuple[dict, HTTPStatus] | None:
+        """
+        Выдаёт тепловую карту тайла z/x/y: количество посещений и чипирований животных
+        по ячейкам тайла (2^"resolution" ячеек по каждой стороне).
+        Необязательные фильтры: диапазон даты и времени (с точностью до дня) и тип животных.
+        """
+        # Проверка: тайл должен существовать, а его ячейки - быть не мельче ячеек хранимой сетки.
+        if not (0 <= z and z + valid_args_data.resolution <= HEATMAP_BASE_ZOOM and
+                0 <= x < 1 << z and 0 <= y < 1 << z):
+            abort(HTTPStatus.BAD_REQUEST)
+        # Проверка: тип животного с ID = "animalTypeId" должен существовать.
+        if valid_args_data.animal_type_id and not load_entity(AnimalType, valid_args_data.animal_type_id):
+            abort(HTTPStatus.NOT_FOUND)
+
+        cells = tile_cells(z, x, y, **valid_args_data.dict())
+        return dict(z=z, x=x, y=y, resolution=valid_args_data.resolution, cells=cells), HTTPStatus.OK
 
 
 @resource_route(api, '/animals/<signed_int:animal_id>/types/<signed_int:animal_type_id>')
@@ -427,12 +620,12 @@ class AnimalsIDTypesID(Resource):
     @ids_validation('animal_id', 'animal_type_id')  # Валидация входящих ID животного и его типа.
     def post(self, animal_id: int, animal_type_id: int) -> tuple[Animal, HTTPStatus] | None:
         """Добавляем тип с указанным ID животному с указанным ID."""
-        found_animal: Animal = Animal.query.filter_by(id=animal_id).first()
+        found_animal: Animal = load_entity(Animal, animal_id)
         # Проверка: животное с указанным ID должно существовать в БД.
         if not found_animal:
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: тип животного с указанным ID должен существовать в БД.
-        if not AnimalType.query.filter_by(id=animal_type_id).first():
+        if not load_entity(AnimalType, animal_type_id):
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: указанного ID типа животного не должно быть в "animalTypes" животного.
         if animal_type_id in found_animal.animal_types:
@@ -440,6 +633,7 @@ class AnimalsIDTypesID(Resource):
 
         # Добавляем новый тип животному и обновляем БД.
         found_animal.animal_types = [*found_animal.animal_types, animal_type_id]
+        count_animals([found_animal], 1, [animal_type_id])
         db.session.commit()
         return found_animal, HTTPStatus.CREATED
 
@@ -448,12 +642,12 @@ class AnimalsIDTypesID(Resource):
     @ids_validation('animal_id', 'animal_type_id')  # Валидация входящих ID животного и его типа.
     def delete(self, animal_id: int, animal_type_id: int) -> tuple[dict, HTTPStatus] | None:
         """Удаляет тип с указанным ID у животного с указанным ID."""
-        found_animal: Animal = Animal.query.filter_by(id=animal_id).first()
+        found_animal: Animal = load_entity(Animal, animal_id)
         # Проверка: животное с указанным ID должно существовать в БД.
         if not found_animal:
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: тип животного с указанным ID должен существовать в БД.
-        if not AnimalType.query.filter_by(id=animal_type_id).first():
+        if not load_entity(AnimalType, animal_type_id):
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: указанный ID типа животного должен быть в "animalTypes" животного.
         if animal_type_id not in found_animal.animal_types:
@@ -466,6 +660,7 @@ class AnimalsIDTypesID(Resource):
         updated_animal_types = list(found_animal.animal_types)
         updated_animal_types.remove(animal_type_id)
         found_animal.animal_types = updated_animal_types
+        count_animals([found_animal], -1, [animal_type_id])
         db.session.commit()
         return found_animal, HTTPStatus.OK
 
@@ -481,13 +676,13 @@ class AnimalsIDTypes(Resource):
             valid_json_data: AnimalTypeUpdatingForAnimal,
             ) -> tuple[Animal, HTTPStatus] | None:
         """Обновляет тип у животного с указанным ID."""
-        found_animal: Animal = Animal.query.filter_by(id=_id).first()
+        found_animal: Animal = load_entity(Animal, _id)
         # Проверка: животное с указанным ID должно существовать в БД.
         if not found_animal:
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: старый и новый типы должны существовать в БД.
-        if (not AnimalType.query.filter_by(id=valid_json_data.old_type_id).first() or
-            not AnimalType.query.filter_by(id=valid_json_data.new_type_id).first()):
+        if (not load_entity(AnimalType, valid_json_data.old_type_id) or
+            not load_entity(AnimalType, valid_json_data.new_type_id)):
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: старый тип должен быть в списке "animalTypes".
         if valid_json_data.old_type_id not in found_animal.animal_types:
@@ -501,6 +696,8 @@ class AnimalsIDTypes(Resource):
         updated_animal_types.remove(valid_json_data.old_type_id)
         updated_animal_types.append(valid_json_data.new_type_id)
         found_animal.animal_types = updated_animal_types
+        count_animals([found_animal], -1, [valid_json_data.old_type_id])
+        count_animals([found_animal], 1, [valid_json_data.new_type_id])
         db.session.commit()
         return found_animal, HTTPStatus.OK
 
@@ -513,12 +710,12 @@ class AnimalsIDLocationsID(Resource):
     @ids_validation('animal_id', 'location_id')  # Валидация входящих ID животного и точки локации.
     def post(self, animal_id: int, location_id: int) -> tuple[VisitedLocation, HTTPStatus] | None:
         """Добавляет животному посещённую точку локации."""
-        found_animal: Animal = Animal.query.filter_by(id=animal_id).first()
+        found_animal: Animal = load_entity(Animal, animal_id)
         # Проверка: животное с указанным ID должно существовать в БД.
         if not found_animal:
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: локация с указанным ID должна существовать в БД.
-        if not Location.query.filter_by(id=location_id).first():
+        if not load_entity(Location, location_id):
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: нельзя добавить новую посещённую точку умершему животному.
         if found_animal.life_status == 'DEAD':
@@ -526,17 +723,26 @@ class AnimalsIDLocationsID(Resource):
         # Проверка: первая посещённая точка не должна быть равна точке чипирования.
         if not found_animal.visited_locations and location_id == found_animal.chipping_location_id:
             abort(HTTPStatus.BAD_REQUEST)
+        # Партиция текущего месяца обычно уже создана при запуске приложения. Иначе она создаётся
+        # на отдельном соединении до первого обращения запроса к `visited_locations`,
+        # чтобы транзакция запроса не удерживала блокировку таблицы, нужную для создания партиции.
+        visit_datetime = datetime.now(timezone.utc)
+        ensure_visited_locations_partition(visit_datetime)
         # Проверка: новая точка не должна быть равна точке, в которой животное уже находится.
         if found_animal.visited_locations:
-            if VisitedLocation.query.filter_by(id=found_animal.visited_locations[-1]).first().location_id == location_id:
+            if load_entity(VisitedLocation, found_animal.visited_locations[-1]).location_id == location_id:
                 abort(HTTPStatus.BAD_REQUEST)
 
         # Добавляем новую посещённую точку в БД и указываем её для животного.
-        new_visited_location = VisitedLocation(visit_datetime=datetime.now(timezone.utc),
-                                               location_id=location_id)
+        new_visited_location = VisitedLocation(visit_datetime=visit_datetime,
+                                               location_id=location_id,
+                                               animal_id=found_animal.id)
         db.session.add(new_visited_location)
-        db.session.commit()
+        db.session.flush()
         found_animal.visited_locations = [*found_animal.visited_locations, new_visited_location.id]
+        count_visits(found_animal, [new_visited_location])
+        publish_event('visitedLocationAdded', found_animal.id, [location_id],
+                      marshal(new_visited_location, visited_location_resource_fields))
         db.session.commit()
         return new_visited_location, HTTPStatus.CREATED
 
@@ -548,12 +754,12 @@ class AnimalsIDLocationsID(Resource):
         # Во избежание путаницы переименовал ссылку.
         visited_location_id = location_id
 
-        found_animal: Animal = Animal.query.filter_by(id=animal_id).first()
+        found_animal: Animal = load_entity(Animal, animal_id)
         # Проверка: животное с указанным ID должно существовать в БД.
         if not found_animal:
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: посещённая точка с указанным ID должна существовать в БД.
-        found_visited_location: VisitedLocation = VisitedLocation.query.filter_by(id=visited_location_id).first()
+        found_visited_location: VisitedLocation = load_entity(VisitedLocation, visited_location_id)
         if not found_visited_location:
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: посещённая точка должна быть в списке "visitedLocations".
@@ -563,53 +769,79 @@ class AnimalsIDLocationsID(Resource):
         # Удаляем посещённую точку из БД и из "visitedLocations" животного.
         new_visited_locations = list(found_animal.visited_locations)
         new_visited_locations.remove(visited_location_id)
+        removed_visited_locations = [found_visited_location]
         if len(new_visited_locations) > 0:
             # Если после удаления, 0-я в списке точка равна точке чипирования, то удалим и её.
-            if VisitedLocation.query.filter_by(id=new_visited_locations[0]).first().location_id == found_animal.chipping_location_id:
+            first_visited_location = load_entity(VisitedLocation, new_visited_locations[0])
+            if first_visited_location.location_id == found_animal.chipping_location_id:
                 del new_visited_locations[0]
+                removed_visited_locations.append(first_visited_location)
         found_animal.visited_locations = new_visited_locations
+        count_visits(found_animal, removed_visited_locations, -1)
         db.session.commit()
+        publish_event('visitedLocationDeleted', found_animal.id, [found_visited_location.location_id],
+                      marshal(found_visited_location, visited_location_resource_fields))
         db.session.delete(found_visited_location)
         db.session.commit()
         return dict(), HTTPStatus.OK
 
 
-@resource_route(api, '/animals/<signed_int:_id>/locations')
+@resource_route(api, '/animals/<signed_int:_id>/locations', dict(get=HEAVY))  # Тяжёлое чтение истории посещений.
 class AnimalsIDLocations(Resource):
 
-    @marshal_with(visited_location_resource_fields)  # Преобразование возвращаемого списка объектов `VisitedLocation` в JSON.
+    @marshal_with_sparse_fields(visited_location_resource_fields)  # Преобразование возвращаемого списка объектов `VisitedLocation` в JSON.
     @cut_results  # Срез результатов поиска.
     @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо они корректны, либо их нет.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
     @id_validation  # Валидация входящего ID животного.
     @request_args_validation(VisitedLocationsSearch)  # Валидация входящих GET-параметров.
     def get(self, _id: int,
             valid_args_data: VisitedLocationsSearch,
             ) -> tuple[list[VisitedLocation], int, int] | None:
         """Выдаёт список посещённых животным точек по параметрам (диапазону даты и времени)."""
-        found_animal: Animal = Animal.query.filter_by(id=_id).first()
+        found_animal: Animal = load_entity(Animal, _id)
         # Проверка: животное с указанным ID должно существовать в БД.
         if not found_animal:
-            abort(HTTPStatus.NOT_FOUND)
+            # Иначе ищем животное и его посещённые точки в холодном архиве.
+            archived_animal = load_archived_animal(_id)
+            if not archived_animal:
+                abort(HTTPStatus.NOT_FOUND)
+            return (load_archived_visited_locations(archived_animal, valid_args_data.start_datetime,
+                                                    valid_args_data.end_datetime),
+                    valid_args_data.from_, valid_args_data.size)
 
         # Если список "visitedLocations" пуст, то соответственно вернём пустой список.
         if not found_animal.visited_locations:
             return [], valid_args_data.from_, valid_args_data.size
 
-        # Параметры фильтрации для отбора из БД посещённых точек, указанных в "visitedLocations" у животного.
-        visited_locations_filter_args = [VisitedLocation.id == __id for __id in found_animal.visited_locations]
-        # Отдельно формируем параметры для фильтрации по дате и времени.
-        datetime_filter_args = []
-        if valid_args_data.start_datetime:
-            # Дата от (включительно).
-            datetime_filter_args.append(VisitedLocation.visit_datetime >= valid_args_data.start_datetime)
-            # Дата до (включительно).
-        if valid_args_data.end_datetime:
-            datetime_filter_args.append(VisitedLocation.visit_datetime <= valid_args_data.end_datetime)
-
-        found_visited_locations = VisitedLocation.query.filter(sql_or(*visited_locations_filter_args)).filter(*datetime_filter_args)
-        return (found_visited_locations.order_by('visit_datetime'),
-                valid_args_data.from_,
-                valid_args_data.size)
+        params = valid_args_data.dict(include={'start_datetime', 'end_datetime'}, exclude_none=True)
+
+        def build_statement():
+            # Отбираем из БД посещённые точки, указанные в "visitedLocations" у животного
+            # (одним параметром-массивом, чтобы форма запроса не зависела от их количества).
+            filter_args = [VisitedLocation.id == any_(bindparam('ids', type_=ARRAY(db.Integer)))]
+            # Отдельно формируем параметры для фильтрации по дате и времени.
+            if 'start_datetime' in params:
+                # Дата от (включительно).
+                filter_args.append(VisitedLocation.visit_datetime >= bindparam('start_datetime'))
+            if 'end_datetime' in params:
+                # Дата до (включительно).
+                filter_args.append(VisitedLocation.visit_datetime <= bindparam('end_datetime'))
+            # Загружаем из БД только запрошенные в "fields" столбцы.
+            statement = load_only_resource_fields(select(VisitedLocation), VisitedLocation,
+                                                  visited_location_resource_fields, valid_args_data.fields_)
+            return (statement.where(*filter_args).order_by(VisitedLocation.visit_datetime)
+                    .offset(bindparam('offset')).limit(bindparam('limit')))
+
+        # Выражение строится один раз для каждого набора фильтров и "fields".
+        statement = statement_cache.get(('visited_locations_search', tuple(params),
+                                         fields_cache_key(valid_args_data.fields_)),
+                                        build_statement)
+        found_visited_locations = db.session.execute(statement, dict(params, ids=found_animal.visited_locations,
+                                                                     offset=valid_args_data.from_,
+                                                                     limit=valid_args_data.size)).scalars()
+        # Срез уже выполнен в БД.
+        return found_visited_locations, 0, valid_args_data.size
 
     @marshal_with(visited_location_resource_fields)  # Преобразование возвращаемого объекта `VisitedLocation` в JSON.
     @authorization_required()  # Проверка авторизации (она обязательна).
@@ -619,7 +851,7 @@ class AnimalsIDLocations(Resource):
             valid_json_data: VisitedLocationUpdating,
             ) -> tuple[VisitedLocation, HTTPStatus] | None:
         """Обновляет посещённую животным точку."""
-        found_animal: Animal = Animal.query.filter_by(id=_id).first()
+        found_animal: Animal = load_entity(Animal, _id)
         # Проверка: животное с указанным ID должно существовать в БД.
         if not found_animal:
             abort(HTTPStatus.NOT_FOUND)
@@ -627,10 +859,13 @@ class AnimalsIDLocations(Resource):
         if valid_json_data.visited_location_id not in found_animal.visited_locations:
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: заменяемая точка локации должна существовать в БД.
-        if not Location.query.filter_by(id=valid_json_data.location_id).first():
+        if not load_entity(Location, valid_json_data.location_id):
             abort(HTTPStatus.NOT_FOUND)
+        # Загружаем обновляемую посещённую точку вместе с соседними одним запросом.
+        _index = found_animal.visited_locations.index(valid_json_data.visited_location_id)
+        get_entity_loader().load_many(VisitedLocation, found_animal.visited_locations[max(_index - 1, 0):_index + 2])
         # Проверка: обновляемая посещённая точка должна существовать в БД.
-        found_visited_location: VisitedLocation = VisitedLocation.query.filter_by(id=valid_json_data.visited_location_id).first()
+        found_visited_location: VisitedLocation = load_entity(VisitedLocation, valid_json_data.visited_location_id)
         if not found_visited_location:
             abort(HTTPStatus.NOT_FOUND)
         # Проверка: если обновляется первая точка, то она не должна быть равна точке чипирования.
@@ -643,16 +878,165 @@ class AnimalsIDLocations(Resource):
 
         if len(found_animal.visited_locations) > 1:
             # Проверка: новая точка локации не должна быть такой же, как предыдущая добавленная.
-            _index = found_animal.visited_locations.index(valid_json_data.visited_location_id)
             if _index != len(found_animal.visited_locations) - 1:
-                if VisitedLocation.query.filter_by(id=found_animal.visited_locations[_index + 1]).first().location_id == valid_json_data.location_id:
+                if load_entity(VisitedLocation, found_animal.visited_locations[_index + 1]).location_id == valid_json_data.location_id:
                     abort(HTTPStatus.BAD_REQUEST)
             # Проверка: новая точка локации не должна быть такой же, как последующая добавленная.
             if _index != 0:
-                if VisitedLocation.query.filter_by(
-                        id=found_animal.visited_locations[_index - 1]).first().location_id == valid_json_data.location_id:
+                if load_entity(VisitedLocation, found_animal.visited_locations[_index - 1]).location_id == valid_json_data.location_id:
                     abort(HTTPStatus.BAD_REQUEST)
         # Обновляем посещённую точку локации.
+        old_location_id = found_visited_location.location_id
+        count_visits(found_animal, [found_visited_location], -1)
         found_visited_location.location_id = valid_json_data.location_id
+        count_visits(found_animal, [found_visited_location])
+        publish_event('visitedLocationUpdated', found_animal.id, [old_location_id, valid_json_data.location_id],
+                      marshal(found_visited_location, visited_location_resource_fields))
         db.session.commit()
         return found_visited_location, HTTPStatus.OK
+
+
+@resource_route(api, '/animals/<signed_int:_id>/trajectory', HEAVY)
+class AnimalsIDTrajectory(Resource):
+
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо они корректны, либо их нет.
+    @read_from_replica  # Чтение из реплики БД (если она настроена).
+    @id_validation  # Валидация входящего ID животного.
+    @request_args_validation(AnimalTrajectory)  # Валидация входящих GET-параметров.
+    def get(self, _id: int,
+            valid_args_data: AnimalTrajectory,
+            ) -> tuple[dict, HTTPStatus] | None:
+        """
+        Выдаёт траекторию животного (точку чипирования и посещённые точки с координатами)
+        в диапазоне даты и времени, упрощённую по интервалам времени ("bucketSeconds")
+        и/или алгоритмом Дугласа-Пекера ("tolerance" - допуск в градусах).
+        """
+        found_animal: Animal = load_entity(Animal, _id)
+        # Проверка: животное с указанным ID должно существовать в БД.
+        if not found_animal:
+            abort(HTTPStatus.NOT_FOUND)
+
+        datetime_filter_args = []
+        if valid_args_data.start_datetime:
+            datetime_filter_args.append(VisitedLocation.visit_datetime >= valid_args_data.start_datetime)
+        if valid_args_data.end_datetime:
+            datetime_filter_args.append(VisitedLocation.visit_datetime <= valid_args_data.end_datetime)
+
+        # Получаем посещённые точки вместе с координатами одним запросом.
+        rows = db.session.execute(
+            select(VisitedLocation.visit_datetime, Location.latitude, Location.longitude)
+            .join(Location, Location.id == VisitedLocation.location_id)
+            .where(VisitedLocation.id == any_(bindparam('ids', found_animal.visited_locations or [],
+                                                        type_=ARRAY(db.Integer))),
+                   *datetime_filter_args)
+            .order_by(VisitedLocation.visit_datetime)
+        ).all()
+
+        # Траектория начинается с точки чипирования (если она попадает в диапазон).
+        if ((not valid_args_data.start_datetime or found_animal.chipping_datetime >= valid_args_data.start_datetime) and
+            (not valid_args_data.end_datetime or found_animal.chipping_datetime <= valid_args_data.end_datetime)):
+            chipping_location: Location = load_entity(Location, found_animal.chipping_location_id)
+            rows.insert(0, (found_animal.chipping_datetime, chipping_location.latitude, chipping_location.longitude))
+
+        datetimes = [row[0] for row in rows]
+        timestamps = np.array([_datetime.timestamp() for _datetime in datetimes], dtype=np.float64)
+        latitudes = np.array([row[1] for row in rows], dtype=np.float64)
+        longitudes = np.array([row[2] for row in rows], dtype=np.float64)
+
+        mask = np.ones(len(rows), dtype=bool)
+        if valid_args_data.bucket_seconds:
+            mask &= time_buckets_mask(timestamps, valid_args_data.bucket_seconds)
+        if valid_args_data.tolerance is not None:
+            indexes = np.flatnonzero(mask)
+            mask[indexes] = douglas_peucker_mask(latitudes[indexes], longitudes[indexes],
+                                                 valid_args_data.tolerance)
+
+        points = [dict(datetime=datetimes[i], latitude=latitudes[i], longitude=longitudes[i])
+                  for i in np.flatnonzero(mask)]
+        return dict(totalPoints=len(rows),
+                    points=marshal(points, trajectory_point_resource_fields)), HTTPStatus.OK
+
+
+@resource_route(api, '/jobs')
+class Jobs(Resource):
+
+    @marshal_with(job_resource_fields)  # Преобразование возвращаемого объекта `Job` в JSON.
+    @authorization_required(pass_account=True)  # Проверка авторизации (она обязательна).
+    @request_json_validation(JobSubmission)  # Валидация входящего JSON.
+    def post(self, authorized_account: Account,
+             valid_json_data: JobSubmission,
+             ) -> tuple[Job, HTTPStatus] | None:
+        """Ставит в очередь фоновую задачу (её статус и результат выдаёт `/jobs/{id}`)."""
+        # Проверка: вид задачи должен существовать.
+        kind = job_kinds.get(valid_json_data.kind)
+        if not kind:
+            abort(HTTPStatus.BAD_REQUEST)
+        # Валидация параметров задачи.
+        try:
+            params = kind.params_model(**valid_json_data.params)
+        except ValidationError:
+            return abort(HTTPStatus.BAD_REQUEST)
+
+        return submit_job(kind, params, authorized_account.id), HTTPStatus.ACCEPTED
+
+
+@resource_route(api, '/jobs/<signed_int:_id>')
+class JobsID(Resource):
+
+    @marshal_with(job_resource_fields)  # Преобразование возвращаемого объекта `Job` в JSON.
+    @authorization_required(pass_account=True)  # Проверка авторизации (она обязательна).
+    @id_validation  # Валидация входящего ID задачи.
+    def get(self, _id: int,
+            authorized_account: Account,
+            ) -> tuple[Job, HTTPStatus] | None:
+        """Выдаёт статус и результат фоновой задачи."""
+        found_job: Job = load_entity(Job, _id)
+        if not found_job:
+            abort(HTTPStatus.NOT_FOUND)
+        # Проверка: просматривать можно только свои задачи.
+        if found_job.account_id != authorized_account.id:
+            abort(HTTPStatus.FORBIDDEN)
+        return found_job, HTTPStatus.OK
+
+
+@resource_route(api, '/jobs/<signed_int:_id>/file')
+class JobsIDFile(Resource):
+
+    @authorization_required(pass_account=True)  # Проверка авторизации (она обязательна).
+    @id_validation  # Валидация входящего ID задачи.
+    def get(self, _id: int,
+            authorized_account: Account,
+            ) -> Response | None:
+        """Выдаёт файл с результатом выполненной задачи выгрузки."""
+        found_job: Job = load_entity(Job, _id)
+        if not found_job:
+            abort(HTTPStatus.NOT_FOUND)
+        # Проверка: просматривать можно только свои задачи.
+        if found_job.account_id != authorized_account.id:
+            abort(HTTPStatus.FORBIDDEN)
+        # Проверка: файл есть только у выполненных задач выгрузки.
+        if found_job.kind != 'animalsExport' or found_job.status != 'DONE':
+            abort(HTTPStatus.NOT_FOUND)
+        # Проверка: файл должен быть доступен приложению (каталог `JOBS_RESULTS_DIR` общий с воркерами).
+        file_path = os.path.abspath(export_file_path(found_job))
+        if not os.path.isfile(file_path):
+            abort(HTTPStatus.NOT_FOUND)
+        return send_file(file_path, mimetype='application/jsonl')
+
+
+@resource_route(api, '/batch', HEAVY)  # Операции пакета допускаются вместе с ним.
+class Batch(Resource):
+
+    @authorization_data_must_be_valid_or_none  # Проверка авторизационных данных: либо их нет, либо они корректны.
+    @request_json_validation(BatchRequest)  # Валидация входящего JSON.
+    def post(self, valid_json_data: BatchRequest,
+             ) -> tuple[dict, HTTPStatus] | None:
+        """
+        Выполняет операции над ресурсами по порядку в одной транзакции: либо все, либо ни одной.
+        Авторизационные данные проверяются один раз и используются всеми операциями.
+        """
+        try:
+            results, status = execute_batch([operation.dict() for operation in valid_json_data.operations])
+        except BatchOperationError:
+            return abort(HTTPStatus.BAD_REQUEST)
+        return dict(results=results), status
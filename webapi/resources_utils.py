@@ -2,15 +2,26 @@
 Модуль содержит различные вспомогательные функции и объекты для модуля `resources`.
 """
 
+import itertools
 import pydantic
-from flask import request
-from flask_restful import abort, fields, Api, Resource
+from datetime import datetime, timedelta, timezone
+from flask import request, current_app
+from flask_restful import abort, fields, marshal, Api, Resource
 from http import HTTPStatus
 from pydantic import ValidationError
-from typing import Callable
+from typing import Callable, Hashable, Iterable, Mapping
 from functools import wraps
+from sqlalchemy import any_, bindparam, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query, load_only
+from sqlalchemy.sql import Select
+from sqlalchemy.orm.util import identity_key
 
 from webapi.db_models import *
+from webapi.validation_models import split_comma_separated
+from webapi.statement_cache import statement_cache
+from webapi.admission import LIGHT, admission_control
 
 __all__ = (
     'account_resource_fields',
@@ -18,18 +29,43 @@ __all__ = (
     'visited_location_resource_fields',
     'animal_type_resource_fields',
     'animal_resource_fields',
+    'animal_event_fields',
+    'trajectory_point_resource_fields',
+    'job_resource_fields',
     'resource_route',
+    'EntityLoader',
+    'get_entity_loader',
+    'load_entity',
+    'entities_batch',
+    'find_first_by',
     'get_authorized_account',
     'set_attrs_of_model_instance',
+    'commit_or_abort',
+    'insert_or_abort',
     'authorization_data_must_be_valid_or_none',
     'authorization_required',
+    'read_from_replica',
     'id_validation',
     'ids_validation',
     'request_json_validation',
     'request_args_validation',
     'cut_results',
+    'TOTAL_COUNT_HEADER',
+    'TOTAL_COUNT_MODE_HEADER',
+    'search_statements',
+    'estimate_rows_count',
+    'count_search_matches',
+    'total_count_headers',
+    'select_resource_fields',
+    'load_only_resource_fields',
+    'fields_cache_key',
+    'marshal_with_sparse_fields',
 )
 
+# Заголовки ответа поиска с общим количеством совпадений и способом его подсчёта ("exact" / "estimate").
+TOTAL_COUNT_HEADER = 'X-Total-Count'
+TOTAL_COUNT_MODE_HEADER = 'X-Total-Count-Mode'
+
 # Словари-аргументы для `@marshal_with(...)`.
 
 # Для объектов `Account`.
@@ -76,28 +112,162 @@ animal_resource_fields = {
     'deathDateTime': fields.DateTime(attribute='death_datetime', dt_format='iso8601')
 }
 
+# Для событий об изменении животного (без неограниченно растущего списка "visitedLocations").
+animal_event_fields = {name: field for name, field in animal_resource_fields.items() if name != 'visitedLocations'}
+
+# Для точек траектории животного (словарей).
+trajectory_point_resource_fields = {
+    'dateTime': fields.DateTime(attribute='datetime', dt_format='iso8601'),
+    'latitude': fields.Float,
+    'longitude': fields.Float,
+}
+
+# Для объектов `Job`.
+job_resource_fields = {
+    'id': fields.Integer,
+    'kind': fields.String,
+    'params': fields.Raw,
+    'status': fields.String,
+    'attempts': fields.Integer,
+    'result': fields.Raw,
+    'error': fields.String,
+    'createdDateTime': fields.DateTime(attribute='created_datetime', dt_format='iso8601'),
+    'finishedDateTime': fields.DateTime(attribute='finished_datetime', dt_format='iso8601'),
+}
+
 
-def resource_route(api: Api, urn: str) -> Callable:
+def resource_route(api: Api, urn: str, admission_class: str | Mapping[str, str] | None = LIGHT) -> Callable:
     """
     Синтаксический сахар, заменяющий написание "api.add_resource(Resource, URN)"
     после определения каждого класса `Resource`.
     С помощью данной функции можно декорировать классы `Resource`,
     тем самым сразу присваивая им URN'ы, которые они обрабатывают.
+    `admission_class` - класс эндпоинтов для контроля допуска запросов (см. модуль `admission`),
+    либо словарь "метод HTTP -> класс"; None - обработчики ресурса не ограничиваются.
     """
     def class_decorator(_type: type[Resource]) -> type[Resource]:
+        if admission_class is not None:
+            _type.method_decorators = [*_type.method_decorators,
+                                       admission_control(admission_class, _rate_limit_key,
+                                                         _verified_rate_limit_key)]
         api.add_resource(_type, urn)
         return _type
     return class_decorator
 
 
+def _rate_limit_key() -> Hashable | None:
+    """
+    Ключ ограничения частоты запросов до допуска: IP-адрес клиента для анонимных запросов.
+    Для запросов с авторизационными данными - None: решение о допуске не должно требовать
+    запросов к БД (в том числе чтобы транзакция запроса началась уже с ограничением времени
+    по крайнему сроку), а непроверенному email доверять нельзя.
+    """
+    if request.authorization is not None:
+        return None
+    return 'ip', request.remote_addr
+
+
+def _verified_rate_limit_key() -> Hashable:
+    """
+    Ключ ограничения частоты запросов с авторизационными данными (после допуска):
+    ID аккаунта, если данные верны, иначе - IP-адрес клиента.
+    """
+    authorized_account = get_authorized_account()
+    if authorized_account:
+        return 'account', authorized_account.id
+    return 'ip', request.remote_addr
+
+
+class EntityLoader:
+    """
+    Загрузчик объектов моделей по ID в рамках одного запроса.
+    Повторные обращения к уже загруженным объектам обслуживаются identity map сессии
+    (через `session.get(...)`) без запросов к БД, а недостающие ID загружаются
+    одним запросом `WHERE id = ANY(:ids)`. Отсутствующие в БД ID запоминаются,
+    чтобы не запрашивать их повторно.
+    """
+
+    def __init__(self) -> None:
+        self._missing: set[tuple[type[db.Model], int]] = set()
+
+    def load(self, model: type[db.Model], _id: int) -> db.Model | None:
+        return self.load_many(model, [_id])[0]
+
+    def load_many(self, model: type[db.Model], ids: Iterable[int]) -> list[db.Model | None]:
+        """
+        Возвращает объекты `model` в порядке `ids` (None - для отсутствующих в БД).
+        """
+        ids = list(ids)
+        not_loaded_ids = [_id for _id in dict.fromkeys(ids)
+                          if identity_key(model, _id) not in db.session.identity_map
+                          and (model, _id) not in self._missing]
+        if not_loaded_ids:
+            # Найденные объекты попадают в identity map сессии.
+            statement = statement_cache.get(('entities_by_ids', model), lambda: select(model).where(
+                model.id == any_(bindparam('ids', type_=ARRAY(db.Integer)))))
+            found_ids = {instance.id for instance in db.session.execute(statement,
+                                                                        dict(ids=not_loaded_ids)).scalars()}
+            self._missing.update((model, _id) for _id in not_loaded_ids if _id not in found_ids)
+
+        return [None if (model, _id) in self._missing else db.session.get(model, _id)
+                for _id in ids]
+
+    def forget_missing(self) -> None:
+        """Забывает отсутствующие ID (после изменений, которые могли создать объекты с ними)."""
+        self._missing.clear()
+
+
+def get_entity_loader() -> EntityLoader:
+    """
+    Возвращает `EntityLoader` текущего запроса (создаёт его при первом обращении).
+    Загрузчик хранится в WSGI-окружении запроса, поэтому не переживает сам запрос.
+    """
+    return request.environ.setdefault('webapi.entity_loader', EntityLoader())
+
+
+def load_entity(model: type[db.Model], _id: int) -> db.Model | None:
+    """Синтаксический сахар для `get_entity_loader().load(...)`."""
+    return get_entity_loader().load(model, _id)
+
+
+def entities_batch(model: type[db.Model], resource_fields: dict, ids: list[int]) -> dict:
+    """
+    Возвращает объекты `model` с указанными ID (одним запросом), преобразованные в JSON
+    согласно `resource_fields`, в порядке `ids`, а также список отсутствующих в БД ID.
+    """
+    found_instances = get_entity_loader().load_many(model, ids)
+    return dict(items=marshal([instance for instance in found_instances if instance is not None],
+                              resource_fields),
+                missingIds=[_id for _id, instance in zip(ids, found_instances) if instance is None])
+
+
+def find_first_by(model: type[db.Model], **values: any) -> db.Model | None:
+    """
+    Аналог `model.query.filter_by(**values).first()`, выполняющий выражение из кэша
+    (одно на модель и набор имён столбцов).
+    """
+    names = tuple(sorted(values))
+    statement = statement_cache.get(('first_by', model, names), lambda: select(model).where(
+        *[getattr(model, name) == bindparam(name) for name in names]).limit(1))
+    return db.session.execute(statement, values).scalar()
+
+
 def get_authorized_account() -> Account | None:
     """
     Возвращает объект `Account` по авторизационным данным (email + пароль).
     Иначе - None.
+    Результат запоминается на время запроса, поэтому декораторы и обработчики
+    могут вызывать функцию повторно без лишних запросов к БД.
     """
-    if request.authorization is not None:
-        return Account.query.filter_by(email=request.authorization['username'],
-                                       password=request.authorization['password']).first()
+    if request.authorization is None:
+        return None
+    if 'webapi.authorized_account_id' not in request.environ:
+        found_account = find_first_by(Account, email=request.authorization['username'],
+                                      password=request.authorization['password'])
+        request.environ['webapi.authorized_account_id'] = found_account.id if found_account else None
+    authorized_account_id = request.environ['webapi.authorized_account_id']
+    if authorized_account_id is not None:
+        return load_entity(Account, authorized_account_id)
 
 
 def authorization_data_must_be_valid_or_none(method: Callable) -> Callable:
@@ -119,6 +289,13 @@ def authorization_required(pass_account: bool = False) -> Callable:
             if not authorized_account:
                 abort(HTTPStatus.UNAUTHORIZED)
 
+            # Изменяющие запросы "привязывают" аккаунт к основной БД на некоторое время,
+            # чтобы его последующие GET-запросы видели сделанные изменения.
+            # Отметка хранится в строке аккаунта и фиксируется вместе с изменениями обработчика.
+            if request.method != 'GET':
+                authorized_account.primary_sticky_until = (
+                    datetime.now(timezone.utc) + timedelta(seconds=current_app.config['REPLICA_STICKINESS_SECONDS']))
+
             if pass_account:
                 kwargs['authorized_account'] = authorized_account
             return method(*args, **kwargs)
@@ -126,6 +303,38 @@ def authorization_required(pass_account: bool = False) -> Callable:
     return decorator
 
 
+# Счётчик для распределения запросов между репликами по кругу.
+_replica_counter = itertools.count()
+
+
+def _is_sticky_to_primary(account: Account) -> bool:
+    """
+    Проверяет отметку аккаунта о недавнем изменении данных. Аккаунт загружается
+    при проверке авторизации с основной БД, поэтому отметка видна всем процессам и узлам.
+    """
+    return (account.primary_sticky_until is not None and
+            datetime.now(timezone.utc) < account.primary_sticky_until)
+
+
+def read_from_replica(method: Callable) -> Callable:
+    """
+    Направляет запросы к БД внутри обработчика на одну из реплик (по кругу).
+    Если реплики не настроены, либо авторизованный аккаунт недавно изменял данные,
+    то используется основная БД.
+    Декоратор должен стоять после декораторов авторизации, чтобы проверка
+    авторизационных данных выполнялась на основной БД.
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        replica_bind_keys = get_replica_bind_keys()
+        authorized_account = get_authorized_account()
+        if replica_bind_keys and not (authorized_account and _is_sticky_to_primary(authorized_account)):
+            request.environ[REPLICA_BIND_KEY_ENVIRON_KEY] = replica_bind_keys[next(_replica_counter) %
+                                                                              len(replica_bind_keys)]
+        return method(*args, **kwargs)
+    return wrapper
+
+
 def id_validation(method: Callable) -> Callable:
     @wraps(method)
     def wrapper(*args, **kwargs):
@@ -178,11 +387,136 @@ def request_args_validation(model: type[pydantic.BaseModel]) -> Callable:
 def cut_results(method: Callable) -> Callable:
     @wraps(method)
     def wrapper(*args, **kwargs):
-        results, from_, size = method(*args, **kwargs)
-        return list(results)[from_:from_ + size], HTTPStatus.OK
+        # Четвёртым элементом обработчик может вернуть заголовки ответа.
+        results, from_, size, *headers = method(*args, **kwargs)
+        return list(results)[from_:from_ + size], HTTPStatus.OK, *headers
     return wrapper
 
 
+def search_statements(key: tuple, build_filtered: Callable[[], Select]) -> tuple[Select, Select, Select]:
+    """
+    Возвращает из кэша выражений (по ключу формы запроса `key`) выражения поиска:
+    отфильтрованную и упорядоченную выборку `build_filtered()`, её страницу
+    (с параметрами "offset" и "limit") и подсчёт количества совпадений.
+    """
+    filtered_statement = statement_cache.get((*key, 'filtered'), build_filtered)
+    page_statement = statement_cache.get((*key, 'page'), lambda: filtered_statement
+                                         .offset(bindparam('offset')).limit(bindparam('limit')))
+    count_statement = statement_cache.get((*key, 'count'), lambda: select(func.count())
+                                          .select_from(filtered_statement.order_by(None).subquery()))
+    return filtered_statement, page_statement, count_statement
+
+
+def estimate_rows_count(statement: Select, params: dict) -> int:
+    """Возвращает оценку планировщика Postgres (по EXPLAIN) количества строк выборки `statement`."""
+    connection = db.session.connection()
+    compiled = statement.compile(dialect=connection.dialect)
+    plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', compiled.construct_params(params)).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_search_matches(count_mode: str, filtered_statement: Select, count_statement: Select,
+                         params: dict, page_rows_count: int) -> tuple[int, str] | None:
+    """
+    Считает количество совпадений поиска согласно "countMode" и возвращает его вместе
+    со способом подсчёта ("exact" или "estimate"), либо None при "countMode" = "none" (по умолчанию).
+    В режиме "estimate" точный подсчёт выполняется, только если оценка планировщика не больше
+    `SEARCH_EXACT_COUNT_PAGE_FACTOR` x `page_rows_count` (количество строк, читаемых для страницы) -
+    тогда он сопоставим по стоимости с выборкой страницы.
+    """
+    if count_mode == 'none':
+        return None
+    if count_mode == 'estimate':
+        estimated_count = estimate_rows_count(filtered_statement, params)
+        if estimated_count > current_app.config['SEARCH_EXACT_COUNT_PAGE_FACTOR'] * page_rows_count:
+            return estimated_count, 'estimate'
+    return db.session.execute(count_statement, params).scalar(), 'exact'
+
+
+def total_count_headers(total_count: tuple[int, str] | None) -> dict[str, str]:
+    """Заголовки ответа поиска с общим количеством совпадений и способом его подсчёта."""
+    if total_count is None:
+        return {}
+    count, count_mode = total_count
+    return {TOTAL_COUNT_HEADER: str(count), TOTAL_COUNT_MODE_HEADER: count_mode}
+
+
+def select_resource_fields(resource_fields: dict, names: list[str] | None) -> dict:
+    """
+    Возвращает подмножество `resource_fields` с ключами `names` (все поля - если `names` равен None).
+    Неизвестные имена полей приводят к ответу 400.
+    """
+    if names is None:
+        return resource_fields
+    if not set(names) <= resource_fields.keys():
+        abort(HTTPStatus.BAD_REQUEST)
+    return {name: field for name, field in resource_fields.items() if name in names}
+
+
+def load_only_resource_fields(query: Query | Select, model: type[db.Model],
+                              resource_fields: dict, names: list[str] | None) -> Query | Select:
+    """
+    Ограничивает `query` загрузкой только тех столбцов `model`, которые нужны
+    для полей `names` из `resource_fields` ("fields" в GET-параметрах).
+    """
+    if names is None:
+        return query
+    columns = [getattr(model, getattr(field, 'attribute', None) or name)
+               for name, field in select_resource_fields(resource_fields, names).items()]
+    return query.options(load_only(model.id, *columns))
+
+
+def fields_cache_key(names: list[str] | None) -> frozenset[str] | None:
+    """Часть ключа кэша выражений (см. модуль `statement_cache`), зависящая от "fields"."""
+    return None if names is None else frozenset(names)
+
+
+def marshal_with_sparse_fields(resource_fields: dict) -> Callable:
+    """
+    Аналог `@marshal_with(...)`, который выдаёт только поля, перечисленные
+    в GET-параметре "fields" через запятую (либо все поля, если параметра нет).
+    """
+    def decorator(method: Callable) -> Callable:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            data, status, *headers = method(*args, **kwargs)
+            names = split_comma_separated(None, request.args.get('fields'))
+            return marshal(data, select_resource_fields(resource_fields, names)), status, *headers
+        return wrapper
+    return decorator
+
+
 def set_attrs_of_model_instance(instance: db.Model, attrs_dict: dict[str, any]) -> None:
     for column_key, value in attrs_dict.items():
         setattr(instance, column_key, value)
+
+
+def commit_or_abort(status: HTTPStatus) -> None:
+    """
+    Фиксирует транзакцию. Если БД отклоняет её из-за нарушения ограничения целостности
+    (внешнего ключа, уникальности), то откатывает транзакцию и отвечает кодом `status`.
+    """
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(status)
+
+
+def insert_or_abort(model: type[db.Model], values: dict[str, any],
+                    status: HTTPStatus = HTTPStatus.CONFLICT) -> db.Model:
+    """
+    Создаёт объект `model` одним запросом "INSERT ... ON CONFLICT DO NOTHING RETURNING ...".
+    Если вставка нарушает ограничение уникальности, то отвечает кодом `status`.
+    """
+    new_instance = db.session.execute(
+        pg_insert(model).values(**values).on_conflict_do_nothing().returning(model)
+    ).scalar()
+    if new_instance is None:
+        db.session.rollback()
+        abort(status)
+    # Отсоединяем объект от сессии, чтобы после фиксации транзакции
+    # его атрибуты не перечитывались из БД отдельным запросом.
+    db.session.expunge(new_instance)
+    db.session.commit()
+    return new_instance
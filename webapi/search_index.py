@@ -0,0 +1,257 @@
+"""
+Модуль содержит необязательный колоночный индекс животных в памяти процесса
+для поиска `/animals/search` (см. настройку `ANIMALS_SEARCH_INDEX_ENABLED`).
+Каждый столбец, участвующий в фильтрации, хранится массивом NumPy,
+а для значений пола и статуса жизни хранятся битовые маски.
+Изменения животных (в том числе сделанные другими процессами, фоновыми задачами
+и архивацией) рассылаются индексам всех процессов через канал LISTEN/NOTIFY
+`ANIMALS_CHANGES_CHANNEL` в транзакции изменения. Кроме того, индекс полностью
+перестраивается (в фоне), когда становится старше `ANIMALS_SEARCH_INDEX_MAX_AGE_SECONDS`
+или когда уведомления могли быть пропущены, - пока индекс устарел, поиск выполняется через SQL.
+"""
+
+import itertools
+import threading
+import time
+import json
+from datetime import datetime, timezone
+from typing import Iterable
+import numpy as np
+from flask import Flask
+from sqlalchemy import select
+
+from webapi.db_models import db, Animal
+from webapi.events import listen_channel, notify
+
+__all__ = (
+    'ANIMALS_CHANGES_CHANNEL',
+    'AnimalsSearchIndex',
+    'animals_search_index',
+    'publish_animals_changes',
+    'animal_matches_filters',
+)
+
+# Канал LISTEN/NOTIFY с изменениями индексируемых полей животных.
+ANIMALS_CHANGES_CHANNEL = 'animals_changes'
+# Количество изменённых животных и ID удалённых в одном сообщении
+# (сообщение NOTIFY должно быть меньше 8000 байт).
+_UPSERTED_PER_MESSAGE = 50
+_REMOVED_PER_MESSAGE = 500
+
+_GENDERS = ('MALE', 'FEMALE', 'OTHER')
+_LIFE_STATUSES = ('ALIVE', 'DEAD')
+
+# Имя массива -> тип его элементов.
+_COLUMNS_DTYPES = {
+    'id': np.int64,
+    'chipper_id': np.int64,
+    'chipping_location_id': np.int64,
+    'chipping_timestamp': np.float64,
+    # Битовая маска присутствующих (не удалённых) животных.
+    'present': np.bool_,
+    **{f'gender={gender}': np.bool_ for gender in _GENDERS},
+    **{f'life_status={life_status}': np.bool_ for life_status in _LIFE_STATUSES},
+}
+
+# Количество строк, загружаемых из БД за раз при построении индекса.
+_BUILD_CHUNK_SIZE = 100_000
+
+
+class AnimalsSearchIndex:
+    """Колоночный снимок таблицы `animals` (только столбцы, по которым идёт поиск)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._columns = {name: np.zeros(0, dtype) for name, dtype in _COLUMNS_DTYPES.items()}
+        self._size = 0
+        self._built_at: float | None = None
+        self._building = False
+        # Изменения, полученные во время перестроения (применяются к новому индексу после него).
+        self._pending_changes: list[dict] = []
+        self._listening = False
+
+    def is_fresh(self, max_age_seconds: float) -> bool:
+        return self._built_at is not None and time.monotonic() - self._built_at < max_age_seconds
+
+    def invalidate(self) -> None:
+        """Помечает индекс устаревшим (поиск пойдёт через SQL, пока индекс не перестроится)."""
+        with self._lock:
+            self._built_at = None
+
+    def _reserve(self, capacity: int) -> None:
+        """Увеличивает ёмкость массивов (с запасом, чтобы добавление было в среднем O(1))."""
+        if capacity <= len(self._columns['id']):
+            return
+        capacity = max(capacity, len(self._columns['id']) * 2, 1024)
+        for name, column in self._columns.items():
+            grown_column = np.zeros(capacity, column.dtype)
+            grown_column[:self._size] = column[:self._size]
+            self._columns[name] = grown_column
+
+    def _set_rows(self, position: int, rows: list[tuple]) -> None:
+        """Записывает строки в массивы, начиная с позиции `position` (векторно по всей пачке)."""
+        ids, genders, life_statuses, chipper_ids, chipping_location_ids, chipping_datetimes = zip(*rows)
+        rows_slice = slice(position, position + len(rows))
+        columns = self._columns
+        columns['id'][rows_slice] = ids
+        columns['chipper_id'][rows_slice] = chipper_ids
+        columns['chipping_location_id'][rows_slice] = chipping_location_ids
+        columns['chipping_timestamp'][rows_slice] = [_datetime.timestamp() for _datetime in chipping_datetimes]
+        columns['present'][rows_slice] = True
+        genders, life_statuses = np.array(genders), np.array(life_statuses)
+        for gender in _GENDERS:
+            columns[f'gender={gender}'][rows_slice] = genders == gender
+        for life_status in _LIFE_STATUSES:
+            columns[f'life_status={life_status}'][rows_slice] = life_statuses == life_status
+
+    def build(self, rows: Iterable[tuple]) -> None:
+        """
+        Полностью перестраивает индекс из строк (id, gender, life_status, chipper_id,
+        chipping_location_id, chipping_datetime), отсортированных по возрастанию id.
+        """
+        new_index = AnimalsSearchIndex()
+        rows = iter(rows)
+        while chunk := list(itertools.islice(rows, _BUILD_CHUNK_SIZE)):
+            new_index._reserve(new_index._size + len(chunk))
+            new_index._set_rows(new_index._size, chunk)
+            new_index._size += len(chunk)
+        with self._lock:
+            self._columns, self._size = new_index._columns, new_index._size
+            self._built_at = time.monotonic()
+            # Изменения, зафиксированные во время перестроения, могли не попасть в снимок БД.
+            for message in self._pending_changes:
+                self._apply_message(message)
+            self._pending_changes = []
+
+    def _upsert_row(self, values: tuple) -> None:
+        ids = self._columns['id'][:self._size]
+        position = int(np.searchsorted(ids, values[0]))
+        if position < self._size and ids[position] == values[0]:
+            self._set_rows(position, [values])
+            return
+        self._reserve(self._size + 1)
+        if position < self._size:
+            # ID меньше последнего (животное создано другим процессом позже построения индекса).
+            for column in self._columns.values():
+                column[position + 1:self._size + 1] = column[position:self._size].copy()
+        self._set_rows(position, [values])
+        self._size += 1
+
+    def _remove_row(self, animal_id: int) -> None:
+        ids = self._columns['id'][:self._size]
+        position = int(np.searchsorted(ids, animal_id))
+        if position < self._size and ids[position] == animal_id:
+            self._columns['present'][position] = False
+
+    def _apply_message(self, message: dict) -> None:
+        for animal_id, gender, life_status, chipper_id, chipping_location_id, chipping_timestamp in message['upserted']:
+            self._upsert_row((animal_id, gender, life_status, chipper_id, chipping_location_id,
+                              datetime.fromtimestamp(chipping_timestamp, timezone.utc)))
+        for animal_id in message['removed']:
+            self._remove_row(animal_id)
+
+    def apply_changes(self, message: dict) -> None:
+        """Применяет сообщение канала `ANIMALS_CHANGES_CHANNEL` (см. `publish_animals_changes`)."""
+        with self._lock:
+            if self._building:
+                self._pending_changes.append(message)
+            elif self._built_at is not None:
+                self._apply_message(message)
+
+    def upsert(self, animal: Animal) -> None:
+        """Добавляет или обновляет животное в индексе (если индекс построен)."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._upsert_row((animal.id, animal.gender, animal.life_status, animal.chipper_id,
+                              animal.chipping_location_id, animal.chipping_datetime))
+
+    def remove(self, animal_id: int) -> None:
+        """Помечает животное удалённым (если индекс построен)."""
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._remove_row(animal_id)
+
+    def search(self, start_datetime: datetime | None = None, end_datetime: datetime | None = None,
+               chipper_id: int | None = None, chipping_location_id: int | None = None,
+               life_status: str | None = None, gender: str | None = None) -> np.ndarray:
+        """Возвращает отсортированные по возрастанию ID животных, подходящих под фильтры."""
+        with self._lock:
+            columns = {name: column[:self._size] for name, column in self._columns.items()}
+            mask = columns['present'].copy()
+            if gender is not None:
+                mask &= columns[f'gender={gender}']
+            if life_status is not None:
+                mask &= columns[f'life_status={life_status}']
+            if chipper_id is not None:
+                mask &= columns['chipper_id'] == chipper_id
+            if chipping_location_id is not None:
+                mask &= columns['chipping_location_id'] == chipping_location_id
+            if start_datetime is not None:
+                mask &= columns['chipping_timestamp'] >= start_datetime.timestamp()
+            if end_datetime is not None:
+                mask &= columns['chipping_timestamp'] <= end_datetime.timestamp()
+            return columns['id'][mask]
+
+    def rebuild_in_background(self, app: Flask) -> None:
+        """
+        Запускает перестроение индекса по данным БД в отдельном потоке (если оно ещё не идёт).
+        При первом перестроении индекс начинает получать изменения из `ANIMALS_CHANGES_CHANNEL`.
+        """
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._pending_changes = []
+        if not self._listening:
+            self._listening = True
+            # После (пере)подключения к БД пропущенные изменения неизвестны - индекс перестраивается.
+            listen_channel(ANIMALS_CHANGES_CHANNEL, self.apply_changes, self.invalidate)
+
+        def rebuild() -> None:
+            try:
+                with app.app_context():
+                    rows = db.session.execute(
+                        select(Animal.id, Animal.gender, Animal.life_status, Animal.chipper_id,
+                               Animal.chipping_location_id, Animal.chipping_datetime)
+                        .order_by(Animal.id)
+                        .execution_options(yield_per=_BUILD_CHUNK_SIZE)
+                    )
+                    self.build(rows)
+            finally:
+                with self._lock:
+                    self._building = False
+                    self._pending_changes = []
+
+        threading.Thread(target=rebuild, daemon=True).start()
+
+
+animals_search_index = AnimalsSearchIndex()
+
+
+def publish_animals_changes(upserted: Iterable[Animal] = (), removed_ids: Iterable[int] = ()) -> None:
+    """
+    Рассылает индексам всех процессов изменения животных в текущей транзакции БД
+    (изменённые или созданные животные и ID удалённых). Животные должны иметь ID.
+    """
+    upserted = [(animal.id, animal.gender, animal.life_status, animal.chipper_id,
+                 animal.chipping_location_id, animal.chipping_datetime.timestamp()) for animal in upserted]
+    removed_ids = list(removed_ids)
+    for start in range(0, len(upserted), _UPSERTED_PER_MESSAGE):
+        notify(ANIMALS_CHANGES_CHANNEL, json.dumps(dict(upserted=upserted[start:start + _UPSERTED_PER_MESSAGE],
+                                                        removed=[])))
+    for start in range(0, len(removed_ids), _REMOVED_PER_MESSAGE):
+        notify(ANIMALS_CHANGES_CHANNEL, json.dumps(dict(upserted=[],
+                                                        removed=removed_ids[start:start + _REMOVED_PER_MESSAGE])))
+
+
+def animal_matches_filters(animal: Animal, start_datetime: datetime | None = None,
+                           end_datetime: datetime | None = None, **equal_values: int | str | None) -> bool:
+    """Проверяет, что животное подходит под фильтры поиска (те же, что и в `AnimalsSearchIndex.search`)."""
+    chipping_timestamp = animal.chipping_datetime.timestamp()
+    if start_datetime is not None and chipping_timestamp < start_datetime.timestamp():
+        return False
+    if end_datetime is not None and chipping_timestamp > end_datetime.timestamp():
+        return False
+    return all(value is None or getattr(animal, name) == value for name, value in equal_values.items())
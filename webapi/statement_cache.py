@@ -0,0 +1,109 @@
+"""
+Модуль содержит кэш SQL-выражений для часто выполняемых запросов обработчиков.
+Выражение `select()` строится один раз для каждой "формы" запроса (набора фильтров,
+загружаемых столбцов и т.п.), а конкретные значения передаются через `bindparam`.
+Повторное использование одного и того же объекта выражения избавляет от построения
+запроса в Python и вычисления его ключа кэша, а скомпилированный SQL берётся
+из кэша компиляции движка SQLAlchemy. Размер кэша ограничен настройкой `STATEMENT_CACHE_SIZE`
+(вытесняются давно не использованные выражения).
+Статистика попаданий обоих кэшей доступна через `/admin/statement-cache`
+с заголовком "X-Profile-Token" (см. модуль `profiling`).
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+from flask import Flask, Response, abort, jsonify
+from http import HTTPStatus
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.sql import Executable
+
+from webapi.db_models import db
+from webapi.profiling import has_valid_profile_token
+
+__all__ = (
+    'StatementCache',
+    'statement_cache',
+    'init_statement_cache',
+)
+
+
+class StatementCache:
+    """
+    Кэш построенных SQL-выражений по ключу формы запроса (LRU не более чем на `maxsize` выражений),
+    со счётчиками попаданий.
+    """
+
+    def __init__(self, maxsize: int = 1000) -> None:
+        self.maxsize = maxsize
+        self._statements: OrderedDict[Hashable, Executable] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, build: Callable[[], Executable]) -> Executable:
+        """Возвращает выражение по ключу `key`, строя его функцией `build` при первом обращении."""
+        with self._lock:
+            statement = self._statements.get(key)
+            if statement is not None:
+                self.hits += 1
+                self._statements.move_to_end(key)
+                return statement
+            self.misses += 1
+        # Выражение строится без блокировки: при гонке остаётся построенное первым.
+        statement = build()
+        with self._lock:
+            statement = self._statements.setdefault(key, statement)
+            self._statements.move_to_end(key)
+            while len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+            return statement
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            return dict(size=len(self._statements), maxsize=self.maxsize, hits=hits, misses=misses,
+                        hitRate=hits / (hits + misses) if hits + misses else None)
+
+
+statement_cache = StatementCache()
+
+# Счётчики кэша компиляции SQLAlchemy по выполненным запросам (всех движков процесса).
+_compiled_cache_counters = dict(hits=0, misses=0, uncached=0)
+_compiled_cache_counters_lock = threading.Lock()
+
+
+def _count_compiled_cache_usage(connection, cursor, statement, parameters, context, executemany) -> None:
+    if context.cache_hit is CacheStats.CACHE_HIT:
+        counter = 'hits'
+    elif context.cache_hit is CacheStats.CACHE_MISS:
+        counter = 'misses'
+    else:
+        # Текстовые запросы и выражения без ключа кэша.
+        counter = 'uncached'
+    with _compiled_cache_counters_lock:
+        _compiled_cache_counters[counter] += 1
+
+
+def _statement_cache_stats() -> Response:
+    """Выдаёт статистику попаданий в кэш выражений и в кэш компиляции SQLAlchemy."""
+    if not has_valid_profile_token():
+        abort(HTTPStatus.FORBIDDEN)
+    with _compiled_cache_counters_lock:
+        counters = dict(_compiled_cache_counters)
+    hits, misses = counters['hits'], counters['misses']
+    return jsonify(statements=statement_cache.stats(),
+                   compiledCache=dict(counters, hitRate=hits / (hits + misses) if hits + misses else None))
+
+
+def init_statement_cache(app: Flask) -> None:
+    """
+    Задаёт размер кэша выражений, подключает подсчёт попаданий в кэш компиляции
+    к движкам БД и выдачу статистики.
+    """
+    statement_cache.maxsize = app.config['STATEMENT_CACHE_SIZE']
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'after_cursor_execute', _count_compiled_cache_usage)
+    app.add_url_rule('/admin/statement-cache', view_func=_statement_cache_stats, methods=['GET'])
@@ -0,0 +1,76 @@
+"""
+Модуль содержит упрощение траектории перемещения животного
+(алгоритм Дугласа-Пекера и прореживание по интервалам времени).
+Вычисления выполняются над массивами NumPy.
+"""
+
+import numpy as np
+
+__all__ = (
+    'douglas_peucker_mask',
+    'time_buckets_mask',
+)
+
+
+def _project(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Переводит координаты в градусах в плоские (равнопромежуточная проекция):
+    долгота масштабируется на косинус средней широты, чтобы расстояния
+    по обеим осям были сопоставимы. Единица измерения - градус широты.
+    """
+    scale = np.cos(np.radians(latitudes.mean()))
+    return np.column_stack((longitudes * scale, latitudes))
+
+
+def douglas_peucker_mask(latitudes: np.ndarray, longitudes: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Возвращает маску точек, которые остаются после упрощения траектории
+    алгоритмом Дугласа-Пекера с допуском `tolerance` (в градусах широты).
+    Расстояния от точек отрезка до его хорды вычисляются векторно.
+    """
+    points_count = len(latitudes)
+    mask = np.zeros(points_count, dtype=bool)
+    if points_count == 0:
+        return mask
+    mask[[0, -1]] = True
+    points = _project(latitudes, longitudes)
+
+    # Стек отрезков (начало, конец), которые ещё нужно упростить.
+    segments = [(0, points_count - 1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        inner = points[start + 1:end]
+        chord = points[end] - points[start]
+        chord_length = np.hypot(*chord)
+        if chord_length == 0:
+            # Начало и конец отрезка совпадают - берём расстояние до этой точки.
+            distances = np.hypot(*(inner - points[start]).T)
+        else:
+            offsets = inner - points[start]
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / chord_length
+
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            mask[index] = True
+            segments.append((start, index))
+            segments.append((index, end))
+    return mask
+
+
+def time_buckets_mask(timestamps: np.ndarray, bucket_seconds: int) -> np.ndarray:
+    """
+    Возвращает маску точек, оставляющую первую точку каждого интервала времени
+    длиной `bucket_seconds` (а также последнюю точку траектории).
+    `timestamps` - отсортированные по возрастанию секунды Unix-времени.
+    """
+    mask = np.zeros(len(timestamps), dtype=bool)
+    if len(timestamps) == 0:
+        return mask
+    buckets = np.floor_divide(timestamps, bucket_seconds)
+    mask[0] = True
+    mask[1:] = buckets[1:] != buckets[:-1]
+    mask[-1] = True
+    return mask
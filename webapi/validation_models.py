@@ -16,9 +16,28 @@ __all__ = ('AccountRegistrationOrUpdating',
            'AnimalTypeUpdatingForAnimal',
            'VisitedLocationsSearch',
            'VisitedLocationUpdating',
+           'AnimalEventsSubscription',
+           'IdsBatch',
+           'AnimalTrajectory',
+           'JobSubmission',
+           'AnimalDeletionJobParams',
+           'AnimalsExportJobParams',
+           'BatchOperation',
+           'BatchRequest',
+           'EncountersSearch',
+           'HeatmapTile',
            )
 
 
+def split_comma_separated(cls, value: str | list[str] | None) -> list[str] | None:
+    """Разбивает значение вида "a,b,c" на список (используется для GET-параметра "fields")."""
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(',') if item.strip()]
+        if not value:
+            raise ValueError()
+    return value
+
+
 class AccountRegistrationOrUpdating(BaseModel):
     first_name: constr(min_length=1, strip_whitespace=True) = Field(alias='firstName')
     last_name: constr(min_length=1, strip_whitespace=True) = Field(alias='lastName')
@@ -33,9 +52,21 @@ class AccountRegistrationOrUpdating(BaseModel):
 class AccountsSearch(BaseModel):
     from_: conint(ge=0) = Field(alias='from', default=0)
     size: conint(gt=0) = Field(default=10)
+    fields_: list[str] | None = Field(alias='fields')
+
+    _split_fields = validator('fields_', pre=True, allow_reuse=True)(split_comma_separated)
     first_name: str | None = Field(alias='firstName')
     last_name: str | None = Field(alias='lastName')
     email: str | None
+    # Подсчёт общего количества совпадений (см. `count_search_matches` в модуле `resources_utils`).
+    count_mode: str = Field(alias='countMode', default='none')
+
+    @validator('count_mode')
+    def count_mode_must_be_exact_or_estimate_or_none(cls, value: str) -> str:
+        if value in ['exact', 'estimate', 'none']:
+            return value
+        else:
+            raise ValueError()
 
 
 class LocationCreatingOrUpdating(BaseModel):
@@ -91,12 +122,19 @@ class AnimalUpdating(BaseModel):
 class AnimalsSearch(BaseModel):
     from_: conint(ge=0) = Field(alias='from', default=0)
     size: conint(gt=0) = Field(default=10)
+    fields_: list[str] | None = Field(alias='fields')
+
+    _split_fields = validator('fields_', pre=True, allow_reuse=True)(split_comma_separated)
     start_datetime: datetime | None = Field(alias='startDateTime')
     end_datetime: datetime | None = Field(alias='endDateTime')
     chipper_id: conint(gt=0) | None = Field(alias='chipperId')
     chipping_location_id: conint(gt=0) | None = Field(alias='chippingLocationId')
     life_status: str | None = Field(alias='lifeStatus')
     gender: str | None
+    # Искать также среди умерших животных, перенесённых в холодный архив.
+    include_archived: bool = Field(alias='includeArchived', default=False)
+    # Подсчёт общего количества совпадений (см. `count_search_matches` в модуле `resources_utils`).
+    count_mode: str = Field(alias='countMode', default='none')
 
     @validator('life_status')
     def life_status_must_be_alive_or_dead(cls, value: str) -> str:
@@ -112,6 +150,13 @@ class AnimalsSearch(BaseModel):
         else:
             raise ValueError()
 
+    @validator('count_mode')
+    def count_mode_must_be_exact_or_estimate_or_none(cls, value: str) -> str:
+        if value in ['exact', 'estimate', 'none']:
+            return value
+        else:
+            raise ValueError()
+
 
 class AnimalTypeUpdatingForAnimal(BaseModel):
     old_type_id: conint(gt=0) = Field(alias='oldTypeId')
@@ -121,6 +166,9 @@ class AnimalTypeUpdatingForAnimal(BaseModel):
 class VisitedLocationsSearch(BaseModel):
     from_: conint(ge=0) = Field(alias='from', default=0)
     size: conint(gt=0) = Field(default=10)
+    fields_: list[str] | None = Field(alias='fields')
+
+    _split_fields = validator('fields_', pre=True, allow_reuse=True)(split_comma_separated)
     start_datetime: datetime | None = Field(alias='startDateTime')
     end_datetime: datetime | None = Field(alias='endDateTime')
 
@@ -128,3 +176,88 @@ class VisitedLocationsSearch(BaseModel):
 class VisitedLocationUpdating(BaseModel):
     visited_location_id: conint(gt=0) = Field(alias='visitedLocationPointId')
     location_id: conint(gt=0) = Field(alias='locationPointId')
+
+
+class AnimalEventsSubscription(BaseModel):
+    animal_ids: list[conint(gt=0)] | None = Field(alias='animalIds')
+    location_ids: list[conint(gt=0)] | None = Field(alias='locationPointIds')
+
+    _split_ids = validator('animal_ids', 'location_ids', pre=True, allow_reuse=True)(split_comma_separated)
+
+
+class IdsBatch(BaseModel):
+    ids: conlist(conint(gt=0), min_items=1, max_items=1000)
+
+    _split_ids = validator('ids', pre=True, allow_reuse=True)(split_comma_separated)
+
+
+class AnimalTrajectory(BaseModel):
+    start_datetime: datetime | None = Field(alias='startDateTime')
+    end_datetime: datetime | None = Field(alias='endDateTime')
+    tolerance: confloat(ge=0) | None
+    bucket_seconds: conint(gt=0) | None = Field(alias='bucketSeconds')
+
+
+class JobSubmission(BaseModel):
+    kind: str
+    params: dict = Field(default_factory=dict)
+
+
+class AnimalDeletionJobParams(BaseModel):
+    animal_id: conint(gt=0) = Field(alias='animalId')
+
+
+class AnimalsExportJobParams(BaseModel):
+    start_datetime: datetime | None = Field(alias='startDateTime')
+    end_datetime: datetime | None = Field(alias='endDateTime')
+    chipper_id: conint(gt=0) | None = Field(alias='chipperId')
+    chipping_location_id: conint(gt=0) | None = Field(alias='chippingLocationId')
+    life_status: str | None = Field(alias='lifeStatus')
+    gender: str | None
+
+    @validator('life_status')
+    def life_status_must_be_alive_or_dead(cls, value: str) -> str:
+        if value in ['ALIVE', 'DEAD']:
+            return value
+        else:
+            raise ValueError()
+
+    @validator('gender')
+    def gender_value_must_be_male_or_female_or_other(cls, value: str) -> str:
+        if value in ['MALE', 'FEMALE', 'OTHER']:
+            return value
+        else:
+            raise ValueError()
+
+
+class BatchOperation(BaseModel):
+    method: str
+    path: constr(min_length=1)
+    body: dict | list | None
+
+    @validator('method')
+    def method_must_be_supported(cls, value: str) -> str:
+        value = value.upper()
+        if value in ['GET', 'POST', 'PUT', 'DELETE']:
+            return value
+        else:
+            raise ValueError()
+
+
+class BatchRequest(BaseModel):
+    operations: conlist(BatchOperation, min_items=1, max_items=100)
+
+
+class EncountersSearch(BaseModel):
+    window_seconds: conint(gt=0) = Field(alias='windowSeconds')
+    start_datetime: datetime | None = Field(alias='startDateTime')
+    end_datetime: datetime | None = Field(alias='endDateTime')
+    location_id: conint(gt=0) | None = Field(alias='locationPointId')
+    animal_type_id: conint(gt=0) | None = Field(alias='animalTypeId')
+
+
+class HeatmapTile(BaseModel):
+    resolution: conint(ge=0, le=8) = Field(default=5)
+    start_datetime: datetime | None = Field(alias='startDateTime')
+    end_datetime: datetime | None = Field(alias='endDateTime')
+    animal_type_id: conint(gt=0) | None = Field(alias='animalTypeId')